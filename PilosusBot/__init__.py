@@ -11,6 +11,12 @@ from config import config, Config
 from celery import Celery
 from inspect import getmembers, isfunction
 from raven.contrib.flask import Sentry
+from .telegram_api import TelegramClient
+from .ratelimit import RateLimiter
+from .executor import PipelineExecutor
+from .querystats import QueryRecorder
+from .replica import ReadReplica
+from .serializers import register_serializer
 import PilosusBot.jinja_filters
 
 
@@ -28,6 +34,11 @@ login_manager.session_protection = 'strong'
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'warning'
 sentry = Sentry()
+telegram = TelegramClient()
+limiter = RateLimiter()
+executor = PipelineExecutor()
+queries = QueryRecorder()
+replica = ReadReplica()
 
 
 def create_app(config_name):
@@ -44,10 +55,16 @@ def create_app(config_name):
     mail.init_app(app)
     moment.init_app(app)
     db.init_app(app)
+    queries.init_app(app)
+    replica.init_app(app)
     login_manager.init_app(app)
     pagedown.init_app(app)
     csrf.init_app(app)
+    register_serializer(app.config['CELERY_MESSAGE_COMPRESS_MIN_BYTES'])
     celery.conf.update(app.config)
+    telegram.init_app(app)
+    limiter.init_app(app)
+    executor.init_app(app)
     sentry.init_app(app, dsn=app.config['SENTRY_DSN_SECRET'],
                     logging=app.config['SENTRY_LOGGING'],
                     level=app.config['SENTRY_LOGGING_LEVEL'])
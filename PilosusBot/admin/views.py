@@ -1,11 +1,14 @@
 from datetime import datetime
 from flask import current_app, flash, redirect, request, render_template, url_for
 from flask_login import current_user, login_required
-from ..models import Permission, Sentiment, Language
+from ..models import Permission, Sentiment, SentimentCount, Language
 from ..decorators import admin_required, permission_required
 from ..utils import lang_code_to_lang_name
+from ..pagination import KeysetPagination
 from .forms import SentimentForm, LanguageForm
-from .. import db
+from .. import db, replica
+from .. import tracing
+from .. import querystats
 from . import admin
 
 
@@ -32,15 +35,22 @@ def sentiments():
         db.session.add(sentiment)
         flash('Your sentiment has been published.', 'success')
         return redirect(url_for('.sentiments'))
-    page = request.args.get('page', 1, type=int)
-    pagination = Sentiment.query.order_by(Sentiment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['APP_ITEMS_PER_PAGE'], error_out=False
-    )
+    level = request.args.get('level', None, type=int)
+    query = replica.query(Sentiment).options(db.joinedload(Sentiment.language),
+                                             db.joinedload(Sentiment.author))
+    if level is not None:
+        query = query.filter(Sentiment.level == level)
+    pagination = KeysetPagination(query, Sentiment,
+                                  per_page=current_app.config['APP_ITEMS_PER_PAGE'],
+                                  after=request.args.get('after'),
+                                  before=request.args.get('before'),
+                                  total=SentimentCount.of(level=level))
     sentiments_paginated = pagination.items
     return render_template('admin/sentiments.html',
                            form=form,
                            sentiments=sentiments_paginated,
                            datetimepicker=datetime.utcnow(),
+                           level=level,
                            pagination=pagination)
 
 
@@ -110,9 +120,10 @@ def languages():
     #pagination = Language.query.order_by(Language.code.desc()).paginate(
     #    page, per_page=current_app.config['APP_ITEMS_PER_PAGE'], error_out=False
     #)
-    pagination = Language.query.outerjoin(Sentiment).\
+    sentiments_count = db.func.coalesce(db.func.sum(SentimentCount.count), 0)
+    pagination = replica.query(Language, sentiments_count).outerjoin(SentimentCount).\
         group_by(Language.id).\
-        order_by(db.func.count(Sentiment.id).desc()).paginate(
+        order_by(sentiments_count.desc()).paginate(
         page, per_page=current_app.config['APP_ITEMS_PER_PAGE'], error_out=False
     )
     languages_paginated = pagination.items
@@ -127,14 +138,21 @@ def languages():
 @admin_required
 def language(code):
     lang = Language.query.filter_by(code=code).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    pagination = Sentiment.query.filter_by(language=lang).paginate(
-       page, per_page=current_app.config['APP_ITEMS_PER_PAGE'], error_out=False
-    )
+    level = request.args.get('level', None, type=int)
+    query = replica.query(Sentiment).filter_by(language_id=lang.id).\
+        options(db.joinedload(Sentiment.language), db.joinedload(Sentiment.author))
+    if level is not None:
+        query = query.filter(Sentiment.level == level)
+    pagination = KeysetPagination(query, Sentiment,
+                                  per_page=current_app.config['APP_ITEMS_PER_PAGE'],
+                                  after=request.args.get('after'),
+                                  before=request.args.get('before'),
+                                  total=SentimentCount.of(lang.id, level))
     sentiments_paginated = pagination.items
     return render_template('admin/lang_sentiments.html',
                            language=lang,
                            sentiments=sentiments_paginated,
+                           level=level,
                            pagination=pagination)
 
 
@@ -146,3 +164,26 @@ def remove_language(code):
     db.session.delete(lang)
     flash('Your language and all associated sentiments have been deleted.', 'success')
     return redirect(url_for('.languages'))
+
+
+# traces
+@admin.route('/traces')
+@login_required
+@admin_required
+def traces():
+    count = current_app.config['APP_TRACE_DASHBOARD_TRACES']
+    latest = tracing.traces(current_app.config['APP_TRACE_DASHBOARD_SPANS'])
+    slowest = sorted(latest, key=lambda t: t['duration'], reverse=True)[:count]
+    return render_template('admin/traces.html',
+                           recent=latest[:count],
+                           slowest=slowest)
+
+
+# DB usage by endpoint and task
+@admin.route('/queries')
+@login_required
+@admin_required
+def queries():
+    return render_template('admin/queries.html',
+                           aggregates=querystats.aggregates(),
+                           slow_query_sec=current_app.config['APP_SLOW_QUERY_SEC'])
@@ -3,7 +3,7 @@ from flask import render_template, redirect, request, url_for, flash, \
 from flask_login import login_user, logout_user, login_required, \
     current_user
 from . import auth
-from .. import db
+from .. import db, replica
 from ..models import User, Permission, Role, Sentiment
 from ..email import send_email
 from ..decorators import permission_required, admin_required
@@ -175,7 +175,8 @@ def invite_request():
     page = request.args.get('page', 1, type=int)
     # find invited users, sort them so that unconfirmed comes first,
     # sort then all users by date
-    pagination = User.query.order_by(User.invited).\
+    pagination = replica.query(User).options(db.joinedload(User.role)).\
+                 order_by(User.invited).\
                  order_by(User.confirmed.asc()).\
                  order_by(User.member_since.desc()).paginate(
                      page, per_page=current_app.config['APP_ITEMS_PER_PAGE'],
@@ -246,7 +247,8 @@ def change_email(token):
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
     page = request.args.get('page', 1, type=int)
-    pagination = user.sentiments.order_by(Sentiment.timestamp.desc()).paginate(
+    pagination = user.sentiments.options(db.joinedload(Sentiment.language)).\
+        order_by(Sentiment.timestamp.desc()).paginate(
         page, per_page=current_app.config['APP_ITEMS_PER_PAGE'],
         error_out=False)
     sentiments = pagination.items
@@ -0,0 +1,134 @@
+"""
+Celery pool autoscaler driven by the backlog of the worker's queues.
+
+Celery's own autoscaler grows the pool up to the number of messages the worker
+has already prefetched, which says little about the backlog of a stage.
+QueueDepthAutoscaler looks at the number of messages waiting in the queues
+the worker consumes and at the worker's throughput, estimates how long
+it takes to drain the backlog (the stage latency) and resizes the pool within
+--autoscale bounds to keep it under AUTOSCALE_TARGET_LATENCY_SEC.
+
+Scaling down is done only if the latency stays below
+AUTOSCALE_TARGET_LATENCY_SEC * AUTOSCALE_SCALE_DOWN_RATIO for AUTOSCALE_COOLDOWN_SEC,
+so that the pool does not flap around the target.
+
+Enabled for the workers launched with --autoscale option:
+(venv) $ celery -A celery_launcher.celery worker -Q assess --autoscale=10,2 -l info
+"""
+
+from celery.five import monotonic
+from celery.utils.log import get_logger
+from celery.worker import state
+from celery.worker.autoscale import Autoscaler
+
+
+logger = get_logger(__name__)
+
+
+class QueueDepthAutoscaler(Autoscaler):
+    """
+    Resize the pool according to the backlog of the worker's queues.
+
+    Settings are read from the Celery app's config (updated with the Flask app's config),
+    as the autoscaler may run outside the app context.
+    """
+    def __init__(self, *args, **kwargs):
+        super(QueueDepthAutoscaler, self).__init__(*args, **kwargs)
+        conf = self.worker.app.conf
+        self.interval = conf.get('AUTOSCALE_INTERVAL_SEC', 5)
+        self.target_latency = conf.get('AUTOSCALE_TARGET_LATENCY_SEC', 5)
+        self.scale_down_ratio = conf.get('AUTOSCALE_SCALE_DOWN_RATIO', 0.25)
+        self.cooldown = conf.get('AUTOSCALE_COOLDOWN_SEC', 60)
+        self._last_check = None
+        self._last_count = None
+        self._low_since = None
+        self._connection = None
+
+    def _maybe_scale(self, req=None):
+        # called for every task message received, check the broker once in a while only
+        now = monotonic()
+        if self._last_check is not None and now - self._last_check < self.interval:
+            return False
+
+        count = state.all_total_count[0]
+        if self._last_check is None:
+            self._last_check, self._last_count = now, count
+            return False
+        rate = (count - self._last_count) / (now - self._last_check)
+        self._last_check, self._last_count = now, count
+
+        try:
+            depth = self.queue_depth()
+        except Exception as err:
+            logger.warning('Autoscaler cannot get queue depth: %r', err)
+            self._connection = None
+            return False
+
+        procs = self.processes
+        wanted = self.desired_processes(depth, rate, procs, now)
+        if wanted > procs:
+            logger.info('Autoscaler: backlog %d, %.1f tasks/s, scaling up %d -> %d processes',
+                        depth, rate, procs, wanted)
+            self.scale_up(wanted - procs)
+            return True
+        if wanted < procs:
+            logger.info('Autoscaler: backlog %d, %.1f tasks/s, scaling down %d -> %d processes',
+                        depth, rate, procs, wanted)
+            self._shrink(procs - wanted)
+            return True
+        return False
+
+    def desired_processes(self, depth, rate, procs, now):
+        """
+        Return number of processes the pool should have.
+
+        :param depth: int (messages waiting in the worker's queues)
+        :param rate: float (tasks per second the worker has been taking lately)
+        :param procs: int (current number of processes)
+        :param now: float (monotonic time)
+        :return: int
+        """
+        per_process = rate / procs if procs and rate else 0
+        if depth and not per_process:
+            # nothing done lately, but there's a backlog (e.g. pool is stuck or just started)
+            latency = float('inf')
+        else:
+            latency = depth / rate if depth else 0.0
+
+        if latency > self.target_latency:
+            self._low_since = None
+            if per_process:
+                wanted = int(-(-depth // (per_process * self.target_latency)))
+            else:
+                wanted = procs + 1
+            return min(max(wanted, procs + 1), self.max_concurrency)
+
+        if latency < self.target_latency * self.scale_down_ratio:
+            if self._low_since is None:
+                self._low_since = now
+            elif now - self._low_since >= self.cooldown:
+                self._low_since = now
+                return max(procs - 1, self.min_concurrency)
+        else:
+            self._low_since = None
+
+        return min(max(procs, self.min_concurrency), self.max_concurrency)
+
+    def queue_depth(self):
+        """
+        Return number of messages waiting in the queues consumed by the worker.
+
+        :return: int
+        """
+        if self._connection is None:
+            self._connection = self.worker.app.connection_for_read()
+        depth = 0
+        with self._connection.channel() as channel:
+            for queue in self.worker.consumer.task_consumer.queues:
+                depth += channel.queue_declare(queue=queue.name, passive=True).message_count
+        return depth
+
+    def info(self):
+        info = super(QueueDepthAutoscaler, self).info()
+        info['target_latency'] = self.target_latency
+        return info
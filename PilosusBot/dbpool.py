@@ -0,0 +1,130 @@
+"""
+Lifecycle of the DB engines in forking Celery workers.
+
+celery_launcher.py creates the app in the worker's parent process, so that
+the engines (and their pooled connections) would otherwise be inherited by
+the pool's child processes and shared between them. Hence:
+
+- the worker's parent disposes of the engines before forking the children
+  and sizes the pool to the number of tasks a child runs at once;
+- each child forgets the engines it inherited without closing their connections
+  (closing a psycopg2 connection terminates the session the parent shares the socket of),
+  so that they are recreated with the tuned pool on the first query;
+- a connection checked out in a process other than the one it was opened in
+  is invalidated rather than used (guards against any other fork),
+  and, unless APP_DB_PRE_PING_DISABLE, checked with a cheap statement,
+  so that a connection dropped by the server is replaced instead of failing the task.
+"""
+
+import os
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
+from . import db
+
+
+_ping = {'enabled': False}
+
+# engines inherited from the parent process, kept referenced so that
+# the garbage collector does not close their connections either
+_inherited = []
+
+
+def on_connect(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+
+def on_checkout(dbapi_connection, connection_record, connection_proxy):
+    pid = os.getpid()
+    if connection_record.info.get('pid') != pid:
+        # do not close the connection, it still belongs to the process it was opened in
+        connection_record.connection = connection_proxy.connection = None
+        raise exc.DisconnectionError('Connection opened in process {0} checked out in process {1}'.format(
+            connection_record.info.get('pid'), pid))
+
+    if _ping['enabled']:
+        try:
+            cursor = dbapi_connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
+        except Exception as err:
+            # the pool retries checkout with a new connection
+            raise exc.DisconnectionError('Connection dropped: {0}'.format(err))
+
+
+def install_guards(pre_ping=True):
+    """
+    Listen on checkouts of all the pools' connections, see the module's docstring.
+
+    :param pre_ping: bool
+    :return: None
+    """
+    _ping['enabled'] = pre_ping
+    if not event.contains(Pool, 'connect', on_connect):
+        event.listen(Pool, 'connect', on_connect)
+        event.listen(Pool, 'checkout', on_checkout)
+
+
+def remove_guards():
+    """
+    Stop listening on checkouts of the pools' connections, see install_guards.
+
+    :return: None
+    """
+    _ping['enabled'] = False
+    if event.contains(Pool, 'connect', on_connect):
+        event.remove(Pool, 'connect', on_connect)
+        event.remove(Pool, 'checkout', on_checkout)
+
+
+def tune_pool(app, concurrency):
+    """
+    Size the pool of the app's engines to the number of tasks a process runs at once.
+
+    SQLite engines are left alone: SQLAlchemy does not pool SQLite file connections.
+
+    :param app: Flask app
+    :param concurrency: int (tasks run at once by a worker's process)
+    :return: None
+    """
+    if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+        return
+    app.config['SQLALCHEMY_POOL_SIZE'] = concurrency
+    app.config['SQLALCHEMY_MAX_OVERFLOW'] = app.config['APP_DB_POOL_MAX_OVERFLOW']
+    app.config['SQLALCHEMY_POOL_TIMEOUT'] = app.config['APP_DB_POOL_TIMEOUT_SEC']
+    app.config['SQLALCHEMY_POOL_RECYCLE'] = app.config['APP_DB_POOL_RECYCLE_SEC']
+
+
+def reset_engines(app, close=True):
+    """
+    Forget the app's engines (including binds), dispose of them if close is True.
+
+    The engines are recreated with the app's current config on the next query.
+    A forked process must not close the connections it inherited (close=False),
+    they still belong to the parent.
+
+    :param app: Flask app
+    :param close: bool
+    :return: None
+    """
+    state = db.get_state(app)
+    for connector in state.connectors.values():
+        # do not create an engine just to dispose of it
+        engine = getattr(connector, '_engine', None)
+        if engine is None:
+            continue
+        if close:
+            engine.dispose()
+        else:
+            _inherited.append(engine)
+    state.connectors.clear()
+
+
+def worker_concurrency(worker):
+    """
+    Return number of tasks a process of the Celery worker runs at once.
+
+    :param worker: celery.apps.worker.Worker
+    :return: int
+    """
+    pool = getattr(worker.pool_cls, '__module__', str(worker.pool_cls))
+    return 1 if 'prefork' in pool or 'processes' in pool else worker.concurrency
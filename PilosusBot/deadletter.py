@@ -0,0 +1,139 @@
+"""
+Dead-letter store of the updates failed in the pipeline.
+
+If a pipeline stage raises, the update it was given is saved to a capped
+Redis list along with the stage's name and the exception, so that it
+can be replayed once the cause is fixed (see `manage.py dlq`).
+Entries are serialized with the pipeline's msgpack format (see serializers.py).
+"""
+
+import time
+from functools import wraps
+import redis
+from flask import current_app
+from . import serializers
+from .processing import get_redis, record_status
+
+
+def add(stage, parsed_update, err):
+    """
+    Save the update failed in the given stage.
+
+    :param stage: str (assess, select, send)
+    :param parsed_update: dict (as given to the stage)
+    :param err: Exception
+    :return: None
+    """
+    entry = {'stage': stage,
+             'payload': parsed_update,
+             'error': type(err).__name__,
+             'message': str(err)[:current_app.config['APP_DLQ_MESSAGE_MAX_LEN']],
+             'time': time.time()}
+    key = current_app.config['APP_DLQ_KEY']
+    try:
+        get_redis().pipeline(transaction=False) \
+            .lpush(key, serializers.dumps(entry)) \
+            .ltrim(key, 0, current_app.config['APP_DLQ_MAX_LEN'] - 1) \
+            .execute()
+    except redis.RedisError as redis_err:
+        current_app.logger.error('Cannot save update failed in %s stage: %s', stage, redis_err)
+    record_status(parsed_update, 'dead', failed_stage=stage, error_code=entry['error'])
+
+
+def entries(stage=None, error=None, limit=None):
+    """
+    Return list of (raw, entry) of the saved entries matching the filters, oldest first.
+
+    Raw value is needed to remove the entry, see remove.
+
+    :param stage: str or None (any stage)
+    :param error: str or None (exception's class name, any error if None)
+    :param limit: int or None (no limit)
+    :return: list of tuples (bytes, dict)
+    """
+    result = []
+    for raw in reversed(get_redis().lrange(current_app.config['APP_DLQ_KEY'], 0, -1)):
+        entry = serializers.loads(raw)
+        if stage and entry['stage'] != stage or error and entry['error'] != error:
+            continue
+        result.append((raw, entry))
+        if limit and len(result) >= limit:
+            break
+    return result
+
+
+def remove(raw):
+    """
+    Remove the entry from the store.
+
+    :param raw: bytes (as returned by entries)
+    :return: int (number of entries removed)
+    """
+    return get_redis().lrem(current_app.config['APP_DLQ_KEY'], 1, raw)
+
+
+def restore(raw):
+    """
+    Put the removed entry back to the store as the oldest one.
+
+    :param raw: bytes (as returned by entries)
+    :return: None
+    """
+    get_redis().rpush(current_app.config['APP_DLQ_KEY'], raw)
+
+
+def replay(send, stage=None, error=None, limit=None, rate=10.0):
+    """
+    Send the saved entries matching the filters with the given function, remove them from the store.
+
+    An entry is removed before it's sent, so that it's never replayed twice by
+    concurrent runs, and put back if sending fails (e.g. the broker is down).
+
+    :param send: callable taking an entry (see tasks.replay_dead_letter)
+    :param stage: str or None (any stage)
+    :param error: str or None (exception's class name, any error if None)
+    :param limit: int or None (no limit)
+    :param rate: float (entries per second)
+    :return: int (number of entries replayed)
+    """
+    if rate <= 0:
+        raise ValueError('Replay rate must be greater than 0')
+
+    replayed = 0
+    for raw, entry in entries(stage=stage, error=error, limit=limit):
+        if not remove(raw):
+            continue
+        try:
+            send(entry)
+        except Exception:
+            restore(raw)
+            raise
+        replayed += 1
+        time.sleep(1.0 / rate)
+    return replayed
+
+
+def dead_letter(stage):
+    """
+    Decorator saving the stage's argument to the dead-letter store if the stage raises.
+
+    The stage function should take the parsed update as its first argument.
+    The exception is re-raised.
+
+    :param stage: str
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(parsed_update, *args, **kwargs):
+            payload = dict(parsed_update)
+            try:
+                return f(parsed_update, *args, **kwargs)
+            except Exception as err:
+                # checked in text is gone once taken by the stage, keep the text itself then
+                if 'text_ref' in payload and 'text' in parsed_update:
+                    del payload['text_ref']
+                    payload['text'] = parsed_update['text']
+                add(stage, payload, err)
+                raise
+        return wrapper
+    return decorator
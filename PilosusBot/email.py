@@ -36,8 +36,13 @@ def send_email_thread(to, subject, template, **kwargs):
 
 
 @shared_task
-def send_celery_async_email(msg):
-    mail.send(msg)
+def send_celery_async_email(msg_fields):
+    """Send email built from the given Message fields.
+
+    Plain fields are passed instead of the Message itself,
+    so that the task's arguments can be serialized without pickle.
+    """
+    mail.send(Message(**msg_fields))
 
 
 # NOTE rename to send_email in production if Thread support is not needed
@@ -45,9 +50,10 @@ def send_email_celery(to, subject, template, countdown=None, **kwargs):
     """Send async email using Celery.
     """
     app = current_app._get_current_object()
-    msg = Message(app.config['APP_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
-                  sender=app.config['APP_MAIL_SENDER'], recipients=[to])
-    msg.body = render_template(template + '.txt', **kwargs)
-    msg.html = render_template(template + '.html', **kwargs)
-    send_celery_async_email.apply_async(args=[msg], countdown=countdown)
+    msg_fields = {'subject': app.config['APP_MAIL_SUBJECT_PREFIX'] + ' ' + subject,
+                  'sender': app.config['APP_MAIL_SENDER'],
+                  'recipients': [to],
+                  'body': render_template(template + '.txt', **kwargs),
+                  'html': render_template(template + '.html', **kwargs)}
+    send_celery_async_email.apply_async(args=[msg_fields], countdown=countdown)
 
@@ -5,6 +5,13 @@ class ValidationError(ValueError):
     pass
 
 
+class ExpiredTextError(LookupError):
+    """
+    Text stored in Redis by the claim check is not there anymore.
+    """
+    pass
+
+
 class APIAccessError(IndicoError):
     """
     Exception wrapper for indico.io
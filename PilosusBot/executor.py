@@ -0,0 +1,132 @@
+"""
+In-process pipeline executor for single-node deployments.
+
+Runs the pipeline (see tasks.process_update) on a bounded pool of threads
+of the web server's process, so that a small installation needs neither
+a broker nor Celery workers. Enabled with APP_PIPELINE_EXECUTOR=thread.
+
+Jobs wait in a bounded queue. If the queue is full for
+APP_EXECUTOR_QUEUE_TIMEOUT_SEC, the job is rejected, so that a burst of
+updates slows the webhook down instead of piling up in memory.
+Delayed jobs (rate limited sends and retries) wait for a place in the queue
+on their timer thread for up to APP_EXECUTOR_DELAYED_TIMEOUT_SEC; if rejected,
+their update is saved to the dead-letter store for replay.
+Jobs are lost if the process exits.
+"""
+
+import logging
+import os
+import queue
+import threading
+from flask import current_app
+
+
+logger = logging.getLogger(__name__)
+
+
+class PipelineExecutor(object):
+    """
+    Bounded thread pool running the pipeline's task functions with the app context pushed.
+    """
+    def __init__(self, app=None):
+        self._queue = None
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['executor'] = self
+
+    @property
+    def enabled(self):
+        return current_app.config['APP_PIPELINE_EXECUTOR'] == 'thread'
+
+    def start(self):
+        """
+        Start worker threads if they are not running in this process yet.
+
+        Threads do not survive fork, so that they are started again in a forked process.
+        """
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=current_app.config['APP_EXECUTOR_QUEUE_SIZE'])
+            self._threads = [threading.Thread(target=self.work, name='pipeline-{0}'.format(i), daemon=True)
+                             for i in range(current_app.config['APP_EXECUTOR_POOL_SIZE'])]
+            for thread in self._threads:
+                thread.start()
+            self._pid = os.getpid()
+
+    def submit(self, fn, *args, countdown=None, **kwargs):
+        """
+        Run the function on the pool, return False if the job has been rejected.
+
+        :param fn: callable (task or plain function)
+        :param args: positional arguments of the function
+        :param countdown: float or None (run not earlier than in the given number of seconds)
+        :param kwargs: keyword arguments of the function
+        :return: bool
+        """
+        self.start()
+        job = (current_app._get_current_object(), fn, args, kwargs)
+
+        if countdown:
+            # delayed jobs must not block the caller, they wait for the queue on the timer's thread
+            timer = threading.Timer(countdown, self.put_delayed, args=[job])
+            timer.daemon = True
+            timer.start()
+            return True
+
+        return self.put(job, timeout=current_app.config['APP_EXECUTOR_QUEUE_TIMEOUT_SEC'])
+
+    def put(self, job, timeout=None, delayed=False):
+        # executor is imported by the package before the modules metrics depend on
+        from .metrics import EXECUTOR_REJECTED
+
+        try:
+            if timeout:
+                self._queue.put(job, timeout=timeout)
+            else:
+                self._queue.put_nowait(job)
+        except queue.Full:
+            logger.warning('Pipeline executor queue is full, %s rejected', getattr(job[1], '__name__', job[1]))
+            EXECUTOR_REJECTED.inc(job='delayed' if delayed else 'immediate')
+            return False
+        return True
+
+    def put_delayed(self, job):
+        """
+        Put the delayed job to the queue, save its update to the dead-letter store if rejected.
+
+        The job's first argument is expected to be the parsed update,
+        delayed jobs are sends (see tasks.resend_message).
+        """
+        from . import deadletter
+
+        app, fn, args, kwargs = job
+        with app.app_context():
+            if self.put(job, timeout=app.config['APP_EXECUTOR_DELAYED_TIMEOUT_SEC'], delayed=True):
+                return
+            if args and isinstance(args[0], dict):
+                deadletter.add('send', args[0], queue.Full('Pipeline executor queue is full'))
+
+    def work(self):
+        jobs = self._queue
+        while True:
+            app, fn, args, kwargs = jobs.get()
+            try:
+                with app.app_context():
+                    fn(*args, **kwargs)
+            except Exception:
+                logger.exception('Pipeline executor job %s failed', getattr(fn, '__name__', fn))
+            finally:
+                jobs.task_done()
+
+    def join(self):
+        """
+        Block until all the jobs queued so far are done.
+        """
+        if self._queue is not None:
+            self._queue.join()
@@ -0,0 +1,163 @@
+"""
+Bulk import of sentiments from CSV or JSON Lines files.
+
+Rows are read in chunks. body_html of a chunk is rendered in a process pool
+(Markdown rendering and sanitizing is CPU-bound, identical bodies are rendered
+once per process, see models.RenderCache) while the previous chunk
+is inserted into the DB with a single bulk INSERT and committed.
+
+Each row should have 'body', 'score' and 'language' (ISO 639-1 code) fields,
+'timestamp' (ISO 8601) is optional.
+
+(venv) $ python manage.py import-sentiments sentiments.csv
+"""
+
+import csv
+import json
+import logging
+import os
+from datetime import datetime
+from functools import partial
+from itertools import islice
+from multiprocessing import Pool
+from flask import current_app
+from . import db
+from .models import Sentiment, SentimentCount, Language, User, cached_render_html
+from .utils import score_to_level
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_rows(path, fmt=None):
+    """
+    Yield rows (dicts) of the given CSV or JSON Lines file.
+
+    :param path: str
+    :param fmt: str or None ('csv' or 'jsonl', guessed by file extension if None)
+    """
+    if fmt is None:
+        fmt = 'jsonl' if os.path.splitext(path)[1].lower() in ('.jsonl', '.json') else 'csv'
+
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def to_mappings(rows, languages, author_id):
+    """
+    Return list of Sentiment mappings of the valid rows and number of rows skipped.
+
+    body_html is not rendered here.
+
+    :param rows: list of dicts
+    :param languages: dict (language code -> id)
+    :param author_id: int
+    :return: tuple (list of dicts, int)
+    """
+    mappings = []
+    skipped = 0
+    now = datetime.utcnow()
+    for row in rows:
+        try:
+            body = row['body']
+            score = float(row['score'])
+            language_id = languages[row['language']]
+            timestamp = datetime.strptime(row['timestamp'][:19], '%Y-%m-%dT%H:%M:%S') \
+                if row.get('timestamp') else now
+        except (KeyError, TypeError, ValueError) as err:
+            logger.warning('Row skipped (%r): %s', err, row)
+            skipped += 1
+            continue
+        if not body:
+            skipped += 1
+            continue
+        mappings.append({'body': body,
+                         'score': score,
+                         'level': score_to_level(score),
+                         'language_id': language_id,
+                         'author_id': author_id,
+                         'timestamp': timestamp})
+    return mappings, skipped
+
+
+def import_sentiments(path, fmt=None, chunk_size=1000, processes=None, author_email=None):
+    """
+    Import sentiments from the file, return number of sentiments imported and rows skipped.
+
+    Every chunk is inserted in a transaction of its own, so that the chunks
+    imported before a failure stay in the DB.
+
+    :param path: str
+    :param fmt: str or None ('csv' or 'jsonl', guessed by file extension if None)
+    :param chunk_size: int (rows per INSERT and transaction)
+    :param processes: int or None (number of CPUs), 1 renders in the current process
+    :param author_email: str or None (APP_ADMIN_EMAIL)
+    :return: tuple (int, int)
+    """
+    author = User.query.filter_by(email=author_email or current_app.config['APP_ADMIN_EMAIL']).first()
+    author_id = author.id if author else None
+    languages = dict(db.session.query(Language.code, Language.id))
+    render = partial(cached_render_html,
+                     tags=current_app.config['APP_ALLOWED_TAGS'],
+                     attributes=current_app.config['APP_ALLOWED_ATTRIBUTES'],
+                     maxsize=current_app.config['APP_RENDER_CACHE_SIZE'])
+
+    pool = Pool(processes) if processes != 1 else None
+    imported = skipped = 0
+    pending = None  # mappings of the previous chunk and their body_html being rendered
+    try:
+        for chunk in chunks(read_rows(path, fmt), chunk_size):
+            mappings, chunk_skipped = to_mappings(chunk, languages, author_id)
+            skipped += chunk_skipped
+            bodies = [m['body'] for m in mappings]
+            rendering = pool.map_async(render, bodies) if pool else None
+
+            if pending:
+                imported += insert(*pending)
+            pending = (mappings, rendering or [render(body) for body in bodies])
+
+        if pending:
+            imported += insert(*pending)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return imported, skipped
+
+
+def insert(mappings, rendering):
+    """
+    Insert the sentiments with a single bulk INSERT, commit.
+
+    :param mappings: list of dicts
+    :param rendering: list of str or multiprocessing.pool.AsyncResult (body_html of the mappings)
+    :return: int (number of rows inserted)
+    """
+    html = rendering.get() if hasattr(rendering, 'get') else rendering
+    for mapping, body_html in zip(mappings, html):
+        mapping['body_html'] = body_html
+    try:
+        db.session.bulk_insert_mappings(Sentiment, mappings)
+        SentimentCount.add_rows(db.session.connection(), mappings)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info('%d sentiments imported', len(mappings))
+    return len(mappings)
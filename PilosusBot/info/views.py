@@ -1,8 +1,26 @@
-from flask import render_template, url_for
-from flask_login import login_required
+import hmac
+from flask import abort, current_app, render_template, request, url_for, Response
+from flask_login import current_user, login_required
 from . import info
+from .. import metrics as app_metrics
+from ..models import Permission
 
 
 @info.route('/')
 def index():
     return render_template('info/index.html')
+
+
+@info.route('/metrics')
+def metrics():
+    """
+    Metrics of all the app's processes in Prometheus text format.
+
+    Available to administrators and to scrapers sending 'Authorization: Bearer <APP_METRICS_TOKEN>'.
+    """
+    token = current_app.config['APP_METRICS_TOKEN']
+    authorized = token and hmac.compare_digest(request.headers.get('Authorization', ''),
+                                               'Bearer ' + token)
+    if not authorized and not current_user.can(Permission.ADMINISTER):
+        abort(403)
+    return Response(app_metrics.exposition(), mimetype='text/plain; version=0.0.4')
@@ -1,3 +1,4 @@
+from datetime import datetime
 from flask import current_app
 from .utils import lang_code_to_lang_name
 
@@ -71,3 +72,20 @@ def code2name(code):
     Convert language code to language name.
     """
     return lang_code_to_lang_name(code)
+
+
+def timestamp2datetime(timestamp):
+    """
+    Convert UNIX timestamp into datetime (UTC), e.g. to be used with moment().
+    """
+    return datetime.utcfromtimestamp(timestamp)
+
+
+def seconds2ms(seconds):
+    """
+    Format duration given in seconds as milliseconds.
+
+    Usage in a template:
+    {{ 0.12345|seconds2ms }} -> 123.5 ms
+    """
+    return '{0:.1f} ms'.format(seconds * 1000)
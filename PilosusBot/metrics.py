@@ -0,0 +1,238 @@
+"""
+Counters and histograms shared by all the app's processes through Redis.
+
+Each process buffers its observations and adds them to Redis hashes
+(one hash per metric) in a single pipeline at most every APP_METRICS_FLUSH_SEC,
+so that the web server's and Celery workers' processes on any host
+contribute to the same metrics.
+
+The metrics are exposed in Prometheus text format by /metrics view.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+import redis
+from flask import current_app
+from .processing import get_redis
+
+
+# default histogram buckets, seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# metrics by name, in order of definition
+REGISTRY = OrderedDict()
+
+# pending increments of this process: (metric name, field) -> value
+_buffer = {}
+_lock = threading.Lock()
+_last_flush = [time.monotonic()]
+
+
+def _labels_field(labels):
+    return ','.join('{0}="{1}"'.format(name, str(value).replace('"', '\\"'))
+                    for name, value in sorted(labels.items()))
+
+
+def parse_labels(field):
+    """
+    Return labels of the metric's hash field.
+
+    :param field: str (name="value",... part of the field)
+    :return: dict
+    """
+    return {name: value.replace('\\"', '"') for name, value in re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', field)}
+
+
+class Metric(object):
+    type = 'untyped'
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        REGISTRY[name] = self
+
+    def key(self):
+        return '{prefix}:{name}'.format(prefix=current_app.config['APP_METRICS_KEY_PREFIX'], name=self.name)
+
+    def read(self):
+        """
+        Return the metric's Redis hash (field -> value), including this process' increments.
+
+        :return: dict
+        """
+        flush()
+        return {field.decode('utf-8'): float(value) for field, value in get_redis().hgetall(self.key()).items()}
+
+    def samples(self, fields):
+        """
+        Return list of (sample name, labels field, value) from the metric's Redis hash.
+
+        A sample named after the metric per field, subclasses add suffixes.
+
+        :param fields: dict (field -> value)
+        :return: list of tuples
+        """
+        return [(self.name, labels, value) for labels, value in sorted(fields.items())]
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        increment(self.name, _labels_field(labels), amount)
+
+    def samples(self, fields):
+        return [(self.name + '_total', labels, value) for labels, value in sorted(fields.items())]
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, buckets=BUCKETS):
+        super(Histogram, self).__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        """
+        Add an observation to the histogram.
+
+        Only the first bucket the value fits into is incremented, buckets are made cumulative
+        when the metric is exposed.
+        """
+        labels_field = _labels_field(labels)
+        bound = next((b for b in self.buckets if value <= b), '+Inf')
+        increment(self.name, '{0}|{1}'.format(labels_field, bound), 1)
+        increment(self.name, labels_field + '|sum', value)
+        increment(self.name, labels_field + '|count', 1)
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the time spent in the block, labels may be updated within the block.
+        """
+        start = time.monotonic()
+        try:
+            yield labels
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def timed(self, f):
+        """
+        Decorator observing the time spent in the function.
+        """
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with self.time():
+                return f(*args, **kwargs)
+        return wrapper
+
+    def samples(self, fields):
+        by_labels = {}
+        for field, value in fields.items():
+            labels, _, suffix = field.rpartition('|')
+            by_labels.setdefault(labels, {})[suffix] = value
+
+        result = []
+        for labels, values in sorted(by_labels.items()):
+            cumulative = 0
+            for bound in self.buckets + ('+Inf',):
+                cumulative += values.get(str(bound), 0)
+                le = 'le="{0}"'.format(bound)
+                result.append((self.name + '_bucket', ','.join(filter(None, [labels, le])), cumulative))
+            result.append((self.name + '_sum', labels, values.get('sum', 0)))
+            result.append((self.name + '_count', labels, values.get('count', 0)))
+        return result
+
+
+def increment(name, field, amount):
+    if current_app.config['APP_METRICS_DISABLE']:
+        return
+    with _lock:
+        _buffer[(name, field)] = _buffer.get((name, field), 0) + amount
+    if time.monotonic() - _last_flush[0] >= current_app.config['APP_METRICS_FLUSH_SEC']:
+        flush()
+
+
+def flush():
+    """
+    Add the increments buffered by this process to Redis.
+
+    The increments are lost if Redis is not available.
+    """
+    with _lock:
+        pending = dict(_buffer)
+        _buffer.clear()
+        _last_flush[0] = time.monotonic()
+    if not pending:
+        return
+
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for (name, field), amount in pending.items():
+            pipe.hincrbyfloat(REGISTRY[name].key(), field, amount)
+        pipe.execute()
+    except redis.RedisError as err:
+        current_app.logger.warning('Cannot flush metrics: %s', err)
+
+
+def reset():
+    """
+    Drop the increments buffered by this process.
+
+    Should be called in a forked process, so that parent's increments are not flushed twice.
+    """
+    with _lock:
+        _buffer.clear()
+        _last_flush[0] = time.monotonic()
+
+
+def exposition():
+    """
+    Return all the metrics in Prometheus text exposition format.
+
+    :return: str
+    """
+    flush()
+    names = list(REGISTRY)
+    pipe = get_redis().pipeline(transaction=False)
+    for name in names:
+        pipe.hgetall(REGISTRY[name].key())
+
+    lines = []
+    for name, fields in zip(names, pipe.execute()):
+        metric = REGISTRY[name]
+        fields = {field.decode('utf-8'): float(value) for field, value in fields.items()}
+        lines.append('# HELP {0} {1}'.format(name, metric.documentation))
+        lines.append('# TYPE {0} {1}'.format(name, metric.type))
+        for sample, labels, value in metric.samples(fields):
+            lines.append('{0}{1} {2!r}'.format(sample, '{' + labels + '}' if labels else '', value))
+    return '\n'.join(lines) + '\n'
+
+
+WEBHOOK_SECONDS = Histogram('pilosusbot_webhook_seconds',
+                            'Time spent handling webhook requests from Telegram.')
+DEDUPE_SECONDS = Histogram('pilosusbot_dedupe_seconds',
+                           'Time spent checking update_id against the updates already received.')
+ASSESS_SECONDS = Histogram('pilosusbot_assess_seconds',
+                           'Time spent assessing sentiment score of a message, by engine.')
+SELECT_SECONDS = Histogram('pilosusbot_select_seconds',
+                           'Time spent selecting a reply, by source.')
+SEND_SECONDS = Histogram('pilosusbot_send_seconds',
+                         'Time spent in sendMessage requests to Telegram, by status code.')
+RENDER_SECONDS = Histogram('pilosusbot_render_seconds',
+                           'Time spent rendering sentiment bodies to HTML, by render cache hit or miss.')
+DB_QUERIES = Histogram('pilosusbot_db_queries',
+                       'Number of DB statements per request or task, by endpoint or task name.',
+                       buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200))
+DB_SECONDS = Histogram('pilosusbot_db_seconds',
+                       'Time spent in the DB per request or task, by endpoint or task name.')
+UPDATES_PROCESSED = Counter('pilosusbot_updates_processed',
+                            'Updates accepted for processing by the webhook.')
+EXECUTOR_REJECTED = Counter('pilosusbot_executor_rejected',
+                            'Jobs rejected by the in-process executor as its queue is full, by job kind.')
+UPDATES_DROPPED = Counter('pilosusbot_updates_dropped',
+                          'Updates not replied, by reason.')
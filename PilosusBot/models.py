@@ -1,14 +1,20 @@
 import hashlib
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from functools import partial
 from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
 from markdown import markdown
 import bleach
 from flask import current_app, request, url_for
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from .exceptions import ValidationError
 from flask_login import UserMixin, AnonymousUserMixin
 from . import db, login_manager
-from .utils import generate_password
+from .utils import generate_password, score_to_level
 from PilosusBot.utils import is_valid_lang_code
 
 
@@ -145,6 +151,51 @@ class User(UserMixin, db.Model):
             except IntegrityError:
                 db.session.rollback()
 
+    @staticmethod
+    def generate_fake_bulk(count=100, roles=None, seed=None, batch_size=10000):
+        """
+        Add fake users to a DB with bulk INSERTs, way faster than generate_fake.
+
+        Emails and usernames are numbered, so that they stay unique. Users get the
+        default role unless roles are given. All the users of a run share the same
+        random password (hashed once), which is not returned: fake users are not
+        meant to log in. The same seed gives the same users.
+
+        :param count: int
+        :param roles: list of Role instances (the default role if None)
+        :param seed: int or None (random)
+        :param batch_size: int (rows per INSERT and transaction)
+        :return: None
+        """
+        from random import Random
+        from forgery_py.dictionaries_loader import get_dictionary
+
+        rng = Random(seed)
+        role_ids = [role.id for role in roles or [Role.query.filter_by(default=True).first()]]
+        password_hash = generate_password_hash(generate_password(16))
+        first_names = get_dictionary('male_first_names') + get_dictionary('female_first_names')
+        last_names = get_dictionary('last_names')
+        cities = get_dictionary('cities')
+        now = datetime.utcnow()
+        first_id = (db.session.query(db.func.max(User.id)).scalar() or 0) + 1
+
+        for start in range(first_id, first_id + count, batch_size):
+            rows = []
+            for n in range(start, min(start + batch_size, first_id + count)):
+                email = 'user{0}@example.com'.format(n)
+                rows.append({'email': email,
+                             'username': 'user{0}'.format(n),
+                             'role_id': rng.choice(role_ids),
+                             'password_hash': password_hash,
+                             'confirmed': True,
+                             'name': '{0} {1}'.format(rng.choice(first_names), rng.choice(last_names)),
+                             'location': rng.choice(cities),
+                             'about_me': _fake_sentences(rng, 1),
+                             'member_since': now - timedelta(days=rng.randint(0, 365)),
+                             'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest()})
+            db.session.bulk_insert_mappings(User, rows)
+            db.session.commit()
+
     def __init__(self, **kwargs):
         super(User, self).__init__(**kwargs)
         if self.role is None:
@@ -324,17 +375,143 @@ class Language(db.Model):
         return '<Language %r>' % self.code
 
 
+def render_html(body, tags, attributes):
+    """
+    Render Markdown body of a sentiment into sanitized HTML.
+
+    Module-level function, so that it can be run in a process pool (see importer.py).
+
+    :param body: str (Markdown)
+    :param tags: list of allowed HTML tags
+    :param attributes: dict of allowed HTML attributes
+    :return: str
+    """
+    return bleach.linkify(bleach.clean(
+        markdown(body, output_format='html'),
+        tags=tags, attributes=attributes, strip=True))
+
+
+class RenderCache(object):
+    """
+    Bounded LRU cache of sentiment bodies rendered by render_html.
+
+    Entries are keyed on the body's hash along with the allowed tags and attributes,
+    so that changing APP_ALLOWED_TAGS or APP_ALLOWED_ATTRIBUTES never returns stale HTML.
+    Each process has a cache of its own.
+    """
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.render_seconds = 0.0
+
+    @staticmethod
+    def key(body, tags, attributes):
+        return (hashlib.sha1(body.encode('utf-8')).hexdigest(),
+                tuple(tags),
+                tuple(sorted((tag, tuple(attrs)) for tag, attrs in attributes.items())))
+
+    def render(self, body, tags, attributes, maxsize):
+        """
+        Return HTML of the body and whether it was found in the cache.
+
+        :param body: str (Markdown)
+        :param tags: list of allowed HTML tags
+        :param attributes: dict of allowed HTML attributes
+        :param maxsize: int (max number of entries kept, 0 disables the cache)
+        :return: tuple (str, bool)
+        """
+        key = self.key(body, tags, attributes) if maxsize else None
+        if key:
+            with self._lock:
+                html = self._entries.get(key)
+                if html is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return html, True
+
+        start = time.monotonic()
+        html = render_html(body, tags, attributes)
+        elapsed = time.monotonic() - start
+
+        with self._lock:
+            self.misses += 1
+            self.render_seconds += elapsed
+            if key:
+                self._entries[key] = html
+                while len(self._entries) > maxsize:
+                    self._entries.popitem(last=False)
+        return html, False
+
+    def stats(self):
+        """
+        Return the cache's hits, misses, hit_rate, size and render_seconds (time spent on misses).
+
+        :return: dict
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / requests if requests else 0.0,
+                    'size': len(self._entries),
+                    'render_seconds': self.render_seconds}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+            self.render_seconds = 0.0
+
+
+render_cache = RenderCache()
+
+# seeded fake sentiments are dated back from a fixed time, a second apart,
+# so that the same seed gives the same timestamps and millions of rows fit in a few weeks
+FAKE_TIMESTAMP_BASE = datetime(2017, 1, 1)
+FAKE_TIMESTAMP_STEP = timedelta(seconds=1)
+
+
+def _fake_sentences(rng, count):
+    """
+    Return the given number of lorem ipsum sentences made with the random generator.
+
+    :param rng: random.Random
+    :param count: int
+    :return: str
+    """
+    from forgery_py.dictionaries_loader import get_dictionary
+    words = get_dictionary('lorem_ipsum')
+    return ' '.join(' '.join(rng.choice(words) for _ in range(rng.randint(4, 12))).capitalize() + '.'
+                    for _ in range(count))
+
+
+def cached_render_html(body, tags, attributes, maxsize):
+    """
+    Render the body with the process' render cache, see RenderCache.render.
+
+    :return: str
+    """
+    return render_cache.render(body, tags, attributes, maxsize)[0]
+
+
 class Sentiment(db.Model):
     """
     Sentiment with given sentiment score (polarity index).
     """
     __tablename__ = 'sentiments'
+    __table_args__ = (db.Index('ix_sentiments_language_id_level', 'language_id', 'level'),
+                      # keyset pagination of a language's sentiments, see pagination.py
+                      db.Index('ix_sentiments_language_id_timestamp_id', 'language_id', 'timestamp', 'id'))
     id = db.Column(db.Integer, primary_key=True)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     language_id = db.Column(db.Integer, db.ForeignKey('languages.id'))
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
     score = db.Column(db.Float, default=0.0)
+    # integer representation of the score, see utils.score_to_level
+    level = db.Column(db.SmallInteger, default=0, index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
 
     @staticmethod
@@ -374,13 +551,100 @@ class Sentiment(db.Model):
             db.session.add(p)
             db.session.commit()
 
+    @staticmethod
+    def generate_fake_bulk(count=100, subsequent_scores=True, levels=None,
+                           language_code='la', random_timestamp=False, seed=None, batch_size=10000):
+        """
+        Add fake sentiments to a DB with bulk INSERTs, way faster than generate_fake.
+
+        Authors are chosen among the users already in the DB, user and language ids
+        are read once. The same seed gives the same sentiments, timestamps included.
+
+        :param count: int
+        :param subsequent_scores: bool (cycle through the levels, choose randomly if False)
+        :param levels: list of float (APP_SCORE_LEVELS)
+        :param language_code: str
+        :param random_timestamp: bool
+        :param seed: int or None (random)
+        :param batch_size: int (rows per INSERT and transaction)
+        :return: None
+        """
+        from random import Random
+
+        rng = Random(seed)
+        user_ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+
+        if not levels:
+            levels = list(current_app.config['APP_SCORE_LEVELS'].keys())
+
+        if not is_valid_lang_code(language_code):
+            language_code = 'la'
+        language_id = Language.query.filter_by(code=language_code).first().id
+
+        timestamp = FAKE_TIMESTAMP_BASE if seed is not None else datetime.utcnow()
+        if random_timestamp:
+            timestamp -= timedelta(days=rng.randint(0, 365), seconds=rng.randint(0, 86399))
+
+        render = partial(cached_render_html,
+                         tags=current_app.config['APP_ALLOWED_TAGS'],
+                         attributes=current_app.config['APP_ALLOWED_ATTRIBUTES'],
+                         maxsize=current_app.config['APP_RENDER_CACHE_SIZE'])
+
+        for start in range(0, count, batch_size):
+            rows = []
+            for i in range(start, min(start + batch_size, count)):
+                score = levels[i % len(levels)] if subsequent_scores else rng.choice(levels)
+                body = _fake_sentences(rng, rng.randint(1, 5))
+                # bulk INSERT bypasses ORM events, set what they would
+                rows.append({'body': body,
+                             'body_html': render(body),
+                             'score': score,
+                             'level': score_to_level(score),
+                             'author_id': rng.choice(user_ids) if user_ids else None,
+                             'language_id': language_id,
+                             'timestamp': timestamp - FAKE_TIMESTAMP_STEP * i})
+            db.session.bulk_insert_mappings(Sentiment, rows)
+            SentimentCount.add_rows(db.session.connection(), rows)
+            db.session.commit()
+
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = current_app.config['APP_ALLOWED_TAGS']
-        allowed_attrs = current_app.config['APP_ALLOWED_ATTRIBUTES']
-        target.body_html = bleach.linkify(bleach.clean(
-            markdown(value, output_format='html'),
-            tags=allowed_tags, attributes=allowed_attrs, strip=True))
+        # re-saved unchanged body
+        if value == oldvalue and target.body_html is not None:
+            return
+
+        from .metrics import RENDER_SECONDS
+        with RENDER_SECONDS.time() as labels:
+            target.body_html, hit = render_cache.render(value,
+                                                        tags=current_app.config['APP_ALLOWED_TAGS'],
+                                                        attributes=current_app.config['APP_ALLOWED_ATTRIBUTES'],
+                                                        maxsize=current_app.config['APP_RENDER_CACHE_SIZE'])
+            labels['cache'] = 'hit' if hit else 'miss'
+
+    @staticmethod
+    def on_changed_score(target, value, oldvalue, initiator):
+        target.level = score_to_level(value) if value is not None else None
+
+    @staticmethod
+    def on_inserted(mapper, connection, target):
+        SentimentCount.add(connection, target.language_id, target.level, 1)
+
+    @staticmethod
+    def on_deleted(mapper, connection, target):
+        SentimentCount.add(connection, target.language_id, target.level, -1)
+
+    @staticmethod
+    def on_updated(mapper, connection, target):
+        state = db.inspect(target)
+        language_id = state.attrs.language_id.history
+        level = state.attrs.level.history
+        if not language_id.has_changes() and not level.has_changes():
+            return
+        SentimentCount.add(connection,
+                           language_id.deleted[0] if language_id.deleted else target.language_id,
+                           level.deleted[0] if level.deleted else target.level,
+                           -1)
+        SentimentCount.add(connection, target.language_id, target.level, 1)
 
     def to_json(self):
         json_sentiment = {
@@ -404,4 +668,152 @@ class Sentiment(db.Model):
         return '<Sentiment %r>' % self.body
 
 db.event.listen(Sentiment.body, 'set', Sentiment.on_changed_body)
+db.event.listen(Sentiment.score, 'set', Sentiment.on_changed_score)
+db.event.listen(Sentiment, 'after_insert', Sentiment.on_inserted)
+db.event.listen(Sentiment, 'after_delete', Sentiment.on_deleted)
+db.event.listen(Sentiment, 'after_update', Sentiment.on_updated)
+
+
+class SentimentCount(db.Model):
+    """
+    Number of sentiments of each language and score level.
+
+    Updated by Sentiment's mapper events within the transaction that writes
+    the sentiments, so that counting sentiments of a language or a level
+    is an index lookup rather than a scan of the sentiments table.
+    Bulk inserts bypass the events and should call add_rows.
+    See `manage.py recount` to recompute the counters from scratch.
+    """
+    __tablename__ = 'sentiment_counts'
+    language_id = db.Column(db.Integer, db.ForeignKey('languages.id'), primary_key=True)
+    level = db.Column(db.SmallInteger, primary_key=True, autoincrement=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @staticmethod
+    def add(connection, language_id, level, delta):
+        """
+        Add delta to the counter of the language and level.
+
+        :param connection: DB connection of the transaction writing the sentiments
+        :param language_id: int
+        :param level: int (see utils.score_to_level)
+        :param delta: int
+        :return: None
+        """
+        if language_id is None or level is None or not delta:
+            return
+        table = SentimentCount.__table__
+        dialect = connection.dialect.name
+        # transactions counting the first sentiment of the same language and level
+        # must not both insert the counter: the loser's sentiment would be rolled back
+        if delta > 0 and dialect == 'postgresql':
+            connection.execute(pg_insert(table).
+                               values(language_id=language_id, level=level, count=delta).
+                               on_conflict_do_update(index_elements=[table.c.language_id, table.c.level],
+                                                     set_={'count': table.c.count + delta}))
+            return
+        if delta > 0 and dialect == 'sqlite':
+            connection.execute(table.insert().prefix_with('OR IGNORE').
+                               values(language_id=language_id, level=level, count=0))
+        updated = connection.execute(table.update().
+                                     where(table.c.language_id == language_id).
+                                     where(table.c.level == level).
+                                     values(count=table.c.count + delta)).rowcount
+        if not updated and delta > 0:
+            connection.execute(table.insert().values(language_id=language_id, level=level, count=delta))
+
+    @staticmethod
+    def add_rows(connection, rows):
+        """
+        Count sentiments inserted in bulk.
+
+        :param connection: DB connection of the transaction inserting the sentiments
+        :param rows: list of dicts with 'language_id' and 'level' keys
+        :return: None
+        """
+        counts = {}
+        for row in rows:
+            key = (row['language_id'], row['level'])
+            counts[key] = counts.get(key, 0) + 1
+        for (language_id, level), delta in sorted(counts.items()):
+            SentimentCount.add(connection, language_id, level, delta)
+
+    @staticmethod
+    def of(language_id=None, level=None, session=None):
+        """
+        Return number of sentiments of the language and the level.
+
+        :param language_id: int or None (all languages)
+        :param level: int or None (all levels)
+        :param session: DB session to query (the app's default session if None)
+        :return: int
+        """
+        query = (session or db.session).query(db.func.coalesce(db.func.sum(SentimentCount.count), 0))
+        if language_id is not None:
+            query = query.filter(SentimentCount.language_id == language_id)
+        if level is not None:
+            query = query.filter(SentimentCount.level == level)
+        return int(query.scalar())
+
+    @staticmethod
+    def levels(language_id, session=None):
+        """
+        Return set of levels the language has sentiments of.
+
+        :param language_id: int
+        :param session: DB session to query (the app's default session if None)
+        :return: set of int
+        """
+        return set(level for level, in (session or db.session).query(SentimentCount.level).
+                   filter(SentimentCount.language_id == language_id,
+                          SentimentCount.count > 0))
+
+    @staticmethod
+    def recompute():
+        """
+        Recompute all the counters from the sentiments table, return number of counters.
+
+        :return: int
+        """
+        SentimentCount.recount(db.session)
+        db.session.commit()
+        return SentimentCount.query.count()
+
+    @staticmethod
+    def recount(session):
+        """
+        Replace the counters with the counts of the sentiments table in the session's transaction.
+
+        :param session: DB session
+        :return: None
+        """
+        table = SentimentCount.__table__
+        sentiments = Sentiment.__table__
+        session.execute(table.delete())
+        session.execute(table.insert().from_select(
+            ['language_id', 'level', 'count'],
+            db.select([sentiments.c.language_id, sentiments.c.level, db.func.count(sentiments.c.id)]).
+            where(sentiments.c.language_id != None).
+            where(sentiments.c.level != None).
+            group_by(sentiments.c.language_id, sentiments.c.level)))
+
+    def __repr__(self):
+        return '<SentimentCount %r %r: %r>' % (self.language_id, self.level, self.count)
+
+
+def on_language_deleted(mapper, connection, target):
+    # sentiments of the language are deleted (and uncounted) first, see Language.sentiments cascade
+    table = SentimentCount.__table__
+    connection.execute(table.delete().where(table.c.language_id == target.id))
+
+db.event.listen(Language, 'before_delete', on_language_deleted)
+
+
+def on_bulk_changed(context):
+    # Query.update() and Query.delete() bypass mapper events, count all over again
+    if context.primary_table is Sentiment.__table__:
+        SentimentCount.recount(context.session)
+
+db.event.listen(Session, 'after_bulk_update', on_bulk_changed)
+db.event.listen(Session, 'after_bulk_delete', on_bulk_changed)
 
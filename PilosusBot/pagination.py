@@ -0,0 +1,88 @@
+"""
+Keyset (cursor) pagination of the dashboard's lists.
+
+Flask-SQLAlchemy's paginate() issues OFFSET n, so that the DB reads and skips
+all the rows of the previous pages, and COUNT(*) of the whole list on each page.
+Keyset pagination seeks right to the page with the (timestamp, id) of the last
+row of the previous page (the cursor) instead, so that any page takes the same time.
+Total number of rows is given by the caller (e.g. from SentimentCount).
+"""
+
+from datetime import datetime
+from . import db
+
+
+CURSOR_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(item):
+    """
+    Return cursor of the item, i.e. its timestamp and id.
+
+    :param item: model instance with timestamp and id attributes
+    :return: str
+    """
+    return '{0}_{1}'.format(item.timestamp.strftime(CURSOR_FORMAT), item.id)
+
+
+def decode_cursor(cursor):
+    """
+    Return (timestamp, id) of the cursor, None if the cursor is not valid.
+
+    :param cursor: str or None
+    :return: tuple (datetime, int) or None
+    """
+    try:
+        timestamp, id = cursor.rsplit('_', 1)
+        return datetime.strptime(timestamp, CURSOR_FORMAT), int(id)
+    except (AttributeError, ValueError):
+        return None
+
+
+class KeysetPagination(object):
+    """
+    A page of the query's rows, newest (by timestamp, then id) first.
+
+    The page starts right after the 'after' cursor (older rows) or ends right
+    before the 'before' cursor (newer rows), the first page if neither is given.
+    """
+    def __init__(self, query, model, per_page, after=None, before=None, total=None):
+        """
+        :param query: query of the model
+        :param model: model class with timestamp and id columns
+        :param per_page: int
+        :param after: str or None (cursor, see encode_cursor)
+        :param before: str or None (cursor, see encode_cursor)
+        :param total: int or None (number of rows of all the pages)
+        """
+        self.per_page = per_page
+        self.total = total
+        timestamp, id = model.timestamp, model.id
+
+        after = decode_cursor(after)
+        before = decode_cursor(before)
+        rows = None
+
+        if before is not None:
+            newer = query.filter(db.or_(timestamp > before[0],
+                                        db.and_(timestamp == before[0], id > before[1])))
+            rows = newer.order_by(timestamp.asc(), id.asc()).limit(per_page + 1).all()
+            if len(rows) > per_page:
+                self.items = list(reversed(rows[:per_page]))
+                self.has_prev = True
+                self.has_next = True
+            else:
+                # less than a page of newer rows: the first page
+                rows = None
+
+        if rows is None:
+            if after is not None:
+                query = query.filter(db.or_(timestamp < after[0],
+                                            db.and_(timestamp == after[0], id < after[1])))
+            rows = query.order_by(timestamp.desc(), id.desc()).limit(per_page + 1).all()
+            self.items = rows[:per_page]
+            self.has_prev = after is not None
+            self.has_next = len(rows) > per_page
+
+        self.prev_cursor = encode_cursor(self.items[0]) if self.has_prev and self.items else None
+        self.next_cursor = encode_cursor(self.items[-1]) if self.has_next and self.items else None
@@ -1,5 +1,29 @@
+import time
+import uuid
+import redis
+import requests
 from flask import current_app
 from qr import CappedCollection
+from .exceptions import ExpiredTextError
+from . import telegram
+
+
+# cached in place of the number of members while it's being requested or if the request failed
+CHAT_SIZE_UNKNOWN = -1
+
+
+def get_redis():
+    """
+    Return Redis client of the current app (DEQUE_HOST, DEQUE_PORT), create one if needed.
+
+    :return: redis.StrictRedis
+    """
+    app = current_app._get_current_object()
+    client = app.extensions.get('redis')
+    if client is None:
+        client = app.extensions['redis'] = redis.StrictRedis(host=app.config['DEQUE_HOST'],
+                                                             port=app.config['DEQUE_PORT'])
+    return client
 
 
 def parse_update(update):
@@ -51,7 +75,9 @@ def parse_update(update):
     except KeyError as err:
         return result
     else:
+        result['update_id'] = update_id
         result['chat_id'] = chat_id
+        result['chat_type'] = message['chat'].get('type')
         result['reply_to_message_id'] = message_id
         result['text'] = text
 
@@ -72,3 +98,190 @@ def parsed_update_can_be_processed(parsed_update):
            parsed_update.get('reply_to_message_id') and \
            len(parsed_update.get('text')) >= current_app.config['APP_UPDATE_TEXT_THRESHOLD_LEN'] and \
            parsed_update.get('reply_to_message_id') % current_app.config['APP_EVERY_NTH_MESSAGE_ONLY'] == 0
+
+
+def chat_size_key(chat_id):
+    return '{prefix}:{id}'.format(prefix=current_app.config['APP_CHAT_SIZE_KEY_PREFIX'], id=chat_id)
+
+
+def chat_members_count(chat_id):
+    """
+    Return number of members of the chat cached in Redis, None if it's not known (yet).
+
+    On a cache miss the number is requested from Telegram in the background
+    (see tasks.refresh_chat_members_count), so that the webhook never waits for Telegram.
+    Until then the chat is marked as being of unknown size, so that other updates
+    from the chat don't schedule the request again.
+
+    :param chat_id: int
+    :return: int or None
+    """
+    key = chat_size_key(chat_id)
+    try:
+        count = get_redis().get(key)
+        if count is None:
+            if get_redis().set(key, CHAT_SIZE_UNKNOWN, nx=True,
+                               ex=current_app.config['APP_CHAT_SIZE_ERROR_TTL_SEC']):
+                schedule_chat_members_count(chat_id)
+            return None
+        count = int(count)
+    except (redis.RedisError, ValueError) as err:
+        current_app.logger.warning('Cannot get members count of chat %s: %s', chat_id, err)
+        return None
+    return None if count == CHAT_SIZE_UNKNOWN else count
+
+
+def schedule_chat_members_count(chat_id):
+    # tasks module imports this one
+    from .tasks import refresh_chat_members_count
+    from . import executor
+
+    if executor.enabled:
+        executor.submit(refresh_chat_members_count, chat_id)
+    else:
+        refresh_chat_members_count.apply_async(args=[chat_id])
+
+
+def fetch_chat_members_count(chat_id):
+    """
+    Request number of members of the chat from Telegram (getChatMembersCount), cache it in Redis.
+
+    The number is cached for APP_CHAT_SIZE_TTL_SEC, so that Telegram is asked once
+    per chat per TTL. Failures are cached for APP_CHAT_SIZE_ERROR_TTL_SEC, so that
+    the chat is not asked about on every update while Telegram fails.
+
+    :param chat_id: int
+    :return: int or None
+    """
+    count = None
+    try:
+        reply = telegram.post('getChatMembersCount', json={'chat_id': chat_id}).json()
+        if reply.get('ok'):
+            count = int(reply['result'])
+    except (requests.exceptions.RequestException, ValueError) as err:
+        current_app.logger.warning('Cannot get members count of chat %s: %s', chat_id, err)
+
+    try:
+        if count is None:
+            get_redis().set(chat_size_key(chat_id), CHAT_SIZE_UNKNOWN,
+                            ex=current_app.config['APP_CHAT_SIZE_ERROR_TTL_SEC'])
+        else:
+            get_redis().set(chat_size_key(chat_id), count,
+                            ex=current_app.config['APP_CHAT_SIZE_TTL_SEC'])
+    except redis.RedisError as err:
+        current_app.logger.warning('Cannot cache members count of chat %s: %s', chat_id, err)
+    return count
+
+
+def update_priority(parsed_update):
+    """
+    Return priority lane of the update: 'high' for private and small group chats, 'low' otherwise.
+
+    Replies to private chats should not wait behind a flood of updates from a large group.
+    Groups are small if they have no more than APP_PRIORITY_GROUP_MAX_MEMBERS members;
+    all the groups are considered large if the option is 0 or the size is not known yet.
+
+    :param parsed_update: dict (return by parse_update function)
+    :return: str
+    """
+    chat_type = parsed_update.get('chat_type')
+    if chat_type == 'private':
+        return 'high'
+
+    max_members = current_app.config['APP_PRIORITY_GROUP_MAX_MEMBERS']
+    if max_members and chat_type in ('group', 'supergroup'):
+        count = chat_members_count(parsed_update['chat_id'])
+        if count is not None and count <= max_members:
+            return 'high'
+
+    return 'low'
+
+
+def check_in_text(parsed_update):
+    """
+    Store long text of the parsed update in Redis, replace it with a reference ('text_ref' key).
+
+    Only the assess stage needs the text, so that there's no sense in passing it
+    through the broker on every hop of the chain (claim check pattern).
+    Texts shorter than APP_TEXT_CLAIM_CHECK_MIN_LEN are kept as is, 0 disables the check in.
+
+    :param parsed_update: dict (return by parse_update function)
+    :return: dict
+    """
+    min_len = current_app.config['APP_TEXT_CLAIM_CHECK_MIN_LEN']
+    if not min_len or len(parsed_update.get('text') or '') < min_len:
+        return parsed_update
+
+    key = '{prefix}:{id}'.format(prefix=current_app.config['APP_TEXT_CLAIM_KEY_PREFIX'],
+                                 id=uuid.uuid4().hex)
+    get_redis().set(key, parsed_update['text'].encode('utf-8'),
+                    ex=current_app.config['APP_TEXT_CLAIM_TTL_SEC'])
+
+    result = dict(parsed_update)
+    del result['text']
+    result['text_ref'] = key
+    return result
+
+
+def check_out_text(parsed_update):
+    """
+    Return text of the parsed update, fetch and delete it from Redis if it has been checked in.
+
+    :param parsed_update: dict (with either 'text' or 'text_ref' key)
+    :return: str
+    """
+    key = parsed_update.get('text_ref')
+    if key is None:
+        return parsed_update['text']
+
+    pipe = get_redis().pipeline(transaction=True)
+    text, _ = pipe.get(key).delete(key).execute()
+    if text is None:
+        raise ExpiredTextError('Text {0} expired or has already been taken'.format(key))
+    return text.decode('utf-8')
+
+
+def update_status_key(update_id):
+    return '{prefix}:{id}'.format(prefix=current_app.config['APP_UPDATE_STATUS_KEY_PREFIX'],
+                                  id=update_id)
+
+
+def record_status(parsed_update, stage, **fields):
+    """
+    Save the pipeline stage the update has reached to Redis hash with a TTL.
+
+    The hash keeps the last stage under 'stage' key and the time each stage was reached
+    under the stage's name, plus any extra fields given (like 'error_code').
+    Used instead of the result backend to find out what happened to an update.
+    Status is not recorded if APP_UPDATE_STATUS_TTL_SEC is 0 or the update has no 'update_id'.
+
+    :param parsed_update: dict
+    :param stage: str (received, assessed, selected, delayed, retrying, sent, failed)
+    :param fields: extra fields to save
+    :return: None
+    """
+    ttl = current_app.config['APP_UPDATE_STATUS_TTL_SEC']
+    update_id = parsed_update.get('update_id')
+    if not ttl or update_id is None:
+        return
+
+    mapping = {'stage': stage, stage: time.time()}
+    mapping.update((name, value) for name, value in fields.items() if value is not None)
+    key = update_status_key(update_id)
+
+    # status is for debugging only, a Redis failure should not break the pipeline
+    try:
+        get_redis().pipeline(transaction=False).hmset(key, mapping).expire(key, ttl).execute()
+    except redis.RedisError as err:
+        current_app.logger.warning('Cannot record status of update %s: %s', update_id, err)
+
+
+def get_status(update_id):
+    """
+    Return the pipeline status recorded for the update, empty dict if there's none.
+
+    :param update_id: int
+    :return: dict
+    """
+    status = get_redis().hgetall(update_status_key(update_id))
+    return {key.decode('utf-8'): value.decode('utf-8') for key, value in status.items()}
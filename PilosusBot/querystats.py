@@ -0,0 +1,166 @@
+"""
+Query instrumentation of the app's DB engines.
+
+Every statement is timed with SQLAlchemy's cursor events. Statements taking
+APP_SLOW_QUERY_SEC or longer are logged along with the code they were issued
+from (the innermost frame outside of the installed libraries). Number of statements and time spent in the DB are summed up per
+request (by endpoint) and per Celery task (by task name) and observed by
+pilosusbot_db_queries and pilosusbot_db_seconds histograms, which are
+shown in the dashboard's Queries page.
+
+Unlike SQLALCHEMY_RECORD_QUERIES no statements are kept in memory,
+so that the recorder can be enabled in production.
+"""
+
+import os
+import site
+import sysconfig
+import threading
+import time
+import traceback
+from celery.signals import task_prerun, task_postrun
+from flask import current_app, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+THIS_FILE = os.path.abspath(__file__)
+PACKAGE_DIR = os.path.dirname(THIS_FILE)
+# standard library and installed packages (SQLAlchemy, Flask-SQLAlchemy, Celery and so on)
+LIBRARY_DIRS = tuple(set(os.path.abspath(path) for path in
+                         [sysconfig.get_paths()[name] for name in ('stdlib', 'platstdlib', 'purelib', 'platlib')] +
+                         getattr(site, 'getsitepackages', lambda: [])()))
+
+# scope (request or task) being handled by the current thread and its totals
+_current = threading.local()
+
+
+def current_scope():
+    return getattr(_current, 'scope', None)
+
+
+def start_scope(scope):
+    """
+    Start summing up the statements of the current thread under the given scope.
+
+    :param scope: str ('endpoint:<endpoint>' or 'task:<task name>')
+    """
+    _current.scope = scope
+    _current.queries = 0
+    _current.seconds = 0.0
+
+
+def end_scope():
+    """
+    Add the current scope's totals to the metrics, return them.
+
+    :return: tuple (scope, number of statements, seconds) or None if there is no scope
+    """
+    from .metrics import DB_QUERIES, DB_SECONDS
+
+    scope = current_scope()
+    if scope is None:
+        return None
+    totals = (scope, _current.queries, _current.seconds)
+    _current.scope = None
+
+    DB_QUERIES.observe(totals[1], scope=scope)
+    DB_SECONDS.observe(totals[2], scope=scope)
+    return totals
+
+
+def aggregates():
+    """
+    Return DB usage of each request endpoint and task, the most time-consuming first.
+
+    Each item is a dict with 'scope', 'calls' (number of requests or tasks),
+    'queries' (statements issued) and 'seconds' (time spent in the DB) keys.
+
+    :return: list of dicts
+    """
+    from .metrics import DB_QUERIES, DB_SECONDS, parse_labels
+
+    queries = DB_QUERIES.read()
+    seconds = DB_SECONDS.read()
+    result = []
+    for field, calls in seconds.items():
+        labels, _, suffix = field.rpartition('|')
+        if suffix != 'count':
+            continue
+        result.append({'scope': parse_labels(labels).get('scope'),
+                       'calls': int(calls),
+                       'queries': int(queries.get(labels + '|sum', 0)),
+                       'seconds': seconds.get(labels + '|sum', 0.0)})
+    return sorted(result, key=lambda a: a['seconds'], reverse=True)
+
+
+def call_site():
+    """
+    Return 'file:line in function' of the innermost frame outside of the libraries that issued the statement.
+
+    That's the app's code, or a caller of the libraries outside of the app (like a test).
+    Paths are relative to the project's directory.
+
+    :return: str or None
+    """
+    for frame in reversed(traceback.extract_stack()):
+        filename = os.path.abspath(frame.filename)
+        if frame.filename.startswith('<') or filename == THIS_FILE or filename.startswith(LIBRARY_DIRS):
+            continue
+        return '{0}:{1} in {2}'.format(os.path.relpath(filename, os.path.dirname(PACKAGE_DIR)),
+                                       frame.lineno, frame.name)
+    return None
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.monotonic())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.monotonic() - conn.info['query_start_time'].pop()
+    if current_scope() is not None:
+        _current.queries += 1
+        _current.seconds += duration
+
+    if current_app and duration >= current_app.config['APP_SLOW_QUERY_SEC']:
+        current_app.logger.warning('Slow query (%.3f s) in %s at %s: %s',
+                                   duration, current_scope(), call_site(), statement)
+
+
+class QueryRecorder(object):
+    """
+    Times the statements of all the DB engines, see the module's docstring.
+    """
+    def __init__(self, app=None):
+        self._listening = False
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['query_recorder'] = self
+        if app.config['APP_QUERY_STATS_DISABLE']:
+            return
+
+        # listen on Engine class, so that binds' engines are instrumented as well
+        if not self._listening:
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+            self._listening = True
+
+        @app.before_request
+        def start_request_scope():
+            start_scope('endpoint:{0}'.format(request.endpoint))
+
+        @app.teardown_request
+        def end_request_scope(exc=None):
+            end_scope()
+
+
+@task_prerun.connect
+def start_task_scope(task=None, **kwargs):
+    start_scope('task:{0}'.format(task.name))
+
+
+@task_postrun.connect
+def end_task_scope(**kwargs):
+    end_scope()
@@ -0,0 +1,149 @@
+"""
+Redis-backed rate limiter for outbound Telegram messages.
+
+Telegram allows roughly 30 messages per second overall, 1 message per second
+to the same private chat and 20 messages per minute to the same group.
+The limiter keeps a global bucket and a bucket per chat in Redis, so that
+the limits are shared by all the send workers.
+
+Buckets are implemented as GCRA (generic cell rate algorithm), which is
+an equivalent of the token bucket storing a single timestamp per bucket.
+A call to RateLimiter.reserve() takes a token from all the buckets at once
+and returns the delay after which the message may be sent.
+"""
+
+import math
+import time
+import redis
+from flask import current_app
+
+
+# KEYS: bucket keys
+# ARGV[1]: current time (ms), then a pair of (emission interval, burst tolerance) in ms per key
+# return: delay (ms) after which the reserved message may be sent
+RESERVE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local allowed_at = now
+local tats = {}
+for i, key in ipairs(KEYS) do
+    local tolerance = tonumber(ARGV[2 * i + 1])
+    local tat = tonumber(redis.call('GET', key) or now)
+    if tat < now then
+        tat = now
+    end
+    tats[i] = tat
+    if tat - tolerance > allowed_at then
+        allowed_at = tat - tolerance
+    end
+end
+for i, key in ipairs(KEYS) do
+    local interval = tonumber(ARGV[2 * i])
+    local tat = math.max(tats[i], allowed_at) + interval
+    redis.call('SET', key, tat, 'PX', math.ceil(tat - now))
+end
+return math.ceil(allowed_at - now)
+"""
+
+# KEYS[1]: bucket key
+# ARGV[1]: current time (ms), ARGV[2]: pause until (ms), ARGV[3]: burst tolerance (ms)
+PAUSE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local tat = tonumber(ARGV[2]) + tonumber(ARGV[3])
+local current = tonumber(redis.call('GET', KEYS[1]) or 0)
+if tat > current then
+    redis.call('SET', KEYS[1], tat, 'PX', math.ceil(tat - now))
+end
+return 0
+"""
+
+
+class RateLimiter(object):
+    """
+    Global and per-chat rate limiter shared across processes through Redis.
+    """
+    def __init__(self, app=None):
+        self._redis = None
+        self._script = None
+        self._pause_script = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['rate_limiter'] = self
+
+    @property
+    def redis(self):
+        # redis-py connection pool re-connects itself after fork
+        if self._redis is None:
+            self._redis = redis.StrictRedis(host=current_app.config['DEQUE_HOST'],
+                                            port=current_app.config['DEQUE_PORT'])
+        return self._redis
+
+    @property
+    def script(self):
+        if self._script is None:
+            self._script = self.redis.register_script(RESERVE_SCRIPT)
+        return self._script
+
+    @property
+    def pause_script(self):
+        if self._pause_script is None:
+            self._pause_script = self.redis.register_script(PAUSE_SCRIPT)
+        return self._pause_script
+
+    def key(self, *parts):
+        return ':'.join([current_app.config['TELEGRAM_RATE_KEY_PREFIX']] + [str(p) for p in parts])
+
+    def buckets(self, chat_id=None):
+        """
+        Return list of (key, emission interval in ms, burst) for the buckets a message passes.
+
+        Group chats (negative chat_id) get their own per-minute limit.
+
+        :param chat_id: int or None
+        :return: list of tuples
+        """
+        config = current_app.config
+        buckets = [(self.key('global'),
+                    1000.0 / config['TELEGRAM_RATE_GLOBAL_PER_SEC'],
+                    config['TELEGRAM_RATE_GLOBAL_PER_SEC'])]
+        if chat_id is not None:
+            if chat_id < 0:
+                interval = 60000.0 / config['TELEGRAM_RATE_GROUP_PER_MIN']
+            else:
+                interval = 1000.0 / config['TELEGRAM_RATE_CHAT_PER_SEC']
+            buckets.append((self.key('chat', chat_id), interval, 1))
+        return buckets
+
+    def reserve(self, chat_id=None):
+        """
+        Reserve a slot for a message to the given chat, return delay in seconds.
+
+        The slot is taken even if delay is greater than zero,
+        so the caller should send the message after the delay without reserving again.
+
+        :param chat_id: int or None (global bucket only)
+        :return: float
+        """
+        buckets = self.buckets(chat_id)
+        keys = [key for key, _, _ in buckets]
+        args = [int(time.time() * 1000)]
+        for _, interval, burst in buckets:
+            args.extend([interval, max(math.ceil(burst) - 1, 0) * interval])
+        delay_ms = self.script(keys=keys, args=args)
+        return max(int(delay_ms), 0) / 1000.0
+
+    def pause(self, seconds, chat_id=None):
+        """
+        Stop sending messages to the given chat (or all the chats) for the given time.
+
+        Used when Telegram replies with 429 Too Many Requests and 'retry_after' parameter.
+
+        :param seconds: float
+        :param chat_id: int or None (pause the global bucket)
+        :return: None
+        """
+        key, interval, burst = self.buckets(chat_id)[-1]
+        now = int(time.time() * 1000)
+        self.pause_script(keys=[key],
+                          args=[now, now + int(seconds * 1000), max(math.ceil(burst) - 1, 0) * interval])
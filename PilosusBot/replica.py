@@ -0,0 +1,122 @@
+"""
+Routing of read-only queries to a read replica of the DB.
+
+If DATABASE_REPLICA_URL is set, the select stage and the dashboard's
+lists read from the 'replica' bind, so that writes to the primary
+(e.g. bulk imports) do not slow down replies.
+
+The replica is checked at most every APP_DB_REPLICA_CHECK_SEC. Reads go to the
+primary while the replica is unavailable or lags behind by more than
+APP_DB_REPLICA_MAX_LAG_SEC (PostgreSQL streaming replicas only, other replicas
+are assumed to be up to date).
+"""
+
+import time
+from flask import current_app, _app_ctx_stack
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy import orm
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from . import db
+
+
+BIND = 'replica'
+
+# seconds since the last transaction replayed by a PostgreSQL standby, NULL on a primary
+PG_LAG_SQL = 'SELECT EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())'
+
+
+class ReadReplica(object):
+    """
+    Sessions of the replica bind with fallback to the primary.
+    """
+    def __init__(self, app=None):
+        self._available = False
+        self._checked_at = None
+        # scoped to the app context, just like Flask-SQLAlchemy's session
+        self.session = orm.scoped_session(self._create_session,
+                                          scopefunc=_app_ctx_stack.__ident_func__)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['read_replica'] = self
+
+        @app.teardown_appcontext
+        def remove_replica_session(exc=None):
+            self.session.remove()
+
+    @staticmethod
+    def _create_session():
+        # engine is looked up for each session, so that it can be recreated (see dbpool.reset_engines)
+        return orm.Session(bind=db.get_engine(current_app, bind=BIND), query_cls=BaseQuery)
+
+    @staticmethod
+    def configured():
+        return BIND in (current_app.config['SQLALCHEMY_BINDS'] or {})
+
+    def lag(self):
+        """
+        Return replication lag of the replica in seconds.
+
+        :return: float
+        """
+        engine = db.get_engine(current_app, bind=BIND)
+        if engine.dialect.name != 'postgresql':
+            engine.execute('SELECT 1')
+            return 0.0
+        return float(engine.execute(PG_LAG_SQL).scalar() or 0.0)
+
+    def available(self):
+        """
+        Return True if reads should go to the replica.
+
+        :return: bool
+        """
+        if not self.configured():
+            return False
+
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < current_app.config['APP_DB_REPLICA_CHECK_SEC']:
+            return self._available
+        self._checked_at = now
+
+        try:
+            lag = self.lag()
+        except SQLAlchemyError as err:
+            current_app.logger.warning('Read replica is not available, reading from the primary: %s', err)
+            self._available = False
+            return False
+
+        self._available = lag <= current_app.config['APP_DB_REPLICA_MAX_LAG_SEC']
+        if not self._available:
+            current_app.logger.warning('Read replica lags by %.1f s, reading from the primary', lag)
+        return self._available
+
+    def mark_unavailable(self, err):
+        current_app.logger.warning('Read replica failed, reading from the primary: %s', err)
+        self._available = False
+        self._checked_at = time.monotonic()
+
+    def query(self, *entities):
+        """
+        Return query of the replica's session if the replica is available, of the primary's otherwise.
+
+        :return: flask_sqlalchemy.BaseQuery
+        """
+        session = self.session if self.available() else db.session
+        return session.query(*entities)
+
+    def run(self, f, *args, **kwargs):
+        """
+        Return f(session, *args, **kwargs) run with the replica's session.
+
+        The function is run again with the primary's session if the replica
+        is not available or fails.
+        """
+        if self.available():
+            try:
+                return f(self.session, *args, **kwargs)
+            except OperationalError as err:
+                self.session.rollback()
+                self.mark_unavailable(err)
+        return f(db.session, *args, **kwargs)
@@ -0,0 +1,233 @@
+"""
+Asyncio consumer of the send queue.
+
+An alternative to the prefork Celery worker for the send queue. A single
+process keeps up to TELEGRAM_ASYNC_CONCURRENCY sendMessage requests in flight
+using aiohttp, within the budget of the shared rate limiter.
+
+Messages are received from the broker by kombu in a separate thread
+(kombu is not asyncio-aware) and handed over to the event loop, which sends
+them and returns them to the consumer thread for acknowledgement.
+Unacknowledged messages are redelivered by the broker if the process dies.
+
+Messages with an ETA (retries and rate limiter delays) are held on the event
+loop until due without counting against the prefetch limit, just like Celery
+workers do. Messages the rate limiter delays by more than REQUEUE_DELAY_SEC are
+requeued with a countdown instead of being held.
+
+The consumer should be launched instead of the Celery worker for the send queue:
+(venv) $ python manage.py sendworker -c 200
+"""
+
+import asyncio
+import logging
+import queue
+import socket
+import threading
+import time
+from datetime import timezone
+import aiohttp
+from celery.utils.iso8601 import parse_iso8601
+from flask import current_app
+from kombu import Connection, Exchange, Queue
+from . import limiter
+from .tasks import send_message_to_chat, retry_countdown, record_delivery_status, stage_queue
+from .processing import record_status
+from .telegram_api import send_message_payload, JSON_HEADERS
+from .metrics import SEND_SECONDS
+
+
+logger = logging.getLogger(__name__)
+
+# rate limiter delays longer than that are not waited for on the event loop
+REQUEUE_DELAY_SEC = 1.0
+
+
+def eta_delay(headers):
+    """
+    Return number of seconds left until the message's ETA, 0 if it has none.
+
+    :param headers: dict (Celery message headers)
+    :return: float
+    """
+    if not headers.get('eta'):
+        return 0.0
+    eta = parse_iso8601(headers['eta'])
+    if eta.tzinfo is None:
+        eta = eta.replace(tzinfo=timezone.utc)
+    return max(eta.timestamp() - time.time(), 0.0)
+
+
+class AsyncSender(object):
+    """
+    Send queue consumer multiplexing Bot API calls on a single event loop.
+
+    Should be run with the app context pushed.
+    """
+    def __init__(self, app, concurrency=None, loop=None):
+        self.app = app
+        self.concurrency = concurrency or app.config['TELEGRAM_ASYNC_CONCURRENCY']
+        self.loop = loop or asyncio.get_event_loop()
+        # created on the event loop, see start
+        self.semaphore = None
+        self.session = None
+        # messages handled by the event loop, to be acknowledged by the consumer thread
+        self.acks = queue.Queue()
+        self.stopped = threading.Event()
+        # delivery tags of the messages waiting for their ETA, not counted against prefetch
+        self.held = set()
+        self.consumer = None
+
+    def run(self):
+        consumer = threading.Thread(target=self.consume, name='send-consumer', daemon=True)
+        self.loop.run_until_complete(self.start())
+        consumer.start()
+        logger.warning('Async sender started with concurrency %d', self.concurrency)
+        try:
+            self.loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            consumer.join()
+            self.loop.run_until_complete(self.stop())
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        self.session = aiohttp.ClientSession(connector=connector)
+
+    async def stop(self):
+        await self.session.close()
+
+    # consumer thread
+    def consume(self):
+        names = [self.app.config['CELERY_QUEUE_SEND']]
+        if self.app.config['CELERY_QUEUE_SEND_PRIORITY']:
+            names.append(self.app.config['CELERY_QUEUE_SEND_PRIORITY'])
+        send_queues = [Queue(name, Exchange(name), routing_key=name) for name in names]
+        try:
+            with Connection(self.app.config['CELERY_BROKER_URL']) as connection:
+                with connection.Consumer(send_queues,
+                                         callbacks=[self.on_message],
+                                         accept=self.app.config['CELERY_ACCEPT_CONTENT'],
+                                         prefetch_count=self.concurrency) as consumer:
+                    self.consumer = consumer
+                    while not self.stopped.is_set():
+                        self.flush_acks()
+                        try:
+                            connection.drain_events(timeout=0.1)
+                        except socket.timeout:
+                            pass
+                    self.flush_acks()
+        finally:
+            if self.loop.is_running():
+                self.loop.call_soon_threadsafe(self.loop.stop)
+
+    def update_prefetch(self):
+        # messages waiting for their ETA don't take prefetch slots of the messages ready to be sent
+        if self.consumer is not None:
+            self.consumer.qos(prefetch_count=self.concurrency + len(self.held))
+
+    def flush_acks(self):
+        released = False
+        while True:
+            try:
+                message = self.acks.get_nowait()
+            except queue.Empty:
+                break
+            message.ack()
+            if message.delivery_tag in self.held:
+                self.held.discard(message.delivery_tag)
+                released = True
+        if released:
+            self.update_prefetch()
+
+    def on_message(self, body, message):
+        # Celery message protocol v2: body is (args, kwargs, embed), task name in headers
+        if message.headers.get('task') != send_message_to_chat.name:
+            logger.error('Unexpected task in the send queue: %s', message.headers.get('task'))
+            message.reject()
+            return
+        args, kwargs, _ = body
+        if eta_delay(message.headers) > 0:
+            self.held.add(message.delivery_tag)
+            self.update_prefetch()
+        asyncio.run_coroutine_threadsafe(self.handle(message, args, kwargs), self.loop)
+
+    # event loop
+    async def handle(self, message, args, kwargs):
+        """
+        Send a message the same way send_message_to_chat task does.
+        """
+        try:
+            await self.process(args[0], message.headers,
+                               reserved=kwargs.get('reserved', False),
+                               created=kwargs.get('created'))
+        except Exception:
+            logger.exception('Failed to send message %s', message.headers.get('id'))
+        finally:
+            self.acks.put(message)
+
+    async def process(self, parsed_update, headers, reserved=False, created=None):
+        created = created or time.time()
+        chat_id = parsed_update.get('chat_id')
+        retries = headers.get('retries') or 0
+
+        # countdown set by the rate limiter or a retry
+        delay = eta_delay(headers)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        if not reserved and not current_app.config['TELEGRAM_RATE_LIMIT_DISABLE']:
+            # blocking Redis call is run in a thread, so that it doesn't stall the other sends
+            delay = await self.loop.run_in_executor(None, self.reserve, chat_id)
+            if delay > REQUEUE_DELAY_SEC:
+                self.requeue(parsed_update, delay, reserved=True, created=created, retries=retries)
+                record_status(parsed_update, 'delayed', retries=retries)
+                return {'ok': None, 'error_code': None,
+                        'description': 'Delayed by rate limiter for {0} s'.format(delay)}
+            await asyncio.sleep(delay)
+
+        async with self.semaphore:
+            result = await self.post('sendMessage', send_message_payload(parsed_update))
+
+        countdown = retry_countdown(result, chat_id, retries, created)
+        if countdown is not None:
+            self.requeue(parsed_update, countdown, reserved=False, created=created, retries=retries + 1)
+        record_delivery_status(parsed_update, result, retries, countdown)
+        return result
+
+    def reserve(self, chat_id):
+        # run in the loop's default executor, outside of the app context of the loop's thread
+        with self.app.app_context():
+            return limiter.reserve(chat_id)
+
+    @staticmethod
+    def requeue(parsed_update, countdown, reserved, created, retries):
+        send_message_to_chat.apply_async(args=[parsed_update],
+                                         kwargs={'reserved': reserved, 'created': created},
+                                         countdown=countdown,
+                                         retries=retries,
+                                         queue=stage_queue('send', parsed_update))
+
+    async def post(self, method, payload):
+        """
+        Make a POST request to the given Bot API method, return Telegram's reply.
+
+        :param method: str (Bot API method name, like 'sendMessage')
+        :param payload: bytes (JSON-encoded)
+        :return: dict
+        """
+        url = current_app.config['TELEGRAM_URL'] + method
+        with SEND_SECONDS.time(status=599) as labels:
+            try:
+                async with self.session.post(url, data=payload, headers=JSON_HEADERS,
+                                             timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC']) \
+                        as response:
+                    labels['status'] = response.status
+                    return await response.json()
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as err:
+                return {'ok': False,
+                        'error_code': 599,  # informal convention for Network connect timeout error
+                        'description': str(err)}
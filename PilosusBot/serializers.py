@@ -0,0 +1,123 @@
+"""
+Compact wire format for Celery messages of the bot's pipeline.
+
+Celery message bodies are serialized with msgpack. Parsed updates (any dict
+with 'chat_id' key) found in the body are packed with a typed, versioned schema:
+known fields are stored by position behind a bitmask of the fields present,
+unknown keys are kept in a trailing map. The whole body is compressed with zlib
+if it exceeds the given size.
+
+Registered as 'msgpack-update' kombu serializer, see register_serializer.
+"""
+
+import zlib
+import msgpack
+from kombu.serialization import register
+
+
+SERIALIZER_NAME = 'msgpack-update'
+CONTENT_TYPE = 'application/x-msgpack-update'
+
+# msgpack extension type of the parsed update
+EXT_PARSED_UPDATE = 1
+
+# parsed update fields by schema version, new fields should be appended to a new version
+SCHEMAS = {
+    1: ('chat_id', 'reply_to_message_id', 'text', 'language', 'score', 'parse_mode'),
+    2: ('chat_id', 'reply_to_message_id', 'text', 'language', 'score', 'parse_mode', 'text_ref'),
+    3: ('chat_id', 'reply_to_message_id', 'text', 'language', 'score', 'parse_mode', 'text_ref',
+        'update_id'),
+    4: ('chat_id', 'reply_to_message_id', 'text', 'language', 'score', 'parse_mode', 'text_ref',
+        'update_id', 'chat_type', 'priority'),
+}
+SCHEMA_VERSION = 4
+
+# first byte of the serialized body
+RAW = b'\x00'
+ZLIB = b'\x01'
+
+# bodies larger than 'compress_min_bytes' get compressed, 0 disables compression
+settings = {'compress_min_bytes': 0}
+
+
+def pack_update(update, version=SCHEMA_VERSION):
+    """
+    Return parsed update packed with the given schema version.
+
+    :param update: dict
+    :param version: int
+    :return: bytes
+    """
+    fields = SCHEMAS[version]
+    mask = 0
+    values = []
+    for i, field in enumerate(fields):
+        if field in update:
+            mask |= 1 << i
+            values.append(update[field])
+    extras = {key: value for key, value in update.items() if key not in fields} or None
+    return msgpack.packb([version, mask] + values + [_encode(extras)], use_bin_type=True)
+
+
+def unpack_update(data):
+    """
+    Return parsed update dict unpacked from the data packed with pack_update.
+
+    :param data: bytes
+    :return: dict
+    """
+    packed = msgpack.unpackb(data, encoding='utf-8', ext_hook=_ext_hook)
+    version, mask, values, extras = packed[0], packed[1], iter(packed[2:-1]), packed[-1]
+    try:
+        fields = SCHEMAS[version]
+    except KeyError:
+        raise ValueError('Unknown parsed update schema version: {0}'.format(version))
+    update = {field: next(values) for i, field in enumerate(fields) if mask & (1 << i)}
+    if extras:
+        update.update(extras)
+    return update
+
+
+def _encode(obj):
+    if isinstance(obj, dict):
+        if 'chat_id' in obj:
+            return msgpack.ExtType(EXT_PARSED_UPDATE, pack_update(obj))
+        return {key: _encode(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_encode(value) for value in obj]
+    return obj
+
+
+def _ext_hook(code, data):
+    if code == EXT_PARSED_UPDATE:
+        return unpack_update(data)
+    return msgpack.ExtType(code, data)
+
+
+def dumps(body):
+    data = msgpack.packb(_encode(body), use_bin_type=True)
+    if settings['compress_min_bytes'] and len(data) > settings['compress_min_bytes']:
+        return ZLIB + zlib.compress(data)
+    return RAW + data
+
+
+def loads(data):
+    if isinstance(data, str):
+        data = data.encode('latin-1')
+    header, data = data[:1], data[1:]
+    if header == ZLIB:
+        data = zlib.decompress(data)
+    elif header != RAW:
+        raise ValueError('Unknown message encoding: {0!r}'.format(header))
+    return msgpack.unpackb(data, encoding='utf-8', ext_hook=_ext_hook)
+
+
+def register_serializer(compress_min_bytes=0):
+    """
+    Register the serializer with kombu, should be called in every process using Celery.
+
+    :param compress_min_bytes: int (compress bodies larger than this, 0 disables compression)
+    """
+    settings['compress_min_bytes'] = compress_min_bytes
+    register(SERIALIZER_NAME, dumps, loads,
+             content_type=CONTENT_TYPE, content_encoding='binary')
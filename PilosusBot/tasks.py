@@ -1,29 +1,141 @@
 import indicoio
 import random
 import requests
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from indicoio.utils.errors import IndicoError, DataStructureException
 from flask import current_app
 from celery import shared_task, chain
-from .utils import score_to_closest_level as select_score_level, \
+from celery.utils.log import get_task_logger
+from .utils import score_to_closest_level as select_score_level, score_to_level, \
     detect_language_code, get_rough_sentiment_score, lang_code_to_lang_name
 from .models import Sentiment, Language
+from .processing import check_out_text, record_status, fetch_chat_members_count
+from .deadletter import dead_letter
+from .metrics import ASSESS_SECONDS, SELECT_SECONDS, SEND_SECONDS
+from .tracing import trace, trace_id_for, current_trace_id, add_span, span
+from .telegram_api import send_message_payload, JSON_HEADERS
+from . import telegram, limiter, executor, replica
 
 
-def celery_chain(parsed_update):
+logger = get_task_logger(__name__)
+
+# config options of the queues by pipeline stage, high priority lanes have '_PRIORITY' suffix
+STAGE_QUEUES = {
+    'assess': 'CELERY_QUEUE_ASSESS',
+    'select': 'CELERY_QUEUE_SELECT',
+    'send': 'CELERY_QUEUE_SEND',
+}
+
+
+def stage_queue(stage, parsed_update):
+    """
+    Return name of the queue for the given pipeline stage of the update.
+
+    High priority updates (see processing.update_priority) go to the stage's
+    priority lane, if it's configured.
+
+    :param stage: str (assess, select, send)
+    :param parsed_update: dict
+    :return: str or None (use CELERY_ROUTES)
+    """
+    option = STAGE_QUEUES[stage]
+    if parsed_update.get('priority') == 'high' and current_app.config.get(option + '_PRIORITY'):
+        return current_app.config[option + '_PRIORITY']
+    return current_app.config[option]
+
+
+def celery_chain(parsed_update, fused=None):
     """
     Celery chain of tasks, one task in the chain is executed after the previous one is done.
 
+    If CELERY_PIPELINE_FUSED config option is set (or fused argument is True),
+    a single process_update task running all the stages in-process is used instead.
+    Tasks are sent to the queues of the update's priority lane, see stage_queue.
+
+    If APP_PIPELINE_EXECUTOR is 'thread', the update is processed by the in-process
+    executor instead of Celery, see executor.PipelineExecutor.
+
     :param parsed_update: dict
-    :return: dict (with 'status_code' and 'status' keys)
+    :param fused: bool or None (use CELERY_PIPELINE_FUSED config option)
+    :return: celery.result.AsyncResult or bool (if the executor is used)
     """
-    chain_result = chain(assess_message_score.s(parsed_update),
-                         select_db_sentiment.s(),
-                         send_message_to_chat.s()).apply_async()
+    if executor.enabled:
+        accepted = executor.submit(process_update, parsed_update)
+        if not accepted:
+            record_status(parsed_update, 'rejected')
+        return accepted
+
+    if fused is None:
+        fused = current_app.config['CELERY_PIPELINE_FUSED']
+
+    if fused:
+        return process_update.apply_async(args=[parsed_update],
+                                          queue=stage_queue('assess', parsed_update))
+
+    chain_result = chain(assess_message_score.s(parsed_update).set(queue=stage_queue('assess', parsed_update)),
+                         select_db_sentiment.s().set(queue=stage_queue('select', parsed_update)),
+                         send_message_to_chat.s().set(queue=stage_queue('send', parsed_update))).apply_async()
     return chain_result
 
 
+@contextmanager
+def stage_span(spans, stage):
+    """
+    Context manager recording the time (in seconds) spent in the given pipeline stage.
+
+    The stage is also recorded as a span of the current trace, see tracing.py.
+
+    :param spans: collections.OrderedDict (stage name -> seconds)
+    :param stage: str
+    """
+    timestamp = time.time()
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        spans[stage] = time.monotonic() - start
+        add_span('stage:' + stage, timestamp, spans[stage])
+
+
+# pipeline tasks' results are passed by the chain itself and never read from the result backend,
+# see processing.record_status for the status of an update
+
+# assess queue
+@shared_task(ignore_result=True)
+def process_update(parsed_update):
+    """
+    Run all the pipeline stages (assess, select, send) in a single task.
+
+    Saves two broker round trips and result backend writes per update
+    compared to the chain of tasks. Stage boundaries are kept as timing spans only.
+
+    :param parsed_update: dict
+    :return: dict (with 'status_code' and 'status' keys)
+    """
+    spans = OrderedDict()
+
+    # trace is not set up by Celery signals if the task is run by the in-process executor
+    with trace(current_trace_id() or trace_id_for(parsed_update)):
+        with stage_span(spans, 'assess'):
+            parsed_update = assess_message_score(parsed_update)
+
+        with stage_span(spans, 'select'):
+            parsed_update = select_db_sentiment(parsed_update)
+
+        with stage_span(spans, 'send'):
+            result = deliver_message(parsed_update)
+
+    logger.info('Update processed: %s',
+                ', '.join('{0} {1:.1f} ms'.format(stage, seconds * 1000)
+                          for stage, seconds in spans.items()))
+    return result
+
+
 # assess queue
-@shared_task
+@shared_task(ignore_result=True)
+@dead_letter('assess')
 def assess_message_score(parsed_update):
     """
     Return incoming message score using either polyglot or third-party API (like inidocoio).
@@ -31,16 +143,21 @@ def assess_message_score(parsed_update):
     The task to be processed in a separate queue with rate limit in compliance with third-party API.
 
     :param parsed_update: dict containing message's text under 'text' key
+                          (or a reference to the text stored in Redis under 'text_ref' key)
     :return: updated dict with the text score index 'score' key.
              [0.0, 1.0], where 0.5 is neutral, <= 0.5 is negative, greater then 0.5 is positive
     """
-    text = parsed_update['text']
+    text = check_out_text(parsed_update)
+    checked_in = parsed_update.pop('text_ref', None) is not None
+    # keep the text until the stage is done, so that it gets into the dead-letter store on failure
+    parsed_update['text'] = text
 
     # calculate sentiment using polyglot library
-    score = get_rough_sentiment_score(text)
+    with ASSESS_SECONDS.time(engine='polyglot'):
+        score = get_rough_sentiment_score(text)
 
-    # detect text language (fallback to default language, if detected language is not in the DB)
-    lang_code_polyglot = detect_language_code(text)
+        # detect text language (fallback to default language, if detected language is not in the DB)
+        lang_code_polyglot = detect_language_code(text)
 
     lang = Language.query.filter_by(code=lang_code_polyglot).first() or \
            Language.query.filter_by(code=current_app.config['APP_LANG_FALLBACK']).first()
@@ -55,19 +172,49 @@ def assess_message_score(parsed_update):
 
     # if request to third-party API succeeded, update score
     # otherwise stay with score calculated by poyglot
-    try:
-        score = indicoio.sentiment(text, language=lang_name)
-    except (IndicoError, DataStructureException) as err:
-        pass
+    with ASSESS_SECONDS.time(engine='indicoio'):
+        try:
+            score = indicoio.sentiment(text, language=lang_name)
+        except (IndicoError, DataStructureException) as err:
+            pass
 
     # return parsed_update updated with score
     parsed_update['score'] = score
+    if checked_in:
+        del parsed_update['text']
+
+    record_status(parsed_update, 'assessed', score=score, language=lang.code)
 
     return parsed_update
 
 
+def candidate_sentiments(session, lang_code, score):
+    """
+    Return Sentiments of the language of the score level closest to the score.
+
+    :param session: DB session to query
+    :param lang_code: str
+    :param score: float
+    :return: list of Sentiment
+    """
+    # select language
+    lang = session.query(Language).filter_by(code=lang_code).first()
+
+    # find score level closest to the calculated score of the text
+    # with at least one Sentiment of the text's language in the DB
+    level = select_score_level(lang_code=lang_code,
+                               score=score,
+                               levels=sorted(list(current_app.config['APP_SCORE_LEVELS'].keys())),
+                               session=session)
+
+    # select all Sentiments of the score level and language
+    return session.query(Sentiment).filter(Sentiment.level == score_to_level(level),
+                                           Sentiment.language == lang).all()
+
+
 # select queue
-@shared_task
+@shared_task(ignore_result=True)
+@dead_letter('select')
 def select_db_sentiment(parsed_update):
     """
     Return sentiment from the database.
@@ -78,22 +225,13 @@ def select_db_sentiment(parsed_update):
     :return: dict updated
     """
 
-    # unpack score, text, language
+    # unpack score, language
     score = parsed_update['score']
-    text = parsed_update['text']
     lang_code = parsed_update['language']
 
-    # select language
-    lang = Language.query.filter_by(code=lang_code).first()
-
-    # find score level closest to the calculated score of the text
-    # with at least one Sentiment of the text's language in the DB
-    level = select_score_level(lang_code=lang_code,
-                               score=score,
-                               levels=sorted(list(current_app.config['APP_SCORE_LEVELS'].keys())))
-
-    # select all Sentiments of the score level and language
-    sentiments = Sentiment.query.filter(Sentiment.score == level, Sentiment.language == lang).all()
+    with SELECT_SECONDS.time(source='db'):
+        # read replica if available, see replica.py
+        sentiments = replica.run(candidate_sentiments, lang_code, score)
 
     # select a Sentiment randomly,
     # select first Sentiment in a list if it's a list of length 1, so that rnd
@@ -109,37 +247,213 @@ def select_db_sentiment(parsed_update):
     else:
         parsed_update['text'] = sentiment.body
 
+    record_status(parsed_update, 'selected', sentiment_id=sentiment.id)
+
     return parsed_update
 
 
 # send queue
-@shared_task
-def send_message_to_chat(parsed_update):
+@shared_task(bind=True, ignore_result=True)
+def send_message_to_chat(self, parsed_update, reserved=False, created=None):
     """
     Send sentiment to the chat
 
-    The task to be processed in a separate queue with rate limit in compliance with Telegram API.
+    See deliver_message for rate limiting and retries.
+
+    :param parsed_update: dict ('text', 'chat_id', 'reply_to_message_id' keys are mandatory)
+    :param reserved: bool (True if a rate limiter slot has already been reserved for the message)
+    :param created: float (timestamp of the first attempt to send the message)
+    :return: dict (with 'status_code' and 'status' keys)
+    """
+    # function's return is not stored in the result backend,
+    # see processing.record_status for the status of the message
+    return deliver_message(parsed_update, reserved=reserved, created=created,
+                           retries=self.request.retries or 0)
+
+
+def deliver_message(parsed_update, reserved=False, created=None, retries=0):
+    """
+    Send the message in compliance with Telegram API limits, schedule a retry if needed.
+
+    If the rate limiter asks for a delay, the message is handed over to
+    send_message_to_chat task with the countdown of that delay.
+
+    The message is sent again by send_message_to_chat task if Telegram replies
+    with 429 Too Many Requests, with 5xx or if a network error occurs, see retry_countdown.
 
     :param parsed_update: dict ('text', 'chat_id', 'reply_to_message_id' keys are mandatory)
+    :param reserved: bool (True if a rate limiter slot has already been reserved for the message)
+    :param created: float (timestamp of the first attempt to send the message)
+    :param retries: int (number of retries made so far)
     :return: dict (with 'status_code' and 'status' keys)
     """
-    url = current_app.config['TELEGRAM_URL'] + 'sendMessage'
+    created = created or time.time()
+    chat_id = parsed_update.get('chat_id')
+
+    if chat_id is None:
+        # nothing to send, don't take a rate limiter slot
+        return {'ok': None, 'error_code': None, 'description': 'No chat to send the message to'}
+
+    if not reserved and not current_app.config['TELEGRAM_RATE_LIMIT_DISABLE']:
+        delay = limiter.reserve(chat_id)
+        if delay > 0:
+            resend_message(parsed_update, delay, reserved=True, created=created, retries=retries)
+            record_status(parsed_update, 'delayed', retries=retries)
+            return {'ok': None, 'error_code': None,
+                    'description': 'Delayed by rate limiter for {0} s'.format(delay)}
+
+    result = post_message(parsed_update)
+
+    countdown = retry_countdown(result, chat_id, retries, created)
+    if countdown is not None:
+        resend_message(parsed_update, countdown, reserved=False, created=created, retries=retries + 1)
+    record_delivery_status(parsed_update, result, retries, countdown)
+    return result
+
+
+def resend_message(parsed_update, countdown, reserved, created, retries):
+    """
+    Schedule sending of the message in the given number of seconds.
+
+    The message is handed over to send_message_to_chat task,
+    or to the in-process executor if it's enabled.
+
+    :param parsed_update: dict
+    :param countdown: float
+    :param reserved: bool (True if a rate limiter slot has already been reserved for the message)
+    :param created: float (timestamp of the first attempt to send the message)
+    :param retries: int (number of retries made so far)
+    :return: None
+    """
+    if executor.enabled:
+        executor.submit(deliver_message, parsed_update, countdown=countdown,
+                        reserved=reserved, created=created, retries=retries)
+        return
+
+    send_message_to_chat.apply_async(args=[parsed_update],
+                                     kwargs={'reserved': reserved, 'created': created},
+                                     countdown=countdown,
+                                     retries=retries,
+                                     queue=stage_queue('send', parsed_update))
+
+
+def record_delivery_status(parsed_update, result, retries, countdown):
+    """
+    Record the status of the update after a sendMessage attempt.
+
+    :param parsed_update: dict
+    :param result: dict (Telegram's reply)
+    :param retries: int (number of retries made so far)
+    :param countdown: float or None (see retry_countdown)
+    :return: None
+    """
+    if result.get('ok'):
+        record_status(parsed_update, 'sent', retries=retries)
+    else:
+        record_status(parsed_update, 'retrying' if countdown is not None else 'failed',
+                      retries=retries, error_code=result.get('error_code'),
+                      description=result.get('description'))
+
+
+def post_message(parsed_update):
+    """
+    Make sendMessage request to Telegram API, return Telegram's reply.
+
+    :param parsed_update: dict
+    :return: dict (with 'ok', 'error_code' and 'description' keys on error)
+    """
     result = {'ok': None, 'error_code': None, 'description': None}
 
     # make a request to telegram API, catch exceptions if any, return status
-    try:
-        r = requests.post(url,
-                          json=parsed_update,
-                          timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'])
-    except requests.exceptions.RequestException as err:
-        result['ok'] = False
-        result['error_code'] = 599  # informal convention for Network connect timeout error
-        result['description'] = str(err)
-    else:
-        result = r.json()
+    with SEND_SECONDS.time(status=599) as labels:
+        try:
+            with span('telegram'):
+                r = telegram.post('sendMessage',
+                                  data=send_message_payload(parsed_update),
+                                  headers=JSON_HEADERS,
+                                  timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'])
+        except requests.exceptions.RequestException as err:
+            result['ok'] = False
+            result['error_code'] = 599  # informal convention for Network connect timeout error
+            result['description'] = str(err)
+        else:
+            labels['status'] = r.status_code
+            result = r.json()
 
-    # function's return can be accessed through Celery chains or other structures,
-    # but won't be accessible for the view it's called from,
-    # unless the view will be changed to explicitly wait for result like this:
-    # result.get(timeout=10)
     return result
+
+
+def retry_countdown(result, chat_id, retries, created):
+    """
+    Return number of seconds to wait before sending the message again, None if it should not be retried.
+
+    429 Too Many Requests is retried after 'retry_after' seconds Telegram asks to wait,
+    the chat (or all the chats, if chat_id unknown) is paused in the rate limiter for that time.
+    5xx and network errors (599) are retried with exponential backoff and jitter.
+    Retries stop after TELEGRAM_RETRY_MAX attempts or TELEGRAM_RETRY_MAX_AGE_SEC seconds.
+
+    :param result: dict (Telegram's reply)
+    :param chat_id: int or None
+    :param retries: int (number of retries made so far)
+    :param created: float (timestamp of the first attempt to send the message)
+    :return: float or None
+    """
+    error_code = result.get('error_code')
+    countdown = None
+
+    if error_code == 429 and (result.get('parameters') or {}).get('retry_after'):
+        retry_after = result['parameters']['retry_after']
+        if not current_app.config['TELEGRAM_RATE_LIMIT_DISABLE']:
+            limiter.pause(retry_after, chat_id)
+        countdown = float(retry_after)
+    elif error_code is not None and error_code >= 500 or error_code == 429:
+        backoff = min(current_app.config['TELEGRAM_RETRY_BACKOFF_SEC'] * 2 ** retries,
+                      current_app.config['TELEGRAM_RETRY_BACKOFF_MAX_SEC'])
+        countdown = backoff * random.uniform(0.5, 1.0)
+
+    if countdown is None or \
+            retries >= current_app.config['TELEGRAM_RETRY_MAX'] or \
+            time.time() + countdown - created >= current_app.config['TELEGRAM_RETRY_MAX_AGE_SEC']:
+        return None
+
+    return countdown
+
+
+# chat size for priority lanes, see processing.update_priority
+@shared_task(ignore_result=True)
+def refresh_chat_members_count(chat_id):
+    """
+    Request number of members of the chat from Telegram and cache it.
+
+    :param chat_id: int
+    :return: None
+    """
+    fetch_chat_members_count(chat_id)
+
+
+def replay_dead_letter(entry):
+    """
+    Send the update saved to the dead-letter store to the stage it failed in.
+
+    The rest of the pipeline follows the stage as usual.
+
+    :param entry: dict (see deadletter.add)
+    :return: None
+    """
+    parsed_update = entry['payload']
+    stage = entry['stage']
+
+    if stage == 'assess':
+        celery_chain(parsed_update)
+    elif stage == 'send':
+        # the reply has been selected already
+        resend_message(parsed_update, 0, reserved=False, created=None, retries=0)
+    elif executor.enabled:
+        executor.submit(replay_from_select, parsed_update)
+    else:
+        chain(select_db_sentiment.s(parsed_update).set(queue=stage_queue('select', parsed_update)),
+              send_message_to_chat.s().set(queue=stage_queue('send', parsed_update))).apply_async()
+
+
+def replay_from_select(parsed_update):
+    deliver_message(select_db_sentiment(parsed_update))
@@ -0,0 +1,154 @@
+"""
+Telegram Bot API client.
+
+Bot API calls go through a single keep-alive requests.Session per process,
+so that TCP and TLS handshakes to api.telegram.org are paid once per pooled
+connection instead of once per reply.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import requests
+from flask import current_app
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+logger = logging.getLogger(__name__)
+
+# documented fields of Bot API sendMessage method
+# see https://core.telegram.org/bots/api#sendmessage
+SEND_MESSAGE_FIELDS = ('chat_id', 'text', 'parse_mode', 'disable_web_page_preview',
+                       'disable_notification', 'reply_to_message_id', 'reply_markup')
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+# per-thread accumulator of the time spent establishing connections
+_timings = threading.local()
+
+
+def send_message_payload(parsed_update):
+    """
+    Return JSON-encoded body of sendMessage request built from the given parsed update.
+
+    Only documented sendMessage fields get into the payload, so that internal keys
+    (like 'score' or 'language') are never sent to Telegram.
+    The payload is encoded once and can be posted as is by any HTTP client.
+
+    >>> send_message_payload({'chat_id': 1, 'text': 'Hi', 'score': 0.5})
+    b'{"chat_id":1,"text":"Hi"}'
+
+    :param parsed_update: dict
+    :return: bytes
+    """
+    payload = {field: parsed_update[field] for field in SEND_MESSAGE_FIELDS
+               if parsed_update.get(field) is not None}
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), sort_keys=True).encode('utf-8')
+
+
+def _timed_connection(connection_cls):
+    """
+    Return a subclass of the given urllib3 connection class that records connect time.
+
+    For HTTPS connections connect() includes the TLS handshake.
+    """
+    class TimedConnection(connection_cls):
+        def connect(self):
+            start = time.monotonic()
+            try:
+                super(TimedConnection, self).connect()
+            finally:
+                _timings.connect = getattr(_timings, 'connect', 0.0) + time.monotonic() - start
+    return TimedConnection
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _timed_connection(HTTPConnectionPool.ConnectionCls)
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _timed_connection(HTTPSConnectionPool.ConnectionCls)
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connection pools record connection (handshake) time.
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        super(TimedHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+class TelegramClient(object):
+    """
+    Per-process Telegram Bot API client with a pooled keep-alive session.
+
+    The session is created lazily and re-created whenever the client is used
+    in a process other than the one that created it, so that sockets are never
+    shared between a parent and its forked children (Celery prefork, uWSGI).
+    """
+    def __init__(self, app=None):
+        self.pool_size = 1
+        self._session = None
+        self._pid = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.pool_size = app.config['TELEGRAM_POOL_SIZE']
+        app.extensions['telegram'] = self
+
+    @property
+    def session(self):
+        if self._session is None or self._pid != os.getpid():
+            self._session = self._create_session()
+            self._pid = os.getpid()
+        return self._session
+
+    def _create_session(self):
+        session = requests.Session()
+        adapter = TimedHTTPAdapter(pool_connections=1,
+                                   pool_maxsize=self.pool_size,
+                                   pool_block=False)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def reset(self):
+        """
+        Drop the current session, the next call creates a new one.
+
+        Should be called in a child process right after fork.
+        """
+        # sockets of the inherited session belong to the parent,
+        # so just forget them instead of closing
+        self._session = None
+        self._pid = None
+
+    def post(self, method, **kwargs):
+        """
+        Make a POST request to the given Bot API method, return requests.Response.
+
+        Handshake and request time are logged for each call.
+        requests.exceptions.RequestException is not caught.
+
+        :param method: str (Bot API method name, like 'sendMessage')
+        :param kwargs: keyword arguments passed to requests.Session.post
+        :return: requests.Response
+        """
+        url = current_app.config['TELEGRAM_URL'] + method
+        kwargs.setdefault('timeout', current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'])
+
+        _timings.connect = 0.0
+        start = time.monotonic()
+        try:
+            return self.session.post(url, **kwargs)
+        finally:
+            total = time.monotonic() - start
+            handshake = _timings.connect
+            logger.info('Telegram %s: handshake %.1f ms, request %.1f ms',
+                        method, handshake * 1000, (total - handshake) * 1000)
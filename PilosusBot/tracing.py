@@ -0,0 +1,195 @@
+"""
+End-to-end traces of updates going through the pipeline.
+
+Trace id is derived from the update's update_id by the webhook and sent
+along with every task of the chain in the message headers ('trace_id').
+Each time a task is published, the message is stamped with the time
+('enqueued_at'), so that the worker knows how long the task has been waiting.
+
+Spans recorded for each update:
+- queue:<stage> - time the task waited in the broker's queue
+- run:<stage> - time the task was running
+- telegram - round trip of sendMessage request
+
+Spans are added to a capped Redis stream (requires Redis 5.0+)
+shown in the dashboard's Traces page. Spans recorded within a trace block
+or a task are buffered by the thread and added with a single pipelined
+round trip at the end of the block or the task, see flush_spans.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+import redis
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from flask import current_app
+from .processing import get_redis
+
+
+# trace of the update being handled by the current thread
+_current = threading.local()
+
+
+def trace_id_for(parsed_update):
+    """
+    Return trace id of the update, None if the update has no update_id.
+
+    :param parsed_update: dict
+    :return: str or None
+    """
+    update_id = parsed_update.get('update_id') if isinstance(parsed_update, dict) else None
+    return str(update_id) if update_id is not None else None
+
+
+def current_trace_id():
+    return getattr(_current, 'trace_id', None)
+
+
+@contextmanager
+def trace(trace_id):
+    """
+    Make spans recorded and tasks published within the block belong to the given trace.
+
+    :param trace_id: str or None
+    """
+    previous = current_trace_id()
+    _current.trace_id = trace_id
+    _current.depth = getattr(_current, 'depth', 0) + 1
+    try:
+        yield trace_id
+    finally:
+        _current.trace_id = previous
+        _current.depth -= 1
+        if not _buffering():
+            flush_spans()
+
+
+def _buffering():
+    # within a trace block or a task, spans are added when it ends
+    return getattr(_current, 'depth', 0) > 0 or getattr(_current, 'task_start', None) is not None
+
+
+def _pending_spans():
+    if not hasattr(_current, 'spans'):
+        _current.spans = []
+    return _current.spans
+
+
+def add_span(name, start, duration, trace_id=None):
+    """
+    Add the span to the trace (the current one if trace_id is not given).
+
+    :param name: str
+    :param start: float (timestamp)
+    :param duration: float (seconds)
+    :param trace_id: str or None
+    :return: None
+    """
+    trace_id = trace_id or current_trace_id()
+    if trace_id is None or current_app.config['APP_TRACE_DISABLE']:
+        return
+    _pending_spans().append((trace_id, name, start, duration))
+    if not _buffering():
+        flush_spans()
+
+
+def flush_spans():
+    """
+    Add the spans buffered by the current thread to the stream in a single round trip.
+
+    :return: None
+    """
+    spans = _pending_spans()
+    if not spans:
+        return
+    _current.spans = []
+
+    key = current_app.config['APP_TRACE_STREAM_KEY']
+    max_len = current_app.config['APP_TRACE_STREAM_MAX_LEN']
+    pipe = get_redis().pipeline(transaction=False)
+    for trace_id, name, start, duration in spans:
+        pipe.execute_command('XADD', key, 'MAXLEN', '~', max_len, '*',
+                             'trace', trace_id, 'span', name,
+                             'start', '{0:.6f}'.format(start),
+                             'duration', '{0:.6f}'.format(duration))
+    try:
+        pipe.execute()
+    except redis.RedisError as err:
+        current_app.logger.warning('Cannot record %d spans: %s', len(spans), err)
+
+
+@contextmanager
+def span(name):
+    """
+    Record time spent in the block as a span of the current trace.
+    """
+    start = time.time()
+    try:
+        yield
+    finally:
+        add_span(name, start, time.time() - start)
+
+
+def traces(count):
+    """
+    Return the traces of the latest spans, the most recent trace first.
+
+    Each trace is a dict with 'id', 'start', 'duration' (from the first span's
+    start to the last span's end) and 'spans' (list of dicts with 'name', 'start',
+    'duration', ordered by start) keys.
+
+    :param count: int (number of the latest spans to read)
+    :return: list of dicts
+    """
+    entries = get_redis().execute_command('XREVRANGE', current_app.config['APP_TRACE_STREAM_KEY'],
+                                          '+', '-', 'COUNT', count)
+    by_id = {}
+    for _, fields in entries:
+        fields = dict(zip(*[iter(value.decode('utf-8') for value in fields)] * 2))
+        by_id.setdefault(fields['trace'], []).append({'name': fields['span'],
+                                                      'start': float(fields['start']),
+                                                      'duration': float(fields['duration'])})
+    result = []
+    for trace_id, spans in by_id.items():
+        spans.sort(key=lambda s: s['start'])
+        start = spans[0]['start']
+        end = max(s['start'] + s['duration'] for s in spans)
+        result.append({'id': trace_id, 'start': start, 'duration': end - start, 'spans': spans})
+    return sorted(result, key=lambda t: t['start'], reverse=True)
+
+
+def _stage(task_name):
+    return task_name.rsplit('.', 1)[-1]
+
+
+@before_task_publish.connect
+def stamp_headers(headers=None, body=None, **kwargs):
+    # protocol v2: custom headers end up as the task's request attributes
+    if headers is None:
+        return
+    headers['enqueued_at'] = time.time()
+    if not headers.get('trace_id'):
+        args = body[0] if isinstance(body, (list, tuple)) and body else None
+        headers['trace_id'] = current_trace_id() or (trace_id_for(args[0]) if args else None)
+
+
+@task_prerun.connect
+def start_task_span(task=None, args=None, **kwargs):
+    request = task.request
+    trace_id = getattr(request, 'trace_id', None) or (trace_id_for(args[0]) if args else None)
+    _current.trace_id = trace_id
+    _current.task_start = time.time()
+
+    enqueued_at = getattr(request, 'enqueued_at', None)
+    if trace_id and enqueued_at and not request.is_eager:
+        add_span('queue:' + _stage(task.name), enqueued_at, max(_current.task_start - enqueued_at, 0))
+
+
+@task_postrun.connect
+def end_task_span(task=None, **kwargs):
+    start = getattr(_current, 'task_start', None)
+    if start is not None:
+        add_span('run:' + _stage(task.name), start, time.time() - start)
+    _current.trace_id = None
+    _current.task_start = None
+    flush_spans()
@@ -1,3 +1,4 @@
+import math
 from polyglot.detect import Detector
 from polyglot.detect import langids as langs
 from polyglot.text import Text
@@ -5,6 +6,9 @@ from polyglot.detect.base import UnknownLanguage
 from polyglot.downloader import downloader
 from flask import current_app
 
+# sentiment scores are stored as integers: score * SCORE_LEVEL_SCALE
+SCORE_LEVEL_SCALE = 1000
+
 
 def download_polyglot_dicts():
     """Download dictionaries needed for Polyglot library.
@@ -61,6 +65,41 @@ def map_value_from_range_to_new_range(old_value, old_slice=slice(-1.0, 1.0), new
            new_slice.start
 
 
+def score_to_level(score):
+    """
+    Return integer score level for a given sentiment score.
+
+    Score levels are stored as small integers, so that they can be matched
+    exactly and indexed compactly, unlike floats. Halves are rounded up
+    (floor(x + 0.5)), not to even like round() does, the same way the
+    migration backfilling levels does.
+
+    >>> score_to_level(0.375)
+    375
+    >>> score_to_level(0.0125)
+    13
+    >>> score_to_level(1.0)
+    1000
+
+    :param score: float
+    :return: int
+    """
+    return int(math.floor(score * SCORE_LEVEL_SCALE + 0.5))
+
+
+def level_to_score(level):
+    """
+    Return sentiment score for a given integer score level.
+
+    >>> level_to_score(625)
+    0.625
+
+    :param level: int
+    :return: float
+    """
+    return level / SCORE_LEVEL_SCALE
+
+
 def detect_language_code(text):
     """
     Return language code, fall back to app's default language if detected language not in the DB.
@@ -105,7 +144,7 @@ def lang_code_to_lang_name(code):
     return langs.isoLangs[code]['name'].split(';')[0]
 
 
-def score_to_closest_level(lang_code, score, levels):
+def score_to_closest_level(lang_code, score, levels, session=None):
     """
     Return level from the given list of score levels, the nearest to the given score.
 
@@ -124,11 +163,16 @@ def score_to_closest_level(lang_code, score, levels):
     :param lang_code: str
     :param score: float (min(levels) <= score <= max(levels) )
     :param levels: list of floats [-1.0, 1.0] including 0.5
+    :param session: DB session to query (the app's default session if None)
     :return: float (score level for which at least one Sentiment
                    in given language exists in the DB)
     """
-    from .models import Sentiment, Language
-    lang = Language.query.filter_by(code=lang_code).first()
+    from .models import SentimentCount, Language
+    from . import db
+    session = session or db.session
+    lang = session.query(Language).filter_by(code=lang_code).first()
+    # levels with at least one Sentiment, see SentimentCount
+    available_levels = SentimentCount.levels(lang.id, session=session) if lang else set()
     neutral_score = 0.5
     neutral_score_idx = levels.index(neutral_score)
 
@@ -169,9 +213,7 @@ def score_to_closest_level(lang_code, score, levels):
 
         # if there's at least one sentiment for the level, return this level
         level = new_levels[cur_idx]
-        sentiment = Sentiment.query.filter(Sentiment.score == level, Sentiment.language == lang).first()
-
-        if sentiment:
+        if score_to_level(level) in available_levels:
             break
 
     return level
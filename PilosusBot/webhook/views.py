@@ -3,12 +3,15 @@ import requests
 
 from flask import jsonify, request, url_for, current_app
 from ..models import Permission
-from .. import csrf
+from .. import csrf, telegram
+from ..metrics import WEBHOOK_SECONDS, DEDUPE_SECONDS, UPDATES_PROCESSED, UPDATES_DROPPED
+from ..tracing import trace, trace_id_for
 from . import webhook
 from .decorators import permission_required
 from .authentication import auth
-from ..processing import parse_update, parsed_update_can_be_processed
-from ..tasks import celery_chain, send_message_to_chat
+from ..processing import parse_update, parsed_update_can_be_processed, check_in_text, \
+    record_status, update_priority
+from ..tasks import celery_chain
 
 
 TELEGRAM_API_KEY = os.environ.get('TELEGRAM_TOKEN')
@@ -54,7 +57,7 @@ def set_webhook(action):
     # make a request to telegram API, catch exceptions if any, return status
     try:
         # set timeout to 120s, since we want server to unset bot even under high load/DDoS
-        response = requests.post(url=current_app.config['TELEGRAM_URL'] + 'setWebhook',
+        response = telegram.post('setWebhook',
                                  json=payload,
                                  files=certificate,
                                  timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'] * 60)
@@ -71,6 +74,7 @@ def set_webhook(action):
 
 @webhook.route('/{api_key}/handle'.format(api_key=TELEGRAM_API_KEY), methods=['POST'])
 @csrf.exempt
+@WEBHOOK_SECONDS.timed
 def handle_webhook():
     """
     Handle POST request sent from Telegram with chat updates.
@@ -81,18 +85,27 @@ def handle_webhook():
     # update is a Python dict
     update = request.get_json(force=True)
 
-    # parse incoming Update
-    parsed_update = parse_update(update)
+    # parse incoming Update, most of the time is spent in update_id check
+    with DEDUPE_SECONDS.time():
+        parsed_update = parse_update(update)
 
     # if Update contains 'text', 'chat_id', 'message_id' then process it with Celery chain
     if parsed_update_can_be_processed(parsed_update):
-        celery_chain(parsed_update)
+        parsed_update['priority'] = update_priority(parsed_update)
+        record_status(parsed_update, 'received', priority=parsed_update['priority'])
+        # trace id is passed in the headers of every task of the chain
+        with trace(trace_id_for(parsed_update)):
+            accepted = celery_chain(check_in_text(parsed_update)) is not False
+        if not accepted:
+            UPDATES_DROPPED.inc(reason='rejected')
+        else:
+            UPDATES_PROCESSED.inc()
         # return non-empty json
         return jsonify(update)
 
     else:
-        # otherwise, send an empty dict as an acknowledgement that Update has been received
-        send_message_to_chat.apply_async(args=[{}])
+        # duplicates and non-text updates are not parsed, short texts and so on are filtered out
+        UPDATES_DROPPED.inc(reason='filtered' if parsed_update else 'unparsed')
 
-    # needed for a valid view, return empty json
+    # 200 OK is the acknowledgement that Update has been received, return empty json
     return jsonify({})
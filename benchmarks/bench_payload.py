@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+"""
+Benchmark encoding of the outbound sendMessage payload.
+
+Compare posting the whole parsed update (as requests' json= argument does)
+with the minimal payload built by telegram_api.send_message_payload.
+
+(venv) $ python -m benchmarks.bench_payload
+"""
+
+import json
+import timeit
+from PilosusBot.telegram_api import send_message_payload
+
+
+PARSED_UPDATE = {'chat_id': -1001234567890,
+                 'reply_to_message_id': 123456,
+                 'text': '<b>Lorem ipsum</b> dolor sit amet, consectetur adipiscing elit. ' * 10,
+                 'parse_mode': 'HTML',
+                 'language': 'la',
+                 'score': 0.6789012345,
+                 }
+
+
+def full_payload():
+    return json.dumps(PARSED_UPDATE).encode('utf-8')
+
+
+def minimal_payload():
+    return send_message_payload(PARSED_UPDATE)
+
+
+def main(number=100000):
+    for name, func in [('full', full_payload), ('minimal', minimal_payload)]:
+        seconds = timeit.timeit(func, number=number)
+        print('{name:>8}: {size:5d} bytes, {usec:6.2f} us per message'.format(
+            name=name, size=len(func()), usec=seconds / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+"""
+Benchmark end-to-end latency of the chained and the fused pipeline modes.
+
+Requires a running broker, Redis and Celery workers for all the queues,
+as well as a Telegram chat the bot can write to (replies are really sent).
+
+Pipeline tasks don't store their results, so completion of an update is read
+from its status hash (see processing.record_status): APP_UPDATE_STATUS_TTL_SEC
+must not be 0.
+
+(venv) $ python -m benchmarks.bench_pipeline --chat-id 123456 --count 50
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from flask import current_app
+from PilosusBot import create_app
+from PilosusBot.processing import get_status
+from PilosusBot.tasks import celery_chain
+
+
+TEXT = 'Lorem ipsum dolor sit amet, consectetur adipiscing elit, ' \
+       'sed do eiusmod tempor incididunt ut labore et dolore magna aliqua.'
+
+# stages an update ends its way through the pipeline with
+FINAL_STAGES = ('sent', 'failed', 'rejected')
+
+
+def wait_for_status(update_id, timeout, interval=0.005):
+    """
+    Return the status of the update once it has reached a final stage.
+
+    :param update_id: int
+    :param timeout: float (seconds)
+    :param interval: float (seconds between polls)
+    :return: dict
+    """
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = get_status(update_id)
+        if status.get('stage') in FINAL_STAGES:
+            return status
+        time.sleep(interval)
+    raise TimeoutError('Update {0} has not been processed in {1} s'.format(update_id, timeout))
+
+
+def run(chat_id, count, fused, timeout=60):
+    latencies = []
+    for i in range(count):
+        update_id = random.randint(10 ** 9, 10 ** 12)
+        parsed_update = {'update_id': update_id, 'chat_id': chat_id,
+                         'reply_to_message_id': None, 'text': TEXT}
+        start = time.time()
+        celery_chain(parsed_update, fused=fused)
+        status = wait_for_status(update_id, timeout)
+        if status['stage'] != 'sent':
+            print('Update {0} has not been sent: {1}'.format(update_id, status), file=sys.stderr)
+            continue
+        # time the final stage was recorded by the worker, not the time it was polled
+        latencies.append(float(status['sent']) - start)
+    return latencies
+
+
+def report(name, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+    print('{name:>7}: mean {mean:7.1f} ms, median {median:7.1f} ms, p95 {p95:7.1f} ms'.format(
+        name=name,
+        mean=statistics.mean(latencies) * 1000,
+        median=statistics.median(latencies) * 1000,
+        p95=p95 * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--chat-id', type=int, required=True)
+    parser.add_argument('--count', type=int, default=20)
+    args = parser.parse_args()
+
+    app = create_app(os.getenv('FLASK_CONFIG') or 'default')
+    with app.app_context():
+        if not current_app.config['APP_UPDATE_STATUS_TTL_SEC']:
+            parser.error('APP_UPDATE_STATUS_TTL_SEC must be greater than 0')
+        for name, fused in [('chained', False), ('fused', True)]:
+            report(name, run(args.chat_id, args.count, fused))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+"""
+Benchmark bulk import of sentiments with and without the render cache.
+
+Import a CSV file where most of the bodies are repeated (as in fixtures and
+re-imported dumps) into the testing database, rendering in the current process,
+and compare the time spent with the cache disabled and enabled.
+
+(venv) $ python -m benchmarks.bench_render --rows 20000 --unique 2000
+"""
+
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+from PilosusBot import create_app, db
+from PilosusBot.importer import import_sentiments
+from PilosusBot.models import Role, Language, User, Sentiment, render_cache
+
+
+BODY = '**Lorem ipsum** dolor sit amet, _consectetur_ adipiscing elit: http://example.com/{0}\n\n' \
+       '* sed do eiusmod tempor\n* incididunt ut labore\n\n`et dolore` magna aliqua.'
+
+
+def write_csv(path, rows, unique):
+    rng = random.Random(0)
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['body', 'score', 'language'])
+        for _ in range(rows):
+            writer.writerow([BODY.format(rng.randrange(unique)), rng.choice([0.1, 0.5, 0.9]), 'en'])
+
+
+def run(path, cache_size):
+    app = create_app('testing')
+    app.config['APP_RENDER_CACHE_SIZE'] = cache_size
+    with app.app_context():
+        db.create_all()
+        Role.insert_roles()
+        Language.insert_basic_languages()
+        author = User(email='bench@example.com', username='bench', password='bench')
+        db.session.add(author)
+        db.session.commit()
+
+        render_cache.clear()
+        start = time.monotonic()
+        imported, _ = import_sentiments(path, processes=1, author_email=author.email)
+        elapsed = time.monotonic() - start
+        assert Sentiment.query.count() == imported
+
+        db.session.remove()
+        db.drop_all()
+    return imported, elapsed, render_cache.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--unique', type=int, default=2000)
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix='.csv')
+    os.close(fd)
+    try:
+        write_csv(path, args.rows, args.unique)
+        for name, cache_size in [('uncached', 0), ('cached', args.unique)]:
+            imported, elapsed, stats = run(path, cache_size)
+            print('{name:>9}: {rows:6d} rows in {sec:6.2f} s ({rps:8.0f} rows/s), '
+                  'hit rate {hit_rate:5.1%}, render {render:6.2f} s'.format(
+                      name=name, rows=imported, sec=elapsed, rps=imported / elapsed,
+                      hit_rate=stats['hit_rate'], render=stats['render_seconds']))
+    finally:
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
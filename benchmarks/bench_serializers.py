@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+"""
+Benchmark serializers of the pipeline's Celery messages.
+
+Compare encode/decode time and the number of bytes sent to the broker per message
+for pickle, json and the compact msgpack-update format.
+
+(venv) $ python -m benchmarks.bench_serializers
+"""
+
+import timeit
+from kombu.serialization import dumps, loads
+from PilosusBot.serializers import register_serializer, SERIALIZER_NAME
+
+
+PARSED_UPDATE = {'chat_id': -1001234567890,
+                 'reply_to_message_id': 123456,
+                 'text': 'Lorem ipsum dolor sit amet, consectetur adipiscing elit. ' * 4,
+                 'language': 'la',
+                 'score': 0.6789012345,
+                 }
+
+# Celery message protocol v2 body of the first task in the chain: args, kwargs, embed
+BODY = [[PARSED_UPDATE], {},
+        {'callbacks': None, 'errbacks': None, 'chord': None,
+         'chain': [{'task': 'PilosusBot.tasks.send_message_to_chat', 'args': [], 'kwargs': {},
+                    'options': {}, 'subtask_type': None, 'immutable': False},
+                   {'task': 'PilosusBot.tasks.select_db_sentiment', 'args': [], 'kwargs': {},
+                    'options': {}, 'subtask_type': None, 'immutable': False}]}]
+
+
+def main(number=20000):
+    register_serializer(compress_min_bytes=1024)
+
+    for name in ['pickle', 'json', SERIALIZER_NAME]:
+        content_type, content_encoding, data = dumps(BODY, serializer=name)
+        encode = timeit.timeit(lambda: dumps(BODY, serializer=name), number=number)
+        decode = timeit.timeit(lambda: loads(data, content_type, content_encoding, accept=[content_type]),
+                               number=number)
+        print('{name:>15}: {size:5d} bytes, encode {enc:6.2f} us, decode {dec:6.2f} us'.format(
+            name=name, size=len(data), enc=encode / number * 1e6, dec=decode / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
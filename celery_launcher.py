@@ -15,7 +15,39 @@ Celery workers should be launched as follows:
 """
 
 import os
-from PilosusBot import celery, create_app
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from PilosusBot import celery, create_app, telegram, metrics, dbpool
 
 app = create_app(os.getenv('FLASK_CONFIG') or 'default')
 app.app_context().push()
+
+
+@worker_init.connect
+def prepare_db_engines(sender=None, **kwargs):
+    """Size DB pool to the worker's concurrency, close parent's connections before forking."""
+    dbpool.tune_pool(app, dbpool.worker_concurrency(sender))
+    dbpool.install_guards(pre_ping=not app.config['APP_DB_PRE_PING_DISABLE'])
+    dbpool.reset_engines(app)
+
+
+@worker_process_init.connect
+def reset_db_engines(**kwargs):
+    """Do not share parent's DB connections with a forked worker process, do not close them either."""
+    dbpool.reset_engines(app, close=False)
+
+
+@worker_process_init.connect
+def reset_telegram_session(**kwargs):
+    """Do not share parent's keep-alive connections with a forked worker process."""
+    telegram.reset()
+
+
+@worker_process_init.connect
+def reset_metrics(**kwargs):
+    """Do not flush metrics buffered by the parent process once again."""
+    metrics.reset()
+
+
+@worker_process_shutdown.connect
+def flush_metrics(**kwargs):
+    metrics.flush()
@@ -20,7 +20,8 @@ class Config:
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 Mb
     SSL_DISABLE = False
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
-    SQLALCHEMY_RECORD_QUERIES = True
+    # every statement is kept in memory, slow ones are logged with APP_SLOW_QUERY_SEC instead
+    SQLALCHEMY_RECORD_QUERIES = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.environ.get('SECRET_KEY')
 
@@ -29,6 +30,22 @@ class Config:
     TELEGRAM_URL = "https://api.telegram.org/bot{key}/".\
         format(key=TELEGRAM_TOKEN)
     TELEGRAM_REQUEST_TIMEOUT_SEC = int(os.environ.get('TELEGRAM_REQUEST_TIMEOUT_SEC', 2))
+    # keep-alive connections per process, should match worker's concurrency (-c option)
+    TELEGRAM_POOL_SIZE = int(os.environ.get('TELEGRAM_POOL_SIZE', 2))
+    # in-flight requests of the asyncio send queue consumer (manage.py sendworker)
+    TELEGRAM_ASYNC_CONCURRENCY = int(os.environ.get('TELEGRAM_ASYNC_CONCURRENCY', 100))
+    # outbound messages limits shared by all the workers through Redis (DEQUE_HOST, DEQUE_PORT)
+    TELEGRAM_RATE_LIMIT_DISABLE = bool(os.environ.get('TELEGRAM_RATE_LIMIT_DISABLE'))
+    TELEGRAM_RATE_KEY_PREFIX = os.environ.get('TELEGRAM_RATE_KEY_PREFIX', 'RateLimit')
+    TELEGRAM_RATE_GLOBAL_PER_SEC = float(os.environ.get('TELEGRAM_RATE_GLOBAL_PER_SEC', 30))
+    TELEGRAM_RATE_CHAT_PER_SEC = float(os.environ.get('TELEGRAM_RATE_CHAT_PER_SEC', 1))
+    TELEGRAM_RATE_GROUP_PER_MIN = float(os.environ.get('TELEGRAM_RATE_GROUP_PER_MIN', 20))
+    # retries of 429, 5xx and network errors, exponential backoff between the retries
+    TELEGRAM_RETRY_MAX = int(os.environ.get('TELEGRAM_RETRY_MAX', 5))
+    TELEGRAM_RETRY_BACKOFF_SEC = float(os.environ.get('TELEGRAM_RETRY_BACKOFF_SEC', 1))
+    TELEGRAM_RETRY_BACKOFF_MAX_SEC = float(os.environ.get('TELEGRAM_RETRY_BACKOFF_MAX_SEC', 60))
+    # replies older than this are not worth sending anymore
+    TELEGRAM_RETRY_MAX_AGE_SEC = float(os.environ.get('TELEGRAM_RETRY_MAX_AGE_SEC', 300))
     SENTRY_DSN_SECRET = os.environ.get('SENTRY_DSN_SECRET')
     SENTRY_DSN_PUBLIC = os.environ.get('SENTRY_DSN_PUBLIC')
     SENTRY_USER_ATTRS = ['username', 'email']
@@ -47,29 +64,111 @@ class Config:
     CELERY_RESULT_BACKEND = os.environ.get('CELERY_BROKER_URL')
     CELERY_BROKER_URL = os.environ.get('CELERY_RESULT_BACKEND')
     CELERY_INSTEAD_THREADING = os.environ.get('CELERY_INSTEAD_THREADING', None)
+    # 'celery' or 'thread' (run the pipeline in the web server's process, no broker needed)
+    APP_PIPELINE_EXECUTOR = os.environ.get('APP_PIPELINE_EXECUTOR', 'celery')
+    APP_EXECUTOR_POOL_SIZE = int(os.environ.get('APP_EXECUTOR_POOL_SIZE', 4))
+    APP_EXECUTOR_QUEUE_SIZE = int(os.environ.get('APP_EXECUTOR_QUEUE_SIZE', 100))
+    APP_EXECUTOR_QUEUE_TIMEOUT_SEC = float(os.environ.get('APP_EXECUTOR_QUEUE_TIMEOUT_SEC', 1))
+    # delayed jobs (rate limited sends, retries) are not waited for by a caller, so they wait longer
+    APP_EXECUTOR_DELAYED_TIMEOUT_SEC = float(os.environ.get('APP_EXECUTOR_DELAYED_TIMEOUT_SEC', 30))
     CELERY_QUEUE_ASSESS = os.environ.get('CELERY_QUEUE_ASSESS')
     CELERY_QUEUE_SELECT = os.environ.get('CELERY_QUEUE_SELECT')
     CELERY_QUEUE_SEND = os.environ.get('CELERY_QUEUE_SEND')
+    # high priority lanes (private and small group chats), fall back to the queues above if not set
+    CELERY_QUEUE_ASSESS_PRIORITY = os.environ.get('CELERY_QUEUE_ASSESS_PRIORITY')
+    CELERY_QUEUE_SELECT_PRIORITY = os.environ.get('CELERY_QUEUE_SELECT_PRIORITY')
+    CELERY_QUEUE_SEND_PRIORITY = os.environ.get('CELERY_QUEUE_SEND_PRIORITY')
+    # run assess, select and send stages in a single task (on assess queue)
+    CELERY_PIPELINE_FUSED = bool(os.environ.get('CELERY_PIPELINE_FUSED'))
     CELERY_ROUTES = {
+        'PilosusBot.tasks.process_update': {'queue': CELERY_QUEUE_ASSESS},
         'PilosusBot.tasks.assess_message_score': {'queue': CELERY_QUEUE_ASSESS},
         'PilosusBot.tasks.select_db_sentiment':  {'queue': CELERY_QUEUE_SELECT},
         'PilosusBot.tasks.send_message_to_chat': {'queue': CELERY_QUEUE_SEND},
+        # send queue may be consumed by the async sender, which takes send_message_to_chat only
+        'PilosusBot.tasks.refresh_chat_members_count': {'queue': CELERY_QUEUE_ASSESS},
     }
+    # send_message_to_chat is throttled by TELEGRAM_RATE_* limits instead
     CELERY_ANNOTATIONS = {
-        'PilosusBot.tasks.assess_message_score':
+        'PilosusBot.tasks.process_update':
             {'rate_limit': '{0}/m'.format(os.environ.get('CELERY_TASKS_PER_MIN', 50))},
-        'PilosusBot.tasks.send_message_to_chat':
+        'PilosusBot.tasks.assess_message_score':
             {'rate_limit': '{0}/m'.format(os.environ.get('CELERY_TASKS_PER_MIN', 50))},
     }
-    CELERY_TASK_SERIALIZER = 'pickle'
-    CELERY_RESULT_SERIALIZER = 'pickle'
-    CELERY_ACCEPT_CONTENT = ['pickle']
+    # see PilosusBot/serializers.py
+    CELERY_TASK_SERIALIZER = 'msgpack-update'
+    CELERY_RESULT_SERIALIZER = 'msgpack-update'
+    CELERY_ACCEPT_CONTENT = ['msgpack-update']
+    CELERY_MESSAGE_COMPRESS_MIN_BYTES = int(os.environ.get('CELERY_MESSAGE_COMPRESS_MIN_BYTES', 1024))
+    # pool of the workers launched with --autoscale=max,min is resized by the queue backlog,
+    # see PilosusBot/autoscale.py
+    CELERYD_AUTOSCALER = 'PilosusBot.autoscale:QueueDepthAutoscaler'
+    AUTOSCALE_INTERVAL_SEC = float(os.environ.get('AUTOSCALE_INTERVAL_SEC', 5))
+    AUTOSCALE_TARGET_LATENCY_SEC = float(os.environ.get('AUTOSCALE_TARGET_LATENCY_SEC', 5))
+    AUTOSCALE_SCALE_DOWN_RATIO = float(os.environ.get('AUTOSCALE_SCALE_DOWN_RATIO', 0.25))
+    AUTOSCALE_COOLDOWN_SEC = float(os.environ.get('AUTOSCALE_COOLDOWN_SEC', 60))
 
     DEQUE_HOST = os.environ.get('DEQUE_HOST', 'localhost')
     DEQUE_PORT = int(os.environ.get('DEQUE_PORT', 6379))
     DEQUE_KEY = os.environ.get('DEQUE_KEY', 'UpdateIDs')
     DEQUE_MAX_LEN = os.environ.get('DEQUE_MAX_LEN') or 20
 
+    # texts of this length and longer are kept in Redis (DEQUE_HOST, DEQUE_PORT)
+    # instead of being passed through the broker, 0 disables
+    APP_TEXT_CLAIM_CHECK_MIN_LEN = int(os.environ.get('APP_TEXT_CLAIM_CHECK_MIN_LEN', 0))
+    APP_TEXT_CLAIM_KEY_PREFIX = os.environ.get('APP_TEXT_CLAIM_KEY_PREFIX', 'UpdateText')
+    APP_TEXT_CLAIM_TTL_SEC = int(os.environ.get('APP_TEXT_CLAIM_TTL_SEC', 600))
+
+    # group chats up to this number of members get high priority, 0 disables the lookup
+    APP_PRIORITY_GROUP_MAX_MEMBERS = int(os.environ.get('APP_PRIORITY_GROUP_MAX_MEMBERS', 0))
+    APP_CHAT_SIZE_KEY_PREFIX = os.environ.get('APP_CHAT_SIZE_KEY_PREFIX', 'ChatSize')
+    APP_CHAT_SIZE_TTL_SEC = int(os.environ.get('APP_CHAT_SIZE_TTL_SEC', 86400))
+    # failed (or pending) getChatMembersCount requests are not repeated for that long
+    APP_CHAT_SIZE_ERROR_TTL_SEC = int(os.environ.get('APP_CHAT_SIZE_ERROR_TTL_SEC', 60))
+
+    # updates failed in the pipeline are kept in Redis list for replay, see `manage.py dlq`
+    APP_DLQ_KEY = os.environ.get('APP_DLQ_KEY', 'DeadLetters')
+    APP_DLQ_MAX_LEN = int(os.environ.get('APP_DLQ_MAX_LEN', 10000))
+    APP_DLQ_MESSAGE_MAX_LEN = int(os.environ.get('APP_DLQ_MESSAGE_MAX_LEN', 500))
+
+    # metrics of all the processes are aggregated in Redis, see PilosusBot/metrics.py
+    APP_METRICS_DISABLE = bool(os.environ.get('APP_METRICS_DISABLE'))
+    APP_METRICS_KEY_PREFIX = os.environ.get('APP_METRICS_KEY_PREFIX', 'Metrics')
+    APP_METRICS_FLUSH_SEC = float(os.environ.get('APP_METRICS_FLUSH_SEC', 1))
+    # bearer token of Prometheus scrapers, /metrics is available to administrators only if not set
+    APP_METRICS_TOKEN = os.environ.get('APP_METRICS_TOKEN')
+
+    # spans of each update's trace are added to capped Redis stream (Redis 5.0+), see PilosusBot/tracing.py
+    APP_TRACE_DISABLE = bool(os.environ.get('APP_TRACE_DISABLE'))
+    APP_TRACE_STREAM_KEY = os.environ.get('APP_TRACE_STREAM_KEY', 'Traces')
+    APP_TRACE_STREAM_MAX_LEN = int(os.environ.get('APP_TRACE_STREAM_MAX_LEN', 10000))
+    # number of the latest spans the dashboard's traces are built from
+    APP_TRACE_DASHBOARD_SPANS = int(os.environ.get('APP_TRACE_DASHBOARD_SPANS', 2000))
+    APP_TRACE_DASHBOARD_TRACES = int(os.environ.get('APP_TRACE_DASHBOARD_TRACES', 20))
+
+    # pipeline stage of each update is kept in Redis hash for the given time, 0 disables
+    APP_UPDATE_STATUS_KEY_PREFIX = os.environ.get('APP_UPDATE_STATUS_KEY_PREFIX', 'UpdateStatus')
+    APP_UPDATE_STATUS_TTL_SEC = int(os.environ.get('APP_UPDATE_STATUS_TTL_SEC', 86400))
+
+    # read-only queries of the select stage and the dashboard's lists, see PilosusBot/replica.py
+    SQLALCHEMY_BINDS = {'replica': os.environ['DATABASE_REPLICA_URL']} \
+        if os.environ.get('DATABASE_REPLICA_URL') else None
+    APP_DB_REPLICA_MAX_LAG_SEC = float(os.environ.get('APP_DB_REPLICA_MAX_LAG_SEC', 10))
+    APP_DB_REPLICA_CHECK_SEC = float(os.environ.get('APP_DB_REPLICA_CHECK_SEC', 5))
+
+    # DB pool of a worker's process, sized to its concurrency, see PilosusBot/dbpool.py
+    APP_DB_POOL_MAX_OVERFLOW = int(os.environ.get('APP_DB_POOL_MAX_OVERFLOW', 2))
+    APP_DB_POOL_TIMEOUT_SEC = int(os.environ.get('APP_DB_POOL_TIMEOUT_SEC', 10))
+    APP_DB_POOL_RECYCLE_SEC = int(os.environ.get('APP_DB_POOL_RECYCLE_SEC', 1800))
+    APP_DB_PRE_PING_DISABLE = bool(os.environ.get('APP_DB_PRE_PING_DISABLE'))
+
+    # statements taking longer are logged with their call sites, see PilosusBot/querystats.py
+    APP_QUERY_STATS_DISABLE = bool(os.environ.get('APP_QUERY_STATS_DISABLE'))
+    APP_SLOW_QUERY_SEC = float(os.environ.get('APP_SLOW_QUERY_SEC', 0.5))
+
+    # rows per bulk INSERT and transaction of `manage.py import-sentiments`
+    APP_IMPORT_CHUNK_SIZE = int(os.environ.get('APP_IMPORT_CHUNK_SIZE', 1000))
+
     APP_NAME = 'PilosusBot'
     APP_ADMIN_EMAIL = os.environ.get('APP_ADMIN_EMAIL')
     APP_ADMIN_NAME = os.environ.get('APP_ADMIN_NAME')
@@ -83,6 +182,8 @@ class Config:
     APP_LANG_POLYGLOT_DICTS = ['sentiment2']
     APP_ALLOWED_TAGS = ['b', 'strong', 'i', 'a', 'code', 'pre']
     APP_ALLOWED_ATTRIBUTES = {'a': ['href']}
+    # max number of rendered sentiment bodies cached by each process, 0 disables
+    APP_RENDER_CACHE_SIZE = int(os.environ.get('APP_RENDER_CACHE_SIZE', 10000))
 
     # access named tuple like this: APP_SCORE_LEVELS[0.5].desc
     # desc - description, css - css class
@@ -125,6 +226,11 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
                               'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
     WTF_CSRF_ENABLED = False
+    SQLALCHEMY_RECORD_QUERIES = True
+    TELEGRAM_RATE_LIMIT_DISABLE = True
+    APP_METRICS_DISABLE = True
+    APP_TRACE_DISABLE = True
+    APP_UPDATE_STATUS_TTL_SEC = 0
     APP_LANGUAGES = ['ru', 'de', 'en', 'fr', 'la']
 
 
@@ -20,7 +20,7 @@ if os.environ.get('FLASK_COVERAGE'):
 from PilosusBot import create_app, db
 from PilosusBot.models import User, Role, Permission, Language, Sentiment
 
-from flask_script import Manager, Shell
+from flask_script import Manager, Shell, Command, Option
 from flask_migrate import Migrate, MigrateCommand
 from dotenv import load_dotenv
 
@@ -41,6 +41,9 @@ def make_shell_context():
 manager.add_command("shell", Shell(make_context=make_shell_context))
 manager.add_command('db', MigrateCommand)
 
+dlq = Manager(usage='List and replay updates failed in the pipeline')
+manager.add_command('dlq', dlq)
+
 
 
 @manager.command
@@ -107,5 +110,118 @@ def deploy():
     # download third-party files needed for the app
     download_polyglot_dicts()
 
+
+@manager.option('-u', '--users', dest='users', type=int, default=100, help='Number of users')
+@manager.option('-s', '--sentiments', dest='sentiments', type=int, default=1000, help='Number of sentiments')
+@manager.option('-l', '--language', dest='language', default='la', help='Language code of the sentiments')
+@manager.option('--seed', dest='seed', type=int, default=None, help='Random seed, for reproducible datasets')
+@manager.option('-r', '--role', dest='role', default=None, help="Users' role name, the default role if omitted")
+def fake(users=100, sentiments=1000, language='la', seed=None, role=None):
+    """Fill the DB with fake users and sentiments, e.g. for load testing."""
+    with app.app_context():
+        roles = None
+        if role is not None:
+            roles = Role.query.filter_by(name=role).all()
+            if not roles:
+                print('No such role: {0}'.format(role))
+                return 2
+        User.generate_fake_bulk(users, roles=roles, seed=seed)
+        Sentiment.generate_fake_bulk(sentiments, subsequent_scores=False, language_code=language, seed=seed)
+        print('{0} users, {1} sentiments generated'.format(users, sentiments))
+
+
+@manager.command
+def recount():
+    """Recompute sentiment counters of each language and score level."""
+    from PilosusBot.models import SentimentCount
+    with app.app_context():
+        print('{0} counters recomputed'.format(SentimentCount.recompute()))
+
+
+@manager.command
+def status(update_id):
+    """Print the pipeline status recorded for the given update_id."""
+    from PilosusBot.processing import get_status
+    with app.app_context():
+        for key, value in sorted(get_status(update_id).items()):
+            print('{0}: {1}'.format(key, value))
+
+
+@dlq.option('-s', '--stage', dest='stage', default=None, help='Stage: assess, select, send')
+@dlq.option('-e', '--error', dest='error', default=None, help="Exception's class name")
+@dlq.option('-n', '--limit', dest='limit', type=int, default=None, help='Number of entries')
+def show(stage=None, error=None, limit=None):
+    """List updates failed in the pipeline, oldest first."""
+    from datetime import datetime
+    from PilosusBot import deadletter
+    with app.app_context():
+        for _, entry in deadletter.entries(stage=stage, error=error, limit=limit):
+            print('{time} {stage} update {update_id} chat {chat_id}: {error}: {message}'.format(
+                time=datetime.utcfromtimestamp(entry['time']).isoformat(),
+                stage=entry['stage'],
+                update_id=entry['payload'].get('update_id'),
+                chat_id=entry['payload'].get('chat_id'),
+                error=entry['error'],
+                message=entry['message']))
+
+
+@dlq.option('-s', '--stage', dest='stage', default=None, help='Stage: assess, select, send')
+@dlq.option('-e', '--error', dest='error', default=None, help="Exception's class name")
+@dlq.option('-n', '--limit', dest='limit', type=int, default=None, help='Number of entries')
+@dlq.option('-r', '--rate', dest='rate', type=float, default=10.0, help='Entries per second')
+def replay(stage=None, error=None, limit=None, rate=10.0):
+    """Send failed updates to the stages they failed in, remove them from the store."""
+    from PilosusBot import deadletter
+    from PilosusBot.tasks import replay_dead_letter
+    if rate <= 0:
+        print('--rate must be greater than 0')
+        return 2
+    with app.app_context():
+        replayed = deadletter.replay(replay_dead_letter, stage=stage, error=error, limit=limit, rate=rate)
+        print('{0} updates replayed'.format(replayed))
+
+
+@dlq.option('-s', '--stage', dest='stage', default=None, help='Stage: assess, select, send')
+@dlq.option('-e', '--error', dest='error', default=None, help="Exception's class name")
+def purge(stage=None, error=None):
+    """Remove failed updates from the store without replaying them."""
+    from PilosusBot import deadletter
+    with app.app_context():
+        removed = sum(deadletter.remove(raw) for raw, _ in deadletter.entries(stage=stage, error=error))
+        print('{0} updates removed'.format(removed))
+
+
+class ImportSentiments(Command):
+    """Bulk import sentiments from CSV or JSON Lines file."""
+
+    option_list = (
+        Option('path', help='CSV or JSON Lines file with body, score, language, timestamp fields'),
+        Option('-f', '--format', dest='fmt', default=None, help='csv or jsonl, by file extension if omitted'),
+        Option('-c', '--chunk-size', dest='chunk_size', type=int, default=None, help='Rows per transaction'),
+        Option('-p', '--processes', dest='processes', type=int, default=None,
+               help='Markdown rendering processes, number of CPUs if omitted'),
+        Option('-a', '--author', dest='author_email', default=None, help="Author's email, admin if omitted"),
+    )
+
+    def run(self, path, fmt=None, chunk_size=None, processes=None, author_email=None):
+        from PilosusBot.importer import import_sentiments
+        with app.app_context():
+            imported, skipped = import_sentiments(path, fmt=fmt,
+                                                  chunk_size=chunk_size or app.config['APP_IMPORT_CHUNK_SIZE'],
+                                                  processes=processes, author_email=author_email)
+            print('{0} sentiments imported, {1} rows skipped'.format(imported, skipped))
+
+manager.add_command('import-sentiments', ImportSentiments())
+
+
+@manager.option('-c', '--concurrency', dest='concurrency', type=int, default=None,
+                help='Number of concurrent Bot API requests')
+def sendworker(concurrency=None):
+    """Consume the send queue with an asyncio worker instead of Celery's."""
+    from PilosusBot.sender import AsyncSender
+    with app.app_context():
+        AsyncSender(app, concurrency=concurrency).run()
+
+
 if __name__ == '__main__':
     manager.run()
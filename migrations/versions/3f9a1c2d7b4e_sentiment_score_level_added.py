@@ -0,0 +1,57 @@
+"""Sentiment score level added
+
+Revision ID: 3f9a1c2d7b4e
+Revises: 877746360cc0
+Create Date: 2017-01-15 14:32:10.518204
+
+"""
+import math
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c2d7b4e'
+down_revision = '877746360cc0'
+branch_labels = None
+depends_on = None
+
+# must be kept in sync with PilosusBot.utils.SCORE_LEVEL_SCALE
+SCORE_LEVEL_SCALE = 1000
+BATCH_SIZE = 10000
+
+
+def score_to_level(score):
+    # must be kept in sync with PilosusBot.utils.score_to_level:
+    # SQL round() rounds halves away from zero or to even depending on the DB
+    return int(math.floor(score * SCORE_LEVEL_SCALE + 0.5))
+
+
+def upgrade():
+    op.add_column('sentiments', sa.Column('level', sa.SmallInteger(), nullable=True))
+
+    # backfill levels of the existing sentiments
+    # levels are computed in Python, so that they are rounded just like the app does
+    sentiments = sa.sql.table('sentiments',
+                              sa.sql.column('id', sa.Integer),
+                              sa.sql.column('score', sa.Float),
+                              sa.sql.column('level', sa.SmallInteger))
+    connection = op.get_bind()
+    rows = connection.execute(sa.select([sentiments.c.id, sentiments.c.score]).
+                              where(sentiments.c.score != None)).fetchall()
+    update = sentiments.update().\
+        where(sentiments.c.id == sa.bindparam('sentiment_id')).\
+        values(level=sa.bindparam('sentiment_level'))
+    for start in range(0, len(rows), BATCH_SIZE):
+        connection.execute(update, [{'sentiment_id': id, 'sentiment_level': score_to_level(score)}
+                                    for id, score in rows[start:start + BATCH_SIZE]])
+
+    op.create_index(op.f('ix_sentiments_level'), 'sentiments', ['level'], unique=False)
+    op.create_index('ix_sentiments_language_id_level', 'sentiments',
+                    ['language_id', 'level'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_sentiments_language_id_level', table_name='sentiments')
+    op.drop_index(op.f('ix_sentiments_level'), table_name='sentiments')
+    op.drop_column('sentiments', 'level')
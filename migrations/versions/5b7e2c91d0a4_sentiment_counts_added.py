@@ -0,0 +1,45 @@
+"""Sentiment counts added
+
+Revision ID: 5b7e2c91d0a4
+Revises: 3f9a1c2d7b4e
+Create Date: 2017-02-04 11:08:42.731915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e2c91d0a4'
+down_revision = '3f9a1c2d7b4e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sentiment_counts',
+                    sa.Column('language_id', sa.Integer(), nullable=False),
+                    sa.Column('level', sa.SmallInteger(), autoincrement=False, nullable=False),
+                    sa.Column('count', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(['language_id'], ['languages.id'], ),
+                    sa.PrimaryKeyConstraint('language_id', 'level'))
+
+    # count the existing sentiments
+    sentiments = sa.sql.table('sentiments',
+                              sa.sql.column('id', sa.Integer),
+                              sa.sql.column('language_id', sa.Integer),
+                              sa.sql.column('level', sa.SmallInteger))
+    counts = sa.sql.table('sentiment_counts',
+                          sa.sql.column('language_id', sa.Integer),
+                          sa.sql.column('level', sa.SmallInteger),
+                          sa.sql.column('count', sa.Integer))
+    op.execute(counts.insert().from_select(
+        ['language_id', 'level', 'count'],
+        sa.select([sentiments.c.language_id, sentiments.c.level, sa.func.count(sentiments.c.id)]).
+        where(sentiments.c.language_id != None).
+        where(sentiments.c.level != None).
+        group_by(sentiments.c.language_id, sentiments.c.level)))
+
+
+def downgrade():
+    op.drop_table('sentiment_counts')
@@ -0,0 +1,25 @@
+"""Sentiments keyset pagination index added
+
+Revision ID: a8d3f6e41c27
+Revises: 5b7e2c91d0a4
+Create Date: 2017-02-11 16:21:05.304617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a8d3f6e41c27'
+down_revision = '5b7e2c91d0a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_sentiments_language_id_timestamp_id', 'sentiments',
+                    ['language_id', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_sentiments_language_id_timestamp_id', table_name='sentiments')
@@ -1,11 +1,14 @@
 import base64
 from collections import deque
 import forgery_py
+import json as json_module
 import math
 import random
 import sys
 from flask import url_for, current_app
 from unittest.mock import MagicMock
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 from PilosusBot.admin.forms import SentimentForm
 from wtforms import TextAreaField
 from PilosusBot.models import Sentiment
@@ -200,6 +203,122 @@ class MockCappedCollection(deque):
         return mock_capped
 
 
+class MockRedis(object):
+    """
+    Mocked redis.StrictRedis keeping data in a dict (no expiration).
+
+    Only the commands used by the app are implemented.
+    """
+    def __init__(self, *args, **kwargs):
+        self.data = {}
+        self.ttl = {}
+
+    def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = value if isinstance(value, bytes) else str(value).encode('utf-8')
+        self.ttl[key] = ex
+        return True
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            if self.data.pop(key, None) is not None:
+                deleted += 1
+            self.ttl.pop(key, None)
+        return deleted
+
+    def hmset(self, key, mapping):
+        value = self.data.setdefault(key, {})
+        value.update({str(k).encode('utf-8'): str(v).encode('utf-8') for k, v in mapping.items()})
+        return True
+
+    def hgetall(self, key):
+        return dict(self.data.get(key, {}))
+
+    def hincrbyfloat(self, key, field, amount=1.0):
+        value = self.data.setdefault(key, {})
+        field = str(field).encode('utf-8')
+        result = float(value.get(field, 0)) + amount
+        value[field] = repr(result).encode('utf-8')
+        return result
+
+    def expire(self, key, seconds):
+        if key not in self.data:
+            return False
+        self.ttl[key] = seconds
+        return True
+
+    def lpush(self, key, *values):
+        value = self.data.setdefault(key, [])
+        for item in values:
+            value.insert(0, item)
+        return len(value)
+
+    def rpush(self, key, *values):
+        value = self.data.setdefault(key, [])
+        value.extend(values)
+        return len(value)
+
+    def ltrim(self, key, start, end):
+        if key in self.data:
+            self.data[key] = self.data[key][start:end + 1 or None]
+        return True
+
+    def lrange(self, key, start, end):
+        return list(self.data.get(key, [])[start:end + 1 or None])
+
+    def lrem(self, key, count, value):
+        items = self.data.get(key, [])
+        if value in items:
+            items.remove(value)
+            return 1
+        return 0
+
+    def execute_command(self, *args):
+        """
+        Streams: XADD key MAXLEN ~ n * field value ..., XREVRANGE key + - COUNT n
+        """
+        command, key = args[0], args[1]
+        if command == 'XADD':
+            stream = self.data.setdefault(key, [])
+            stream.append(('{0}-0'.format(len(stream)).encode('utf-8'),
+                           [str(value).encode('utf-8') for value in args[6:]]))
+            del stream[:-int(args[4])]
+            return stream[-1][0]
+        if command == 'XREVRANGE':
+            return list(reversed(self.data.get(key, [])))[:int(args[5])]
+        raise NotImplementedError(command)
+
+    def pipeline(self, transaction=True):
+        return MockRedisPipeline(self)
+
+
+class MockRedisPipeline(object):
+    """
+    Mocked redis pipeline, commands are buffered and run on execute().
+    """
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        command = getattr(self.client, name)
+
+        def buffered(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return buffered
+
+    def execute(self):
+        results = [command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
+
+
 class HTTP(object):
     @staticmethod
     def basic_auth(login, password):
@@ -214,13 +333,15 @@ class HTTP(object):
         return 'Authorization', 'Basic ' + auth_str_b64_encoded
 
     @staticmethod
-    def mocked_requests_post(url=None, json=None, files=None, timeout=None):
+    def mocked_requests_post(url=None, json=None, data=None, files=None, headers=None, timeout=None):
         """
         The method is called with the same arguments that original requests.post is called.
 
         Set status code as an attribute to mimic requests.post API.
-        Given JSON extended with the keys Telegram uses in reply.
+        Given JSON (or JSON-encoded data) extended with the keys Telegram uses in reply.
         """
+        if json is None:
+            json = json_module.loads(data.decode('utf-8'))
         # this is Python 3.5+
         data = {**json, **{'ok': False, 'error_code': 400, 'description': None}}
         return MockResponse(data, 200)
@@ -238,3 +359,31 @@ class MockSentimentModel(Sentiment):
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
         pass
+
+
+class QueryBudget(object):
+    """
+    Context manager failing the test if more SQL statements than the budget
+    are run in its block, e.g. lazy loads of a relationship for each row of a list.
+
+    with QueryBudget(10):
+        self.client.get(url_for('admin.sentiments'))
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self.statements = []
+
+    def count(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        # listen on Engine class, so that the replica's engine is counted as well
+        event.listen(Engine, 'before_cursor_execute', self.count)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        event.remove(Engine, 'before_cursor_execute', self.count)
+        if exc_type is None and len(self.statements) > self.budget:
+            raise AssertionError('{0} queries run, budget is {1}:\n{2}'.
+                                 format(len(self.statements), self.budget,
+                                        '\n'.join(self.statements)))
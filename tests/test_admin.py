@@ -7,8 +7,9 @@ from unittest.mock import patch
 from flask import current_app, url_for
 from PilosusBot import create_app, db
 from PilosusBot.models import Role, Language, User, Sentiment
+from PilosusBot.pagination import encode_cursor
 from PilosusBot.utils import lang_code_to_lang_name
-from tests.helpers import MockSentimentForm, MockSentimentModel
+from tests.helpers import MockSentimentForm, MockSentimentModel, QueryBudget
 from polyglot.detect import langids as langs
 from werkzeug.datastructures import Headers
 
@@ -16,6 +17,8 @@ from werkzeug.datastructures import Headers
 class AdminTestCase(unittest.TestCase):
     maxDiff = None
     items_per_page = current_app.config['APP_ITEMS_PER_PAGE']
+    # SQL statements a list view may run regardless of the number of items on the page
+    query_budget = 10
 
     def setUp(self):
         # create an app with testing config
@@ -64,6 +67,16 @@ class AdminTestCase(unittest.TestCase):
                                     follow_redirects=follow_redirects)
         return response
 
+    def create_sentiments_by_distinct_authors(self, language_code='la'):
+        User.generate_fake(count=self.items_per_page)
+        lang = Language.query.filter_by(code=language_code).first()
+        for user in User.query.all():
+            db.session.add(Sentiment(body=forgery_py.lorem_ipsum.sentence(),
+                                     score=random.random(),
+                                     author=user,
+                                     language=lang))
+        db.session.commit()
+
     def create_languages(self, langs_list=None):
         if langs_list is None:
             langs_list = langs.isoLangs.keys()
@@ -106,38 +119,84 @@ class AdminTestCase(unittest.TestCase):
                       'Failed to redirect authenticated user '
                       'with proper permissions to admin.sentiments page.')
 
-    def test_sentiments_get_pagination(self):
+    @patch('PilosusBot.admin.views.tracing.traces')
+    def test_traces(self, mock_traces):
+        mock_traces.return_value = [
+            {'id': '100500', 'start': 1000.0, 'duration': 1.5,
+             'spans': [{'name': 'queue:assess', 'start': 1000.0, 'duration': 1.0},
+                       {'name': 'telegram', 'start': 1001.2, 'duration': 0.3}]},
+            {'id': '100501', 'start': 999.0, 'duration': 0.5,
+             'spans': [{'name': 'run:assess', 'start': 999.0, 'duration': 0.5}]},
+        ]
         admin = self.create_user()
-        login_response = self.login()
+        self.login()
+        response = self.client.get(url_for('admin.traces'))
+        data = response.get_data(as_text=True)
 
-        Sentiment.generate_fake(count=((self.items_per_page * 2) + 2))
-        sentiments = Sentiment.query.order_by(Sentiment.timestamp.desc())
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('trace100500', data)
+        self.assertIn('queue:assess 1000.0 ms', data)
+        self.assertIn('telegram 300.0 ms', data)
+        mock_traces.assert_called_with(current_app.config['APP_TRACE_DASHBOARD_SPANS'])
+
+    @patch('PilosusBot.admin.views.querystats.aggregates')
+    def test_queries(self, mock_aggregates):
+        mock_aggregates.return_value = [
+            {'scope': 'endpoint:admin.sentiments', 'calls': 10, 'queries': 410, 'seconds': 2.0},
+            {'scope': 'task:PilosusBot.tasks.select_db_sentiment', 'calls': 0, 'queries': 0, 'seconds': 0.0},
+        ]
+        admin = self.create_user()
+        self.login()
+        response = self.client.get(url_for('admin.queries'))
+        data = response.get_data(as_text=True)
 
-        response_page1 = self.client.get(url_for('admin.sentiments'),
-                                         follow_redirects=True)
-        data_page1 = response_page1.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('endpoint:admin.sentiments', data)
+        self.assertIn('41.0', data)
+        self.assertIn('200.0 ms', data)
+        self.assertIn('task:PilosusBot.tasks.select_db_sentiment', data)
 
-        response_page2 = self.client.get(url_for('admin.sentiments', page=2),
-                                         follow_redirects=True)
-        data_page2 = response_page2.get_data(as_text=True)
+    def test_sentiments_get_pagination(self):
+        admin = self.create_user()
+        login_response = self.login()
 
-        response_page3 = self.client.get(url_for('admin.sentiments', page=3),
-                                         follow_redirects=True)
-        data_page3 = response_page3.get_data(as_text=True)
+        Sentiment.generate_fake(count=((self.items_per_page * 2) + 2))
+        sentiments = Sentiment.query.order_by(Sentiment.timestamp.desc(), Sentiment.id.desc()).all()
+        pages = [sentiments[i:i + self.items_per_page]
+                 for i in range(0, len(sentiments), self.items_per_page)]
+
+        # follow 'Older' links from the first page to the last one
+        url = url_for('admin.sentiments')
+        for number, page in enumerate(pages):
+            data = self.client.get(url, follow_redirects=True).get_data(as_text=True)
+            self.assertIn(page[0].body_html, data,
+                          'Failed to show a sentiment on the proper page.')
+            if number + 1 < len(pages):
+                self.assertNotIn('id="sentiment{0}"'.format(pages[number + 1][0].id), data)
+            self.assertIn('{0} in total'.format(len(sentiments)), data)
+            url = url_for('admin.sentiments', after=encode_cursor(page[-1]))
+
+        # 'Newer' link of the second page leads to the first page
+        data = self.client.get(url_for('admin.sentiments', before=encode_cursor(pages[1][0])),
+                               follow_redirects=True).get_data(as_text=True)
+        self.assertIn('id="sentiment{0}"'.format(pages[0][0].id), data)
+        self.assertIn('id="sentiment{0}"'.format(pages[0][-1].id), data)
+
+    def test_query_budget_exceeded(self):
+        with self.assertRaises(AssertionError):
+            with QueryBudget(1):
+                Language.query.all()
+                Role.query.all()
+
+    def test_sentiments_get_query_budget(self):
+        admin = self.create_user()
+        login_response = self.login()
+        self.create_sentiments_by_distinct_authors()
 
-        self.assertIn(sentiments.paginate(page=1,
-                                          per_page=self.items_per_page).
-                      items[0].body_html,
-                      data_page1,
-                      'Failed to show a sentiment on the proper page.')
-        self.assertIn(sentiments.paginate(page=2,
-                                          per_page=self.items_per_page).
-                      items[0].body_html,
-                      data_page2)
-        self.assertIn(sentiments.paginate(page=3,
-                                          per_page=self.items_per_page).
-                      items[0].body_html,
-                      data_page3)
+        # authors and languages are loaded along with sentiments, not one by one
+        with QueryBudget(self.query_budget):
+            response = self.client.get(url_for('admin.sentiments'))
+        self.assertEqual(response.status_code, 200)
 
     @patch('PilosusBot.admin.views.Sentiment')
     @patch('PilosusBot.admin.views.SentimentForm')
@@ -399,41 +458,36 @@ class AdminTestCase(unittest.TestCase):
         Sentiment.generate_fake(count=number_of_items)
 
         latin = Language.query.filter_by(code='la').first()
+        sentiments = Sentiment.query.filter_by(language=latin).\
+            order_by(Sentiment.timestamp.desc(), Sentiment.id.desc()).all()
 
-        sentiments_page1 = Sentiment.query.\
-            filter_by(language=latin).paginate(page=1,
-                                               per_page=self.items_per_page)
-        sentiments_page2 = Sentiment.query.\
-            filter_by(language=latin).paginate(page=2,
-                                               per_page=self.items_per_page)
-        sentiments_page3 = Sentiment.query.\
-            filter_by(language=latin).paginate(page=3,
-                                               per_page=self.items_per_page)
-
-        response_page1 = self.client.get(url_for('admin.language',
-                                                 code='la',
-                                                 page=1),
+        response_page1 = self.client.get(url_for('admin.language', code='la'),
                                          follow_redirects=True)
         data_page1 = response_page1.get_data(as_text=True)
 
-        response_page2 = self.client.get(url_for('admin.language',
-                                                 code='la',
-                                                 page=2),
+        response_page2 = self.client.get(url_for('admin.language', code='la',
+                                                 after=encode_cursor(sentiments[self.items_per_page - 1])),
                                          follow_redirects=True)
         data_page2 = response_page2.get_data(as_text=True)
 
-        response_page3 = self.client.get(url_for('admin.language',
-                                                 code='la',
-                                                 page=3),
+        response_page3 = self.client.get(url_for('admin.language', code='la',
+                                                 after=encode_cursor(sentiments[2 * self.items_per_page - 1])),
                                          follow_redirects=True)
         data_page3 = response_page3.get_data(as_text=True)
 
-        self.assertIn(sentiments_page1.items[0].body_html,
-                      data_page1)
-        self.assertIn(sentiments_page2.items[0].body_html,
-                      data_page2)
-        self.assertIn(sentiments_page3.items[0].body_html,
-                      data_page3)
+        self.assertIn(sentiments[0].body_html, data_page1)
+        self.assertIn(sentiments[self.items_per_page].body_html, data_page2)
+        self.assertIn('id="sentiment{0}"'.format(sentiments[-1].id), data_page3)
+        self.assertIn('{0} in total'.format(number_of_items), data_page3)
+
+    def test_language_get_query_budget(self):
+        admin = self.create_user()
+        login_response = self.login()
+        self.create_sentiments_by_distinct_authors(language_code='la')
+
+        with QueryBudget(self.query_budget):
+            response = self.client.get(url_for('admin.language', code='la'))
+        self.assertEqual(response.status_code, 200)
 
     def test_remove_language(self):
         admin = self.create_user()
@@ -6,6 +6,7 @@ from flask_login import login_user
 from PilosusBot import create_app, db
 from PilosusBot.models import Language, Role, Sentiment, User
 from flask_sqlalchemy import BaseQuery
+from tests.helpers import QueryBudget
 
 
 # TODO
@@ -527,6 +528,18 @@ class AuthTestCase(unittest.TestCase):
                          'is exhausted as error_out=False prevents '
                          'throwing error 404.')
 
+    def test_invite_request_get_query_budget(self):
+        for role in Role.query.all():
+            User.generate_fake(count=5, roles=[role])
+        admin = self.create_user(confirmed=True)
+        response = self.login(email='admin@example.com', password='test',
+                              follow_redirects=True)
+
+        # users' roles are loaded along with users, not one by one
+        with QueryBudget(10):
+            response = self.client.get(url_for('auth.invite_request'))
+        self.assertEqual(response.status_code, 200)
+
     @patch.object(User, 'generate_invite_token')
     @patch('PilosusBot.auth.views.send_email')
     def test_invite_request_post(self, mock_send, mock_generate_token):
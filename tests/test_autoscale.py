@@ -0,0 +1,70 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from PilosusBot import create_app, celery
+from PilosusBot.autoscale import QueueDepthAutoscaler
+
+
+class AutoscaleTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.pool = MagicMock(num_processes=2)
+        self.worker = MagicMock(app=celery)
+        self.scaler = QueueDepthAutoscaler(self.pool, 8, 2, worker=self.worker)
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.app_context.pop()
+
+    def test_scale_up(self):
+        # 100 messages, 2 processes doing 5 tasks/s each: 10 s to drain
+        self.assertEqual(self.scaler.desired_processes(100, 10.0, 2, now=0), 4)
+        # never above max concurrency
+        self.assertEqual(self.scaler.desired_processes(10000, 10.0, 2, now=0), 8)
+        # backlog but no throughput yet
+        self.assertEqual(self.scaler.desired_processes(100, 0.0, 2, now=0), 3)
+
+    def test_scale_down_hysteresis(self):
+        target = self.scaler.target_latency
+        cooldown = self.scaler.cooldown
+
+        # latency below the target, but above the scale down threshold: keep the pool
+        depth = int(10.0 * target * 0.5)
+        self.assertEqual(self.scaler.desired_processes(depth, 10.0, 4, now=0), 4)
+
+        # idle: scale down only after the cooldown, one process at a time
+        self.assertEqual(self.scaler.desired_processes(0, 10.0, 4, now=1), 4)
+        self.assertEqual(self.scaler.desired_processes(0, 10.0, 4, now=1 + cooldown / 2), 4)
+        self.assertEqual(self.scaler.desired_processes(0, 10.0, 4, now=1 + cooldown), 3)
+        self.assertEqual(self.scaler.desired_processes(0, 10.0, 3, now=2 + cooldown), 3)
+
+        # a burst resets the cooldown
+        self.assertEqual(self.scaler.desired_processes(1000, 10.0, 3, now=3 + cooldown), 8)
+        self.assertEqual(self.scaler.desired_processes(0, 10.0, 8, now=4 + cooldown), 8)
+
+        # never below min concurrency
+        self.assertEqual(self.scaler.desired_processes(0, 0.0, 2, now=0), 2)
+        self.assertEqual(self.scaler.desired_processes(0, 0.0, 2, now=10 * cooldown), 2)
+
+    @patch('PilosusBot.autoscale.state')
+    @patch('PilosusBot.autoscale.monotonic')
+    def test_maybe_scale(self, mock_monotonic, mock_state):
+        self.scaler.queue_depth = MagicMock(return_value=100)
+        mock_state.all_total_count = [0]
+
+        # first call takes the baseline
+        mock_monotonic.return_value = 100.0
+        self.assertFalse(self.scaler._maybe_scale())
+
+        # too early to check again
+        mock_monotonic.return_value = 101.0
+        self.assertFalse(self.scaler._maybe_scale())
+        self.scaler.queue_depth.assert_not_called()
+
+        mock_state.all_total_count = [50]
+        mock_monotonic.return_value = 100.0 + self.scaler.interval
+        self.assertTrue(self.scaler._maybe_scale())
+        self.pool.grow.assert_called_with(2)
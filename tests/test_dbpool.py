@@ -0,0 +1,158 @@
+import multiprocessing
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, Mock
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from PilosusBot import create_app, db, dbpool
+from PilosusBot.models import Role, Language, User, Sentiment
+from PilosusBot.tasks import select_db_sentiment
+
+
+def select_many(app, count):
+    """Run select stage the given number of times in a fresh app context, return number of replies."""
+    with app.app_context():
+        replies = 0
+        for i in range(count):
+            parsed_update = select_db_sentiment({'chat_id': i, 'reply_to_message_id': i,
+                                                 'score': 0.5, 'language': 'en'})
+            replies += bool(parsed_update.get('text'))
+        db.session.remove()
+        return replies
+
+
+def forked_select_many(app, count, results):
+    # what celery_launcher does in worker_process_init
+    dbpool.reset_engines(app, close=False)
+    results.put(select_many(app, count))
+
+
+class DBPoolTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.create_all()
+        Role.insert_roles()
+        Language.insert_basic_languages()
+        User.generate_fake(2)
+        Sentiment.generate_fake(count=10, language_code='en')
+
+        fd, self.db_path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        # guards listen on the Pool class, do not leave them to the other tests
+        dbpool.remove_guards()
+        os.remove(self.db_path)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def queue_pool_engine(self):
+        return create_engine('sqlite:///' + self.db_path, poolclass=QueuePool, pool_size=1)
+
+    def test_connection_of_other_process_invalidated(self):
+        dbpool.install_guards(pre_ping=False)
+        engine = self.queue_pool_engine()
+        conn = engine.connect()
+        inherited = conn.connection.connection
+        conn.close()
+
+        with patch('PilosusBot.dbpool.os.getpid', return_value=os.getpid() + 1):
+            conn = engine.connect()
+            self.assertIsNot(conn.connection.connection, inherited)
+            self.assertEqual(conn.execute('SELECT 1').scalar(), 1)
+            conn.close()
+
+    def test_pre_ping(self):
+        dbpool.install_guards(pre_ping=True)
+        engine = self.queue_pool_engine()
+        conn = engine.connect()
+        dropped = conn.connection.connection
+        conn.close()
+        # connection closed behind the pool's back, as if by the server
+        dropped.close()
+
+        conn = engine.connect()
+        self.assertIsNot(conn.connection.connection, dropped)
+        self.assertEqual(conn.execute('SELECT 1').scalar(), 1)
+        conn.close()
+
+    def test_reset_engines(self):
+        engine = db.engine
+        dbpool.reset_engines(self.app)
+
+        self.assertEqual(db.get_state(self.app).connectors, {})
+        self.assertIsNot(db.engine, engine)
+        self.assertEqual(Language.query.count(), len(self.app.config['APP_LANGUAGES']))
+
+    def test_reset_engines_in_child(self):
+        engine = Mock()
+        state = db.get_state(self.app)
+        state.connectors['stub'] = Mock(_engine=engine)
+
+        # inherited connections are not closed, the parent still uses them
+        dbpool.reset_engines(self.app, close=False)
+        engine.dispose.assert_not_called()
+        self.assertEqual(state.connectors, {})
+        self.assertIn(engine, dbpool._inherited)
+        dbpool._inherited.remove(engine)
+
+        state.connectors['stub'] = Mock(_engine=engine)
+        dbpool.reset_engines(self.app)
+        engine.dispose.assert_called_with()
+
+    def test_remove_guards(self):
+        from sqlalchemy import event
+        from sqlalchemy.pool import Pool
+        dbpool.install_guards(pre_ping=True)
+        dbpool.remove_guards()
+
+        self.assertFalse(event.contains(Pool, 'connect', dbpool.on_connect))
+        self.assertFalse(event.contains(Pool, 'checkout', dbpool.on_checkout))
+        self.assertFalse(dbpool._ping['enabled'])
+
+    def test_tune_pool(self):
+        dbpool.tune_pool(self.app, 4)
+        # SQLite file connections are not pooled
+        self.assertIsNone(self.app.config.get('SQLALCHEMY_POOL_SIZE'))
+
+        with patch.dict(self.app.config, {'SQLALCHEMY_DATABASE_URI': 'postgresql://bot@localhost/bot'}):
+            dbpool.tune_pool(self.app, 4)
+            self.assertEqual(self.app.config['SQLALCHEMY_POOL_SIZE'], 4)
+            self.assertEqual(self.app.config['SQLALCHEMY_MAX_OVERFLOW'],
+                             self.app.config['APP_DB_POOL_MAX_OVERFLOW'])
+
+    def test_worker_concurrency(self):
+        from celery.concurrency.prefork import TaskPool
+        self.assertEqual(dbpool.worker_concurrency(Mock(pool_cls=TaskPool, concurrency=8)), 1)
+        self.assertEqual(dbpool.worker_concurrency(Mock(pool_cls='threads', concurrency=8)), 8)
+
+    def test_stress_concurrent_select_threads(self):
+        dbpool.install_guards()
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            replies = sum(pool.map(lambda _: select_many(self.app, 25), range(16)))
+        self.assertEqual(replies, 16 * 25)
+
+    def test_stress_concurrent_select_forked(self):
+        dbpool.install_guards()
+        # parent's engine has connected before forking, as celery_launcher's does
+        self.assertEqual(Sentiment.query.count(), 10)
+
+        context = multiprocessing.get_context('fork')
+        results = context.Queue()
+        processes = [context.Process(target=forked_select_many, args=(self.app, 50, results))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=60)
+
+        self.assertEqual([p.exitcode for p in processes], [0] * 4)
+        self.assertEqual(sum(results.get(timeout=5) for _ in processes), 4 * 50)
@@ -0,0 +1,110 @@
+import unittest
+from unittest.mock import patch
+from flask import current_app
+from PilosusBot import create_app, db, celery
+from PilosusBot import deadletter
+from PilosusBot.models import Role, Language, User
+from PilosusBot.tasks import select_db_sentiment, replay_dead_letter
+from tests.helpers import MockRedis
+
+
+class DeadLetterTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        celery.conf.update(CELERY_ALWAYS_EAGER=True)
+
+        db.create_all()
+        Role.insert_roles()
+        Language.insert_basic_languages()
+        User.generate_fake(5)
+
+        self.redis = MockRedis()
+        self.redis_patcher = patch('PilosusBot.deadletter.get_redis', return_value=self.redis)
+        self.redis_patcher.start()
+
+        self.parsed_update = {'update_id': 100500, 'chat_id': 1111111, 'reply_to_message_id': 1,
+                              'text': 'Hello', 'language': 'la', 'score': 0.5}
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.redis_patcher.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_failed_stage_saved(self):
+        # no sentiments in the DB: random.choice raises IndexError
+        with self.assertRaises(IndexError):
+            select_db_sentiment.delay(dict(self.parsed_update)).get(timeout=5)
+
+        saved = deadletter.entries()
+        self.assertEqual(len(saved), 1)
+        entry = saved[0][1]
+        self.assertEqual(entry['stage'], 'select')
+        self.assertEqual(entry['error'], 'IndexError')
+        self.assertEqual(entry['payload'], self.parsed_update)
+
+    def test_entries_filter_and_remove(self):
+        deadletter.add('assess', self.parsed_update, ValueError('Boom!'))
+        deadletter.add('select', self.parsed_update, IndexError('Bang!'))
+        deadletter.add('select', self.parsed_update, ValueError('Boom!' * 1000))
+
+        self.assertEqual([e['stage'] for _, e in deadletter.entries()], ['assess', 'select', 'select'])
+        self.assertEqual(len(deadletter.entries(stage='select')), 2)
+        self.assertEqual(len(deadletter.entries(stage='select', error='ValueError')), 1)
+        self.assertEqual(len(deadletter.entries(limit=1)), 1)
+        self.assertEqual(len(deadletter.entries()[-1][1]['message']),
+                         current_app.config['APP_DLQ_MESSAGE_MAX_LEN'])
+
+        raw, _ = deadletter.entries(stage='assess')[0]
+        self.assertEqual(deadletter.remove(raw), 1)
+        self.assertEqual(deadletter.remove(raw), 0)
+        self.assertEqual(len(deadletter.entries()), 2)
+
+    def test_max_len(self):
+        with patch.dict(current_app.config, {'APP_DLQ_MAX_LEN': 2}):
+            for i in range(3):
+                deadletter.add('assess', dict(self.parsed_update, update_id=i), ValueError())
+
+        self.assertEqual([e['payload']['update_id'] for _, e in deadletter.entries()], [1, 2])
+
+    def test_replay_failure_restores_entry(self):
+        deadletter.add('assess', dict(self.parsed_update, update_id=1), ValueError())
+        deadletter.add('assess', dict(self.parsed_update, update_id=2), ValueError())
+        sent = []
+
+        def send(entry):
+            if entry['payload']['update_id'] == 2:
+                raise ConnectionError('Broker is down')
+            sent.append(entry['payload']['update_id'])
+
+        with self.assertRaises(ConnectionError):
+            deadletter.replay(send, rate=1000.0)
+
+        # the entry failed to be replayed is kept in the store
+        self.assertEqual(sent, [1])
+        self.assertEqual([e['payload']['update_id'] for _, e in deadletter.entries()], [2])
+
+        with self.assertRaises(ValueError):
+            deadletter.replay(send, rate=0)
+
+    @patch('PilosusBot.tasks.chain')
+    @patch('PilosusBot.tasks.celery_chain')
+    def test_replay(self, mock_celery_chain, mock_chain):
+        replay_dead_letter({'stage': 'assess', 'payload': self.parsed_update})
+        mock_celery_chain.assert_called_with(self.parsed_update)
+        mock_chain.assert_not_called()
+
+        mock_celery_chain.reset_mock()
+        replay_dead_letter({'stage': 'select', 'payload': self.parsed_update})
+        mock_celery_chain.assert_not_called()
+        mock_chain().apply_async.assert_called_with()
+
+        mock_chain.reset_mock()
+        with patch('PilosusBot.tasks.resend_message') as mock_resend:
+            replay_dead_letter({'stage': 'send', 'payload': self.parsed_update})
+        mock_resend.assert_called_with(self.parsed_update, 0, reserved=False, created=None, retries=0)
+        mock_chain.assert_not_called()
@@ -0,0 +1,103 @@
+import threading
+import unittest
+from unittest.mock import patch
+from flask import current_app
+from PilosusBot import create_app, executor
+from PilosusBot.executor import PipelineExecutor
+from PilosusBot.tasks import celery_chain
+
+
+class ExecutorTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app.config['APP_PIPELINE_EXECUTOR'] = 'thread'
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.app_context.pop()
+
+    def test_init_app(self):
+        self.assertIs(current_app.extensions['executor'], executor)
+        self.assertTrue(executor.enabled)
+
+    def test_submit(self):
+        pipeline = PipelineExecutor(self.app)
+        results = []
+
+        def job(value, power=1):
+            # app context is pushed in the worker thread
+            results.append((current_app.name, threading.current_thread().name, value ** power))
+
+        self.assertTrue(pipeline.submit(job, 2, power=3))
+        pipeline.join()
+
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0][0], self.app.name)
+        self.assertTrue(results[0][1].startswith('pipeline-'))
+        self.assertEqual(results[0][2], 8)
+
+    def test_submit_countdown(self):
+        pipeline = PipelineExecutor(self.app)
+        done = threading.Event()
+
+        self.assertTrue(pipeline.submit(done.set, countdown=0.05))
+        self.assertTrue(done.wait(timeout=5))
+
+    def test_backpressure(self):
+        self.app.config.update(APP_EXECUTOR_POOL_SIZE=1, APP_EXECUTOR_QUEUE_SIZE=1,
+                               APP_EXECUTOR_QUEUE_TIMEOUT_SEC=0.01)
+        pipeline = PipelineExecutor(self.app)
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_job():
+            started.set()
+            release.wait(timeout=5)
+
+        # the only worker is busy, the queue takes one more job, then jobs get rejected
+        self.assertTrue(pipeline.submit(blocking_job))
+        started.wait(timeout=5)
+        self.assertTrue(pipeline.submit(blocking_job))
+        self.assertFalse(pipeline.submit(blocking_job))
+
+        release.set()
+        pipeline.join()
+
+    @patch('PilosusBot.deadletter.add')
+    def test_delayed_job_rejected(self, mock_add):
+        self.app.config.update(APP_EXECUTOR_POOL_SIZE=1, APP_EXECUTOR_QUEUE_SIZE=1,
+                               APP_EXECUTOR_DELAYED_TIMEOUT_SEC=0.01)
+        pipeline = PipelineExecutor(self.app)
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_job(parsed_update=None):
+            started.set()
+            release.wait(timeout=5)
+
+        self.assertTrue(pipeline.submit(blocking_job))
+        started.wait(timeout=5)
+        self.assertTrue(pipeline.submit(blocking_job))
+
+        # a delayed send finding the queue full is saved for replay, not silently dropped
+        parsed_update = {'update_id': 1, 'chat_id': 1111111, 'text': 'Sentiment'}
+        job = (self.app, blocking_job, (parsed_update,), {})
+        pipeline.put_delayed(job)
+        self.assertEqual(mock_add.call_args[0][:2], ('send', parsed_update))
+
+        release.set()
+        pipeline.join()
+
+    @patch('PilosusBot.tasks.executor.submit', return_value=True)
+    @patch('PilosusBot.tasks.process_update.apply_async')
+    def test_celery_chain(self, mock_apply, mock_submit):
+        parsed_update = {'chat_id': 1111111, 'reply_to_message_id': 1, 'text': 'Hello'}
+
+        self.assertTrue(celery_chain(parsed_update))
+
+        mock_submit.assert_called_once()
+        self.assertEqual(mock_submit.call_args[0][1], parsed_update)
+        mock_apply.assert_not_called()
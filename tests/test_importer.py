@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+from PilosusBot import create_app, db
+from PilosusBot.importer import import_sentiments, read_rows
+from PilosusBot.models import Role, Language, User, Sentiment, SentimentCount
+from PilosusBot.utils import score_to_level
+
+
+class ImporterTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.create_all()
+        Role.insert_roles()
+        Language.insert_basic_languages()
+        self.author = User(email='importer@example.com', username='importer', password='secret')
+        db.session.add(self.author)
+        db.session.commit()
+
+        self.tmp_dir = tempfile.mkdtemp()
+        self.rows = [{'body': 'I *love* it', 'score': '0.9', 'language': 'en',
+                      'timestamp': '2017-01-02T03:04:05'},
+                     {'body': 'Ужасно', 'score': '-0.8', 'language': 'ru', 'timestamp': ''},
+                     {'body': 'Unknown language', 'score': '0.1', 'language': 'xx', 'timestamp': ''},
+                     {'body': 'Bad score', 'score': 'high', 'language': 'en', 'timestamp': ''},
+                     {'body': 'Visit http://example.com', 'score': '0', 'language': 'de', 'timestamp': ''}]
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        shutil.rmtree(self.tmp_dir)
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def write_csv(self):
+        path = os.path.join(self.tmp_dir, 'sentiments.csv')
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            f.write('body,score,language,timestamp\n')
+            for row in self.rows:
+                f.write('"{body}",{score},{language},{timestamp}\n'.format(**row))
+        return path
+
+    def write_jsonl(self):
+        path = os.path.join(self.tmp_dir, 'sentiments.jsonl')
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in self.rows:
+                f.write(json.dumps(row) + '\n')
+        return path
+
+    def assert_imported(self):
+        self.assertEqual(Sentiment.query.count(), 3)
+        self.assertEqual(SentimentCount.of(Language.query.filter_by(code='en').first().id), 1)
+
+        love = Sentiment.query.filter_by(body='I *love* it').first()
+        # tags not allowed are stripped, just like Sentiment.on_changed_body does
+        self.assertEqual(love.body_html, 'I love it')
+        self.assertEqual(love.score, 0.9)
+        self.assertEqual(love.level, score_to_level(0.9))
+        self.assertEqual(love.language.code, 'en')
+        self.assertEqual(love.author, self.author)
+        self.assertEqual(love.timestamp, datetime(2017, 1, 2, 3, 4, 5))
+
+        link = Sentiment.query.filter_by(language=Language.query.filter_by(code='de').first()).first()
+        self.assertIn('<a href="http://example.com"', link.body_html)
+
+    def test_read_rows(self):
+        self.assertEqual([r['body'] for r in read_rows(self.write_csv())],
+                         [r['body'] for r in self.rows])
+        self.assertEqual(list(read_rows(self.write_jsonl())), self.rows)
+
+    def test_import_csv(self):
+        imported, skipped = import_sentiments(self.write_csv(), chunk_size=2, processes=1,
+                                              author_email=self.author.email)
+        self.assertEqual((imported, skipped), (3, 2))
+        self.assert_imported()
+
+    def test_import_jsonl_process_pool(self):
+        imported, skipped = import_sentiments(self.write_jsonl(), chunk_size=2, processes=2,
+                                              author_email=self.author.email)
+        self.assertEqual((imported, skipped), (3, 2))
+        self.assert_imported()
@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+from flask import url_for
+from PilosusBot import create_app
+from PilosusBot import metrics
+from PilosusBot.metrics import Histogram, Counter
+from tests.helpers import MockRedis
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app.config['APP_METRICS_DISABLE'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.client = self.app.test_client(use_cookies=True)
+
+        self.redis = MockRedis()
+        self.redis_patcher = patch('PilosusBot.metrics.get_redis', return_value=self.redis)
+        self.redis_patcher.start()
+        metrics.reset()
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.redis_patcher.stop()
+        self.app_context.pop()
+
+    def test_histogram(self):
+        histogram = Histogram('test_histogram_seconds', 'Test histogram.', buckets=(0.1, 1.0))
+        histogram.observe(0.05, stage='assess')
+        histogram.observe(0.5, stage='assess')
+        histogram.observe(5, stage='assess')
+        with histogram.time(stage='send') as labels:
+            labels['status'] = 200
+
+        text = metrics.exposition()
+
+        self.assertIn('# TYPE test_histogram_seconds histogram', text)
+        self.assertIn('test_histogram_seconds_bucket{stage="assess",le="0.1"} 1.0', text)
+        self.assertIn('test_histogram_seconds_bucket{stage="assess",le="1.0"} 2.0', text)
+        self.assertIn('test_histogram_seconds_bucket{stage="assess",le="+Inf"} 3.0', text)
+        self.assertIn('test_histogram_seconds_sum{stage="assess"} 5.55', text)
+        self.assertIn('test_histogram_seconds_count{stage="assess"} 3.0', text)
+        self.assertIn('test_histogram_seconds_count{stage="send",status="200"} 1.0', text)
+
+    def test_counter_buffered(self):
+        counter = Counter('test_counter', 'Test counter.')
+        with patch.dict(self.app.config, {'APP_METRICS_FLUSH_SEC': 3600}):
+            counter.inc(reason='filtered')
+            counter.inc(2, reason='filtered')
+            # nothing is written to Redis until flush
+            self.assertEqual(self.redis.data, {})
+
+        self.assertIn('test_counter_total{reason="filtered"} 3.0', metrics.exposition())
+
+    def test_untyped_samples(self):
+        metric = metrics.Metric('test_untyped', 'Test metric.')
+        self.assertEqual(metric.samples({'stage="assess"': 2.0}), [('test_untyped', 'stage="assess"', 2.0)])
+
+    def test_disabled(self):
+        counter = Counter('test_counter_disabled', 'Test counter.')
+        with patch.dict(self.app.config, {'APP_METRICS_DISABLE': True}):
+            counter.inc()
+        metrics.flush()
+        self.assertEqual(self.redis.data, {})
+
+    def test_metrics_view(self):
+        metrics.UPDATES_PROCESSED.inc()
+        self.assertEqual(self.client.get(url_for('info.metrics')).status_code, 403)
+
+        with patch.dict(self.app.config, {'APP_METRICS_TOKEN': 'secret'}):
+            response = self.client.get(url_for('info.metrics'),
+                                       headers={'Authorization': 'Bearer wrong'})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.get(url_for('info.metrics'),
+                                       headers={'Authorization': 'Bearer secret'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith('text/plain'))
+        self.assertIn('pilosusbot_updates_processed_total 1.0', response.get_data(as_text=True))
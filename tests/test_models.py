@@ -1,12 +1,18 @@
 from datetime import datetime
 import forgery_py
 import hashlib
+import os
+import tempfile
 import time
 import unittest
-from unittest.mock import patch
+from unittest.mock import patch, Mock
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
 from PilosusBot import create_app, db
-from PilosusBot.models import Role, Language, User, AnonymousUser, Permission, Sentiment
+from PilosusBot.models import Role, Language, User, AnonymousUser, Permission, Sentiment, SentimentCount, \
+    render_cache, FAKE_TIMESTAMP_BASE, FAKE_TIMESTAMP_STEP
 from PilosusBot.exceptions import ValidationError
+from PilosusBot.utils import score_to_level
 from flask import current_app, request
 
 
@@ -406,6 +412,159 @@ class ModelsTestCase(unittest.TestCase):
         sentiments = Sentiment.query.order_by(Sentiment.id.asc()).all()
         self.assertEqual(levels, [s.score for s in sentiments])
 
+    def test_sentiment_generate_fake_bulk(self):
+        User.generate_fake_bulk(count=5, seed=42, batch_size=2)
+        Sentiment.generate_fake_bulk(count=7, subsequent_scores=False, language_code='en',
+                                     seed=42, batch_size=3)
+
+        self.assertEqual(User.query.count(), 5)
+        self.assertEqual(Sentiment.query.count(), 7)
+        # regular users with a random password
+        self.assertEqual(set(u.role.name for u in User.query.all()), {'User'})
+        self.assertFalse(User.query.first().verify_password('password'))
+
+        sentiments = Sentiment.query.order_by(Sentiment.id.asc()).all()
+        user_ids = set(u.id for u in User.query.all())
+        for s in sentiments:
+            self.assertEqual(s.language.code, 'en')
+            self.assertEqual(s.level, score_to_level(s.score))
+            self.assertIn(s.author_id, user_ids)
+            self.assertTrue(s.body_html)
+
+        # the same seed gives the same data
+        generated = [(s.body, s.score, s.author_id, s.timestamp) for s in sentiments]
+        Sentiment.query.delete()
+        db.session.commit()
+        Sentiment.generate_fake_bulk(count=7, subsequent_scores=False, language_code='en', seed=42)
+        self.assertEqual([(s.body, s.score, s.author_id, s.timestamp)
+                          for s in Sentiment.query.order_by(Sentiment.id.asc()).all()], generated)
+
+    def test_sentiment_generate_fake_bulk_timestamps(self):
+        User.generate_fake_bulk(count=1, seed=42)
+        Sentiment.generate_fake_bulk(count=3, seed=42)
+        timestamps = [s.timestamp for s in Sentiment.query.order_by(Sentiment.id.asc()).all()]
+        self.assertEqual(timestamps, [FAKE_TIMESTAMP_BASE - FAKE_TIMESTAMP_STEP * i for i in range(3)])
+
+        # timestamp of the last of 10M sentiments is still far from datetime.min
+        self.assertGreater(FAKE_TIMESTAMP_BASE - FAKE_TIMESTAMP_STEP * 10 ** 7, datetime(2016, 1, 1))
+
+    def test_sentiment_level(self):
+        User.generate_fake(count=2)
+        Sentiment.generate_fake(count=2, subsequent_scores=True, levels=[0.375, 0.625])
+        sentiments = Sentiment.query.order_by(Sentiment.id.asc()).all()
+
+        self.assertEqual([s.level for s in sentiments], [375, 625])
+
+        # level is kept in sync with score on write
+        sentiments[0].score = 0.75
+        db.session.add(sentiments[0])
+        db.session.commit()
+
+        self.assertEqual(Sentiment.query.filter(Sentiment.level == 750).first(), sentiments[0])
+
+    def test_sentiment_render_cache(self):
+        render_cache.clear()
+        first = Sentiment(body='*Lorem* http://example.com', score=0.5)
+        second = Sentiment(body='*Lorem* http://example.com', score=0.5)
+
+        self.assertEqual(first.body_html, second.body_html)
+        self.assertIn('<a href="http://example.com"', first.body_html)
+        self.assertEqual((render_cache.hits, render_cache.misses), (1, 1))
+
+        # unchanged body is not rendered again
+        first.body = '*Lorem* http://example.com'
+        self.assertEqual((render_cache.hits, render_cache.misses), (1, 1))
+
+        # allowed tags are the part of the key
+        with patch.dict(current_app.config, {'APP_ALLOWED_TAGS': ['em']}):
+            third = Sentiment(body='*Lorem* http://example.com', score=0.5)
+        self.assertEqual(render_cache.misses, 2)
+        self.assertIn('<em>Lorem</em>', third.body_html)
+        self.assertNotEqual(third.body_html, first.body_html)
+
+        with patch.dict(current_app.config, {'APP_RENDER_CACHE_SIZE': 1}):
+            Sentiment(body='Ipsum', score=0.5)
+        stats = render_cache.stats()
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['hit_rate'], 0.25)
+
+    def test_sentiment_counts(self):
+        User.generate_fake(count=2)
+        Sentiment.generate_fake(count=8, language_code='en')
+        Sentiment.generate_fake_bulk(count=4, language_code='ru', seed=1)
+        en = Language.query.filter_by(code='en').first()
+        ru = Language.query.filter_by(code='ru').first()
+
+        def actual(language, level=None):
+            query = Sentiment.query.filter_by(language_id=language.id)
+            return query.filter_by(level=level).count() if level is not None else query.count()
+
+        sentiment = Sentiment.query.filter_by(language_id=en.id).first()
+        level = sentiment.level
+        self.assertEqual(SentimentCount.of(en.id), 8)
+        self.assertEqual(SentimentCount.of(ru.id), 4)
+        self.assertEqual(SentimentCount.of(en.id, level), actual(en, level))
+
+        # score and language changed
+        sentiment.score = 0.0 if level != 0 else 1.0
+        sentiment.language = ru
+        db.session.add(sentiment)
+        db.session.commit()
+        self.assertEqual(SentimentCount.of(en.id), 7)
+        self.assertEqual(SentimentCount.of(en.id, level), actual(en, level))
+        self.assertEqual(SentimentCount.of(ru.id, sentiment.level), actual(ru, sentiment.level))
+        self.assertIn(sentiment.level, SentimentCount.levels(ru.id))
+
+        db.session.delete(sentiment)
+        db.session.commit()
+        self.assertEqual(SentimentCount.of(ru.id), 4)
+
+        # bulk delete
+        Sentiment.query.filter_by(language_id=ru.id, level=Sentiment.query.filter_by(
+            language_id=ru.id).first().level).delete()
+        db.session.commit()
+        self.assertEqual(SentimentCount.of(ru.id), actual(ru))
+
+        db.session.delete(en)
+        db.session.commit()
+        self.assertEqual(SentimentCount.query.filter_by(language_id=en.id).count(), 0)
+
+        SentimentCount.query.delete()
+        self.assertEqual(SentimentCount.recompute(), len(SentimentCount.levels(ru.id)))
+        self.assertEqual(SentimentCount.of(ru.id), actual(ru))
+
+    def test_sentiment_count_first_of_level_in_two_sessions(self):
+        fd, db_path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        engine = create_engine('sqlite:///' + db_path)
+        SentimentCount.__table__.create(engine)
+        first, second = engine.connect(), engine.connect()
+        try:
+            # both transactions started before either has counted the pair
+            first_tx, second_tx = first.begin(), second.begin()
+            SentimentCount.add(first, 1, 3, 1)
+            first_tx.commit()
+            SentimentCount.add(second, 1, 3, 1)
+            second_tx.commit()
+
+            table = SentimentCount.__table__
+            self.assertEqual(first.execute(db.select([table.c.count])).fetchall(), [(2,)])
+        finally:
+            first.close()
+            second.close()
+            engine.dispose()
+            os.remove(db_path)
+
+    def test_sentiment_count_upsert_postgresql(self):
+        connection = Mock()
+        connection.dialect.name = 'postgresql'
+        SentimentCount.add(connection, 1, 3, 2)
+
+        self.assertEqual(connection.execute.call_count, 1)
+        statement = str(connection.execute.call_args[0][0].compile(dialect=postgresql.dialect()))
+        self.assertIn('ON CONFLICT (language_id, level) DO UPDATE SET count = '
+                      '(sentiment_counts.count + ', statement)
+
     def test_sentiment_json(self):
         User.generate_fake(count=2)
         Sentiment.generate_fake(count=1)
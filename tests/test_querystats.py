@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import patch
+from PilosusBot import create_app, db
+from PilosusBot import metrics, querystats
+from PilosusBot.models import Role, Language
+from tests.helpers import MockRedis
+
+
+class QueryStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app.config['APP_METRICS_DISABLE'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.create_all()
+        Role.insert_roles()
+
+        self.redis = MockRedis()
+        self.redis_patcher = patch('PilosusBot.metrics.get_redis', return_value=self.redis)
+        self.redis_patcher.start()
+        metrics.reset()
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.redis_patcher.stop()
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_scope(self):
+        self.assertIsNone(querystats.end_scope())
+
+        querystats.start_scope('task:PilosusBot.tasks.select_db_sentiment')
+        Language.query.all()
+        Language.query.filter_by(code='en').first()
+        scope, queries, seconds = querystats.end_scope()
+
+        self.assertEqual(scope, 'task:PilosusBot.tasks.select_db_sentiment')
+        self.assertEqual(queries, 2)
+        self.assertGreater(seconds, 0)
+        self.assertIsNone(querystats.current_scope())
+
+        querystats.start_scope('task:PilosusBot.tasks.select_db_sentiment')
+        querystats.end_scope()
+
+        self.assertEqual(querystats.aggregates(),
+                         [{'scope': 'task:PilosusBot.tasks.select_db_sentiment',
+                           'calls': 2, 'queries': 2, 'seconds': seconds}])
+
+    def test_request_scope(self):
+        self.app.test_client().get('/')
+
+        scopes = [a['scope'] for a in querystats.aggregates()]
+        self.assertIn('endpoint:info.index', scopes)
+
+    def test_slow_query_logged(self):
+        with patch.dict(self.app.config, {'APP_SLOW_QUERY_SEC': 0}), \
+                patch.object(self.app.logger, 'warning') as mock_warning:
+            Role.query.all()
+
+        args = mock_warning.call_args[0]
+        self.assertIn('Slow query', args[0])
+        # call site is the code issuing the statement (here, the test), not SQLAlchemy's
+        self.assertIn('tests/test_querystats.py', args[3])
+        self.assertIn('in test_slow_query_logged', args[3])
+        self.assertIn('SELECT', args[4])
+
+        with patch.dict(self.app.config, {'APP_SLOW_QUERY_SEC': 0}), \
+                patch.object(self.app.logger, 'warning') as mock_warning:
+            Role.insert_roles()
+
+        self.assertTrue(any('PilosusBot/models.py' in str(c[0][3]) and 'insert_roles' in str(c[0][3])
+                            for c in mock_warning.call_args_list))
@@ -0,0 +1,54 @@
+import unittest
+from unittest.mock import MagicMock, patch
+from flask import current_app
+from PilosusBot import create_app, limiter
+from PilosusBot.ratelimit import RateLimiter
+
+
+class RateLimiterTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.app_context.pop()
+
+    def test_init_app(self):
+        self.assertIs(current_app.extensions['rate_limiter'], limiter)
+
+    def test_buckets(self):
+        rate_limiter = RateLimiter(self.app)
+        prefix = current_app.config['TELEGRAM_RATE_KEY_PREFIX']
+        global_interval = 1000.0 / current_app.config['TELEGRAM_RATE_GLOBAL_PER_SEC']
+
+        self.assertEqual([b[0] for b in rate_limiter.buckets()], [prefix + ':global'])
+        self.assertEqual(rate_limiter.buckets()[0][1], global_interval)
+
+        private = rate_limiter.buckets(1111111)
+        self.assertEqual(private[1],
+                         (prefix + ':chat:1111111',
+                          1000.0 / current_app.config['TELEGRAM_RATE_CHAT_PER_SEC'], 1))
+
+        group = rate_limiter.buckets(-1111111)
+        self.assertEqual(group[1],
+                         (prefix + ':chat:-1111111',
+                          60000.0 / current_app.config['TELEGRAM_RATE_GROUP_PER_MIN'], 1))
+
+    def test_reserve(self):
+        rate_limiter = RateLimiter(self.app)
+        rate_limiter._script = MagicMock(return_value=1500)
+
+        with patch('PilosusBot.ratelimit.time.time', return_value=100.0):
+            delay = rate_limiter.reserve(1111111)
+
+        self.assertEqual(delay, 1.5)
+        kwargs = rate_limiter._script.call_args[1]
+        self.assertEqual(len(kwargs['keys']), 2)
+        # now, then (interval, tolerance) for the global and the chat buckets
+        self.assertEqual(kwargs['args'][0], 100000)
+        self.assertEqual(len(kwargs['args']), 5)
+        # a single message per chat, no burst
+        self.assertEqual(kwargs['args'][4], 0)
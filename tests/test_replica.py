@@ -0,0 +1,67 @@
+import unittest
+from unittest.mock import patch, Mock
+from sqlalchemy.exc import OperationalError
+from PilosusBot import create_app, db, replica
+from PilosusBot.models import Role, Language, User, Sentiment
+from PilosusBot.tasks import select_db_sentiment
+
+
+class ReplicaTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        # the testing DB plays the replica's part
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica': self.app.config['SQLALCHEMY_DATABASE_URI']}
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        db.create_all()
+        Role.insert_roles()
+        Language.insert_basic_languages()
+        User.generate_fake(2)
+        Sentiment.generate_fake(count=5, language_code='en')
+        replica._checked_at = None
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        replica._checked_at = None
+        self.app.config['SQLALCHEMY_BINDS'] = None
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+
+    def test_query_routed_to_replica(self):
+        self.assertTrue(replica.available())
+        query = replica.query(Sentiment)
+        self.assertIs(query.session, replica.session())
+        self.assertEqual(query.count(), 5)
+
+    def test_not_configured(self):
+        self.app.config['SQLALCHEMY_BINDS'] = None
+        self.assertFalse(replica.available())
+        self.assertIs(replica.query(Sentiment).session, db.session())
+
+    def test_lagging_replica(self):
+        with patch.object(replica, 'lag', return_value=self.app.config['APP_DB_REPLICA_MAX_LAG_SEC'] + 1):
+            self.assertFalse(replica.available())
+        # state is kept until the next check
+        self.assertFalse(replica.available())
+        self.assertIs(replica.query(Sentiment).session, db.session())
+
+    def test_unavailable_replica(self):
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite:////nonexistent/replica.sqlite'}
+        self.assertFalse(replica.available())
+
+    def test_run_falls_back_to_primary(self):
+        f = Mock(side_effect=[OperationalError('SELECT 1', {}, Exception('replica is gone')), 'primary'])
+        self.assertEqual(replica.run(f, 'en'), 'primary')
+        self.assertIs(f.call_args_list[0][0][0], replica.session)
+        self.assertIs(f.call_args_list[1][0][0], db.session)
+        self.assertFalse(replica.available())
+
+    def test_select_stage_reads_replica(self):
+        with patch.object(replica, 'run', wraps=replica.run) as mock_run:
+            parsed_update = select_db_sentiment({'chat_id': 1, 'reply_to_message_id': 1,
+                                                 'score': 0.5, 'language': 'en'})
+        self.assertTrue(parsed_update['text'])
+        self.assertEqual(mock_run.call_args[0][0].__name__, 'candidate_sentiments')
@@ -0,0 +1,116 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+from flask import current_app
+from PilosusBot import create_app
+from PilosusBot.sender import AsyncSender
+from PilosusBot.telegram_api import send_message_payload
+
+
+class AsyncSenderTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.loop = asyncio.new_event_loop()
+        self.sender = AsyncSender(self.app, concurrency=10, loop=self.loop)
+        self.loop.run_until_complete(self.sender.start())
+        self.parsed_update = {'chat_id': 1111111, 'reply_to_message_id': 1, 'text': 'Sentiment'}
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.loop.run_until_complete(self.sender.stop())
+        self.loop.close()
+        self.app_context.pop()
+
+    def mock_post(self, reply):
+        calls = []
+
+        async def post(method, payload):
+            calls.append((method, payload))
+            return reply
+
+        self.sender.post = post
+        return calls
+
+    def test_concurrency(self):
+        self.assertEqual(self.sender.concurrency, 10)
+        sender = AsyncSender(self.app, loop=self.loop)
+        self.assertEqual(sender.concurrency, current_app.config['TELEGRAM_ASYNC_CONCURRENCY'])
+
+    def test_process(self):
+        calls = self.mock_post({'ok': True})
+
+        result = self.loop.run_until_complete(self.sender.process(self.parsed_update, {}))
+
+        self.assertEqual(result, {'ok': True})
+        self.assertEqual(calls, [('sendMessage', send_message_payload(self.parsed_update))])
+
+    @patch('PilosusBot.sender.send_message_to_chat.apply_async')
+    def test_process_retry(self, mock_apply):
+        self.mock_post({'ok': False, 'error_code': 429, 'parameters': {'retry_after': 5}})
+
+        self.loop.run_until_complete(self.sender.process(self.parsed_update, {'retries': 1},
+                                                         created=None))
+
+        self.assertEqual(mock_apply.call_args[1]['countdown'], 5.0)
+        self.assertEqual(mock_apply.call_args[1]['retries'], 2)
+
+    def test_handle_acks_message(self):
+        self.mock_post({'ok': True})
+        message = MagicMock(headers={'task': 'PilosusBot.tasks.send_message_to_chat'})
+
+        self.loop.run_until_complete(self.sender.handle(message, [self.parsed_update], {}))
+        self.sender.flush_acks()
+
+        message.ack.assert_called_with()
+
+    def test_on_message_unexpected_task(self):
+        message = MagicMock(headers={'task': 'PilosusBot.tasks.assess_message_score'})
+
+        self.sender.on_message([[self.parsed_update], {}, {}], message)
+
+        message.reject.assert_called_with()
+
+    @patch('PilosusBot.sender.asyncio.run_coroutine_threadsafe')
+    def test_on_message_eta_not_counted_against_prefetch(self, mock_run):
+        self.sender.consumer = MagicMock()
+        eta = (datetime.utcnow() + timedelta(seconds=30)).isoformat()
+        message = MagicMock(headers={'task': 'PilosusBot.tasks.send_message_to_chat', 'eta': eta})
+
+        self.sender.on_message([[self.parsed_update], {}, {}], message)
+        self.sender.consumer.qos.assert_called_with(prefetch_count=11)
+        mock_run.assert_called()
+
+        # prefetch is restored once the message is acknowledged
+        self.sender.acks.put(message)
+        self.sender.flush_acks()
+        self.sender.consumer.qos.assert_called_with(prefetch_count=10)
+        self.assertEqual(self.sender.held, set())
+
+    @patch('PilosusBot.sender.record_status')
+    @patch('PilosusBot.sender.send_message_to_chat.apply_async')
+    @patch('PilosusBot.sender.limiter.reserve', return_value=5.0)
+    def test_process_rate_limited_requeued(self, mock_reserve, mock_apply, mock_status):
+        calls = self.mock_post({'ok': True})
+
+        with patch.dict(current_app.config, {'TELEGRAM_RATE_LIMIT_DISABLE': False}):
+            result = self.loop.run_until_complete(self.sender.process(self.parsed_update, {}))
+
+        mock_reserve.assert_called_with(self.parsed_update['chat_id'])
+        self.assertEqual(calls, [])
+        self.assertIsNone(result['ok'])
+        self.assertEqual(mock_apply.call_args[1]['countdown'], 5.0)
+        self.assertTrue(mock_apply.call_args[1]['kwargs']['reserved'])
+
+    @patch('PilosusBot.sender.limiter.reserve', return_value=0.01)
+    def test_process_rate_limited_short_delay(self, mock_reserve):
+        calls = self.mock_post({'ok': True})
+
+        with patch.dict(current_app.config, {'TELEGRAM_RATE_LIMIT_DISABLE': False}):
+            result = self.loop.run_until_complete(self.sender.process(self.parsed_update, {}))
+
+        self.assertEqual(result, {'ok': True})
+        self.assertEqual(len(calls), 1)
@@ -0,0 +1,66 @@
+import unittest
+from kombu.serialization import dumps as kombu_dumps, loads as kombu_loads
+from PilosusBot import create_app
+from PilosusBot.serializers import SERIALIZER_NAME, CONTENT_TYPE, RAW, ZLIB, \
+    dumps, loads, pack_update, unpack_update, settings
+
+
+class SerializersTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        self.parsed_update = {'chat_id': -1001234567890, 'reply_to_message_id': 7,
+                              'text': 'Lorem ipsum', 'language': 'la', 'score': 0.625}
+        # Celery message protocol v2 body: args, kwargs, embed
+        self.body = [[self.parsed_update], {'reserved': False},
+                     {'callbacks': None, 'errbacks': None, 'chord': None,
+                      'chain': [{'task': 'PilosusBot.tasks.send_message_to_chat',
+                                 'args': [], 'kwargs': {}, 'options': {}}]}]
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.app_context.pop()
+
+    def test_pack_update(self):
+        self.assertEqual(unpack_update(pack_update(self.parsed_update)), self.parsed_update)
+        self.assertEqual(unpack_update(pack_update({'chat_id': 1})), {'chat_id': 1})
+
+        # unknown keys survive the round trip
+        update = dict(self.parsed_update, parse_mode='HTML', update_id=42)
+        self.assertEqual(unpack_update(pack_update(update)), update)
+
+        # schema keeps keys out of the packed data
+        self.assertNotIn(b'reply_to_message_id', pack_update(self.parsed_update))
+
+    def test_dumps_loads(self):
+        data = dumps(self.body)
+        self.assertEqual(data[:1], RAW)
+        self.assertEqual(loads(data), self.body)
+
+    def test_compression(self):
+        body = [[dict(self.parsed_update, text='Lorem ipsum ' * 300)], {}, {}]
+        compress_min_bytes = settings['compress_min_bytes']
+        try:
+            settings['compress_min_bytes'] = 1024
+            data = dumps(body)
+        finally:
+            settings['compress_min_bytes'] = compress_min_bytes
+
+        self.assertEqual(data[:1], ZLIB)
+        self.assertLess(len(data), 1024)
+        self.assertEqual(loads(data), body)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            loads(b'\x07' + dumps(self.body)[1:])
+
+    def test_registered(self):
+        content_type, content_encoding, data = kombu_dumps(self.body, serializer=SERIALIZER_NAME)
+
+        self.assertEqual(content_type, CONTENT_TYPE)
+        self.assertEqual(content_encoding, 'binary')
+        self.assertEqual(kombu_loads(data, content_type, content_encoding,
+                                     accept=[SERIALIZER_NAME]),
+                         self.body)
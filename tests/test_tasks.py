@@ -1,12 +1,17 @@
 from requests.exceptions import RequestException
+import time
 import unittest
-from unittest.mock import patch, call
+from unittest.mock import patch, call, ANY
 from PilosusBot import create_app, db, celery
 from PilosusBot.models import Role, Language, User, Sentiment
 from PilosusBot.tasks import celery_chain, assess_message_score, \
-    select_db_sentiment, send_message_to_chat
-from PilosusBot.processing import parse_update
-from tests.helpers import HTTP, TelegramUpdates, MockSentiment, MockCappedCollection
+    select_db_sentiment, send_message_to_chat, retry_countdown, process_update, stage_queue, \
+    refresh_chat_members_count
+from PilosusBot.processing import parse_update, check_in_text, get_status, update_priority
+from PilosusBot.exceptions import ExpiredTextError
+from PilosusBot.telegram_api import send_message_payload, JSON_HEADERS
+from tests.helpers import HTTP, TelegramUpdates, MockSentiment, MockCappedCollection, \
+    MockResponse, MockRedis
 from flask import current_app
 from indicoio.utils.errors import IndicoError
 
@@ -85,6 +90,53 @@ class TasksTestCase(unittest.TestCase):
         self.assertEqual(mock_indicoio.config.api_key, current_app.config['INDICO_TOKEN'])
         mock_indicoio.sentiment.assert_called_with(parsed_update['text'], language='latin')
 
+    @patch('PilosusBot.processing.get_redis')
+    @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
+    @patch('PilosusBot.tasks.indicoio', autospec=True)
+    def test_assess_message_score_claim_check(self, mock_indicoio, mock_redis):
+        mock_indicoio.sentiment.return_value = 0.87654321
+        mock_redis.return_value = MockRedis()
+        current_app.config['APP_TEXT_CLAIM_CHECK_MIN_LEN'] = 1
+
+        update = TelegramUpdates.TEXT_OK_ID_OK_TEXT
+        update['update_id'] -= 10
+
+        parsed_update = parse_update(update)
+        checked_in = check_in_text(parsed_update)
+
+        # text is stored in Redis, only the reference is passed to the chain
+        self.assertNotIn('text', checked_in)
+        key = checked_in['text_ref']
+        self.assertTrue(key.startswith(current_app.config['APP_TEXT_CLAIM_KEY_PREFIX'] + ':'))
+        self.assertEqual(mock_redis.return_value.ttl[key],
+                         current_app.config['APP_TEXT_CLAIM_TTL_SEC'])
+
+        result = assess_message_score.delay(checked_in).get(timeout=5)
+
+        self.assertEqual(result['score'], 0.87654321)
+        self.assertNotIn('text_ref', result)
+        self.assertNotIn('text', result)
+        self.assertIsNone(mock_redis.return_value.get(key))
+        mock_indicoio.sentiment.assert_called_with(parsed_update['text'], language='latin')
+
+        # the text can be taken only once
+        with self.assertRaises(ExpiredTextError):
+            assess_message_score.delay(checked_in).get(timeout=5)
+
+    @patch('PilosusBot.processing.get_redis')
+    @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
+    def test_check_in_text_short(self, mock_redis):
+        update = TelegramUpdates.TEXT_OK_ID_OK_TEXT
+        update['update_id'] -= 10
+        parsed_update = parse_update(update)
+
+        # disabled by default
+        self.assertEqual(check_in_text(parsed_update), parsed_update)
+
+        current_app.config['APP_TEXT_CLAIM_CHECK_MIN_LEN'] = len(parsed_update['text']) + 1
+        self.assertEqual(check_in_text(parsed_update), parsed_update)
+        mock_redis.assert_not_called()
+
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     def test_select_db_sentiment(self):
         parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
@@ -120,7 +172,7 @@ class TasksTestCase(unittest.TestCase):
         mock_random.choice.assert_called()
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_send_message_to_chat(self, mock_requests):
         parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
         parsed_update['parse_mode'] = 'HTML'
@@ -136,18 +188,152 @@ class TasksTestCase(unittest.TestCase):
 
         mock_requests.assert_called()
         self.assertIn(call(current_app.config['TELEGRAM_URL'] + 'sendMessage',
-                      json=parsed_update,
+                      data=send_message_payload(parsed_update),
+                      headers=JSON_HEADERS,
                       timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC']),
                       mock_requests.call_args_list)
 
-    @patch('requests.post', side_effect=RequestException('Boom!'))
+    @patch('PilosusBot.processing.get_redis')
+    @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
+    def test_send_message_to_chat_status(self, mock_requests, mock_redis):
+        mock_redis.return_value = MockRedis()
+        current_app.config['APP_UPDATE_STATUS_TTL_SEC'] = 60
+        current_app.config['TELEGRAM_RETRY_MAX'] = 0
+
+        parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
+        parsed_update['text'] = 'Sentiment'
+        update_id = parsed_update['update_id']
+
+        self.assertEqual(get_status(update_id), {})
+
+        # mocked Telegram replies with an error
+        result = send_message_to_chat.delay(parsed_update).get(timeout=5)
+        status = get_status(update_id)
+
+        self.assertEqual(status['stage'], 'failed')
+        self.assertEqual(status['error_code'], str(result['error_code']))
+        self.assertIn('failed', status)
+        self.assertEqual(list(mock_redis.return_value.ttl.values()), [60])
+
+        # no status recorded if disabled
+        current_app.config['APP_UPDATE_STATUS_TTL_SEC'] = 0
+        mock_redis.return_value.data.clear()
+        send_message_to_chat.delay(parsed_update).get(timeout=5)
+        self.assertEqual(get_status(update_id), {})
+
+    @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
+    @patch('PilosusBot.tasks.send_message_to_chat.apply_async')
+    @patch('PilosusBot.tasks.limiter.reserve', return_value=1.5)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
+    def test_send_message_to_chat_rate_limited(self, mock_requests, mock_reserve, mock_apply):
+        parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
+        parsed_update['text'] = 'Sentiment'
+
+        with patch.dict(current_app.config, {'TELEGRAM_RATE_LIMIT_DISABLE': False}):
+            # apply() runs the task locally without calling the mocked apply_async
+            result = send_message_to_chat.apply(args=[parsed_update]).get(timeout=5)
+
+        mock_reserve.assert_called_with(parsed_update['chat_id'])
+        mock_apply.assert_called_with(args=[parsed_update],
+                                      kwargs={'reserved': True, 'created': ANY},
+                                      countdown=1.5,
+                                      retries=0,
+                                      queue=current_app.config['CELERY_QUEUE_SEND'])
+        self.assertEqual(mock_requests.call_args_list, [])
+        self.assertIsNone(result['ok'])
+
+        # slot already reserved, message is sent without asking the limiter again
+        mock_reserve.reset_mock()
+        with patch.dict(current_app.config, {'TELEGRAM_RATE_LIMIT_DISABLE': False}):
+            result = send_message_to_chat.apply(args=[parsed_update],
+                                                kwargs={'reserved': True}).get(timeout=5)
+
+        mock_reserve.assert_not_called()
+        mock_requests.assert_called()
+        self.assertEqual(result['text'], parsed_update['text'])
+
+    @patch('PilosusBot.tasks.limiter.reserve', return_value=0.0)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
+    def test_send_message_to_chat_no_chat(self, mock_requests, mock_reserve):
+        # nothing to send: neither a rate limiter slot nor a request is spent
+        with patch.dict(current_app.config, {'TELEGRAM_RATE_LIMIT_DISABLE': False}):
+            result = send_message_to_chat.apply(args=[{}]).get(timeout=5)
+
+        mock_reserve.assert_not_called()
+        self.assertEqual(mock_requests.call_args_list, [])
+        self.assertIsNone(result['ok'])
+
+    @patch('requests.Session.post', side_effect=RequestException('Boom!'))
     def test_send_message_to_chat_raise_exception(self, mock_requests):
-        result = send_message_to_chat.delay({}).get(timeout=5)
+        # network errors are retried, the error is returned when retries are exhausted
+        with patch.dict(current_app.config, {'TELEGRAM_RETRY_MAX': 0}):
+            result = send_message_to_chat.delay({}).get(timeout=5)
 
         self.assertEqual(result['ok'], False)
         self.assertEqual(result['error_code'], 599)
         self.assertEqual(result['description'], 'Boom!')
 
+    @patch('PilosusBot.tasks.send_message_to_chat.apply_async')
+    @patch('requests.Session.post')
+    def test_send_message_to_chat_retry(self, mock_requests, mock_retry):
+        mock_requests.return_value = MockResponse({'ok': False, 'error_code': 429,
+                                                   'description': 'Too Many Requests',
+                                                   'parameters': {'retry_after': 7}}, 429)
+        parsed_update = {'chat_id': 1111111, 'reply_to_message_id': 1, 'text': 'Sentiment'}
+
+        send_message_to_chat.apply(args=[parsed_update])
+
+        self.assertEqual(mock_retry.call_args[1]['countdown'], 7.0)
+        self.assertEqual(mock_retry.call_args[1]['kwargs']['reserved'], False)
+        self.assertEqual(mock_retry.call_args[1]['retries'], 1)
+
+        # 4xx other than 429 is not retried
+        mock_retry.reset_mock()
+        mock_requests.return_value = MockResponse({'ok': False, 'error_code': 400,
+                                                   'description': 'Bad Request'}, 400)
+        result = send_message_to_chat.apply(args=[parsed_update]).get(timeout=5)
+
+        mock_retry.assert_not_called()
+        self.assertEqual(result['error_code'], 400)
+
+        # message too old to be retried
+        mock_requests.return_value = MockResponse({'ok': False, 'error_code': 502,
+                                                   'description': 'Bad Gateway'}, 502)
+        result = send_message_to_chat.apply(args=[parsed_update],
+                                            kwargs={'created': 1.0}).get(timeout=5)
+
+        mock_retry.assert_not_called()
+        self.assertEqual(result['error_code'], 502)
+
+    @patch('PilosusBot.tasks.limiter.pause')
+    def test_retry_countdown(self, mock_pause):
+        backoff = current_app.config['TELEGRAM_RETRY_BACKOFF_SEC']
+        backoff_max = current_app.config['TELEGRAM_RETRY_BACKOFF_MAX_SEC']
+
+        now = time.time()
+
+        self.assertIsNone(retry_countdown({'ok': True}, 1, 0, now))
+        self.assertIsNone(retry_countdown({'ok': False, 'error_code': 403}, 1, 0, now))
+
+        countdown = retry_countdown({'ok': False, 'error_code': 599}, 1, 2, now)
+        self.assertGreaterEqual(countdown, backoff * 4 * 0.5)
+        self.assertLessEqual(countdown, backoff * 4)
+
+        with patch.dict(current_app.config, {'TELEGRAM_RETRY_MAX': 100}):
+            self.assertLessEqual(retry_countdown({'ok': False, 'error_code': 500}, 1, 99, now),
+                                 backoff_max)
+
+        # retries exhausted
+        retries_max = current_app.config['TELEGRAM_RETRY_MAX']
+        self.assertIsNone(retry_countdown({'ok': False, 'error_code': 500}, 1, retries_max, now))
+
+        with patch.dict(current_app.config, {'TELEGRAM_RATE_LIMIT_DISABLE': False}):
+            countdown = retry_countdown({'ok': False, 'error_code': 429,
+                                         'parameters': {'retry_after': 3}}, -1, 0, now)
+        self.assertEqual(countdown, 3.0)
+        mock_pause.assert_called_with(3, -1)
+
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.tasks.assess_message_score.s')
     @patch('PilosusBot.tasks.select_db_sentiment.s')
@@ -155,9 +341,9 @@ class TasksTestCase(unittest.TestCase):
     @patch('PilosusBot.tasks.chain', autospec=True)
     def test_celery_chain(self, mock_chain, mock_send, mock_select, mock_assess):
         mock_chain().apply_async.return_value = 'Hola!'
-        mock_assess.return_value = 1
-        mock_select.return_value = 2
-        mock_send.return_value = 3
+        mock_assess.return_value.set.return_value = 1
+        mock_select.return_value.set.return_value = 2
+        mock_send.return_value.set.return_value = 3
         parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
 
         result = celery_chain(parsed_update)
@@ -167,3 +353,87 @@ class TasksTestCase(unittest.TestCase):
         mock_assess.assert_called_with(parsed_update)
         mock_select.assert_called_with()
         mock_send.assert_called_with()
+        mock_assess.return_value.set.assert_called_with(queue=current_app.config['CELERY_QUEUE_ASSESS'])
+
+    @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
+    @patch('PilosusBot.tasks.process_update.apply_async', return_value='Hola!')
+    @patch('PilosusBot.tasks.chain', autospec=True)
+    def test_celery_chain_fused(self, mock_chain, mock_apply):
+        parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
+
+        with patch.dict(current_app.config, {'CELERY_PIPELINE_FUSED': True}):
+            result = celery_chain(parsed_update)
+
+        self.assertEqual(result, 'Hola!')
+        mock_apply.assert_called_with(args=[parsed_update], queue=current_app.config['CELERY_QUEUE_ASSESS'])
+        mock_chain.assert_not_called()
+
+    @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
+    def test_stage_queue(self):
+        parsed_update = parse_update(TelegramUpdates.TEXT_OK_ID_OK_TEXT)
+        self.assertEqual(parsed_update['chat_type'], 'private')
+        self.assertEqual(update_priority(parsed_update), 'high')
+        self.assertEqual(update_priority(dict(parsed_update, chat_type='supergroup')), 'low')
+
+        lanes = {'CELERY_QUEUE_SEND': 'send', 'CELERY_QUEUE_SEND_PRIORITY': 'send_priority'}
+        with patch.dict(current_app.config, lanes):
+            self.assertEqual(stage_queue('send', dict(parsed_update, priority='high')), 'send_priority')
+            self.assertEqual(stage_queue('send', dict(parsed_update, priority='low')), 'send')
+            self.assertEqual(stage_queue('send', parsed_update), 'send')
+
+        # no priority lane configured
+        with patch.dict(current_app.config, {'CELERY_QUEUE_SEND': 'send', 'CELERY_QUEUE_SEND_PRIORITY': None}):
+            self.assertEqual(stage_queue('send', dict(parsed_update, priority='high')), 'send')
+
+    @patch('PilosusBot.processing.telegram.post')
+    @patch('PilosusBot.processing.get_redis')
+    def test_update_priority_group_size(self, mock_redis, mock_post):
+        mock_redis.return_value = MockRedis()
+        mock_post.return_value = MockResponse({'ok': True, 'result': 150}, 200)
+        parsed_update = {'chat_id': -100500, 'chat_type': 'supergroup'}
+
+        with patch.dict(current_app.config, {'APP_PRIORITY_GROUP_MAX_MEMBERS': 200}):
+            # size is not known yet: low lane, Telegram is asked in the background
+            with patch('PilosusBot.tasks.refresh_chat_members_count.apply_async') as mock_apply:
+                self.assertEqual(update_priority(parsed_update), 'low')
+                self.assertEqual(update_priority(parsed_update), 'low')
+            mock_apply.assert_called_once_with(args=[-100500])
+            mock_post.assert_not_called()
+
+            refresh_chat_members_count.apply(args=[-100500])
+            self.assertEqual(update_priority(parsed_update), 'high')
+            # chat size is cached
+            self.assertEqual(update_priority(parsed_update), 'high')
+            self.assertEqual(mock_post.call_count, 1)
+
+        with patch.dict(current_app.config, {'APP_PRIORITY_GROUP_MAX_MEMBERS': 100}):
+            self.assertEqual(update_priority(parsed_update), 'low')
+
+    @patch('PilosusBot.processing.telegram.post', side_effect=RequestException('Boom!'))
+    @patch('PilosusBot.processing.get_redis')
+    def test_refresh_chat_members_count_failure_cached(self, mock_redis, mock_post):
+        mock_redis.return_value = MockRedis()
+        parsed_update = {'chat_id': -100500, 'chat_type': 'supergroup'}
+
+        refresh_chat_members_count.apply(args=[-100500])
+
+        key = '{0}:-100500'.format(current_app.config['APP_CHAT_SIZE_KEY_PREFIX'])
+        self.assertEqual(mock_redis.return_value.ttl[key], current_app.config['APP_CHAT_SIZE_ERROR_TTL_SEC'])
+        with patch.dict(current_app.config, {'APP_PRIORITY_GROUP_MAX_MEMBERS': 200}), \
+                patch('PilosusBot.tasks.refresh_chat_members_count.apply_async') as mock_apply:
+            # the failure is not retried by every update from the chat
+            self.assertEqual(update_priority(parsed_update), 'low')
+            mock_apply.assert_not_called()
+
+    @patch('PilosusBot.tasks.deliver_message', return_value={'ok': True})
+    @patch('PilosusBot.tasks.select_db_sentiment', side_effect=lambda u: dict(u, text='Sentiment'))
+    @patch('PilosusBot.tasks.assess_message_score', side_effect=lambda u: dict(u, score=0.5))
+    def test_process_update(self, mock_assess, mock_select, mock_deliver):
+        parsed_update = {'chat_id': 1111111, 'reply_to_message_id': 1, 'text': 'Hello'}
+
+        result = process_update.delay(parsed_update).get(timeout=5)
+
+        self.assertEqual(result, {'ok': True})
+        mock_assess.assert_called_with(parsed_update)
+        mock_select.assert_called_with(dict(parsed_update, score=0.5))
+        mock_deliver.assert_called_with(dict(parsed_update, score=0.5, text='Sentiment'))
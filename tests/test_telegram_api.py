@@ -0,0 +1,61 @@
+import json
+import unittest
+from unittest.mock import patch
+from flask import current_app
+from PilosusBot import create_app, telegram
+from PilosusBot.telegram_api import TelegramClient, send_message_payload
+from tests.helpers import HTTP
+
+
+class TelegramClientTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.app_context.pop()
+
+    def test_init_app(self):
+        self.assertIs(current_app.extensions['telegram'], telegram)
+        self.assertEqual(telegram.pool_size, current_app.config['TELEGRAM_POOL_SIZE'])
+
+    def test_session_reused(self):
+        client = TelegramClient(self.app)
+        session = client.session
+        self.assertIs(client.session, session)
+        self.assertEqual(session.get_adapter('https://api.telegram.org')._pool_maxsize,
+                         current_app.config['TELEGRAM_POOL_SIZE'])
+
+    def test_session_recreated_after_fork(self):
+        client = TelegramClient(self.app)
+        session = client.session
+
+        with patch('PilosusBot.telegram_api.os.getpid', return_value=-1):
+            self.assertIsNot(client.session, session)
+
+        client.reset()
+        self.assertIsNot(client.session, session)
+
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
+    def test_post(self, mock_post):
+        client = TelegramClient(self.app)
+        response = client.post('sendMessage', json={'chat_id': 1, 'text': 'Hello'})
+
+        self.assertEqual(response.json()['text'], 'Hello')
+        mock_post.assert_called_with(current_app.config['TELEGRAM_URL'] + 'sendMessage',
+                                     json={'chat_id': 1, 'text': 'Hello'},
+                                     timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'])
+
+    def test_send_message_payload(self):
+        parsed_update = {'chat_id': 1111111, 'reply_to_message_id': 7, 'text': 'Привет',
+                         'parse_mode': 'HTML', 'score': 0.5, 'language': 'ru', 'level': None}
+        payload = send_message_payload(parsed_update)
+
+        self.assertIsInstance(payload, bytes)
+        self.assertEqual(json.loads(payload.decode('utf-8')),
+                         {'chat_id': 1111111, 'reply_to_message_id': 7,
+                          'text': 'Привет', 'parse_mode': 'HTML'})
+        self.assertEqual(send_message_payload({}), b'{}')
@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import patch
+from PilosusBot import create_app
+from PilosusBot import tracing
+from tests.helpers import MockRedis
+
+
+class TracingTestCase(unittest.TestCase):
+    def setUp(self):
+        """Method called before each unit-test"""
+        self.app = create_app('testing')
+        self.app.config['APP_TRACE_DISABLE'] = False
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+        self.redis = MockRedis()
+        self.redis_patcher = patch('PilosusBot.tracing.get_redis', return_value=self.redis)
+        self.redis_patcher.start()
+
+    def tearDown(self):
+        """Method called after each unit-test"""
+        self.redis_patcher.stop()
+        self.app_context.pop()
+
+    def test_trace_id_for(self):
+        self.assertEqual(tracing.trace_id_for({'update_id': 100500}), '100500')
+        self.assertIsNone(tracing.trace_id_for({'chat_id': 1}))
+        self.assertIsNone(tracing.trace_id_for(None))
+
+    def test_spans(self):
+        # no trace, no span
+        tracing.add_span('run:assess', 1000.0, 0.5)
+        self.assertEqual(tracing.traces(100), [])
+
+        with tracing.trace('1'):
+            tracing.add_span('queue:assess', 1000.0, 0.1)
+            tracing.add_span('run:assess', 1000.1, 0.5)
+            self.assertEqual(tracing.current_trace_id(), '1')
+        self.assertIsNone(tracing.current_trace_id())
+        tracing.add_span('telegram', 1001.0, 0.2, trace_id='1')
+        tracing.add_span('run:assess', 2000.0, 0.05, trace_id='2')
+
+        traces = tracing.traces(100)
+
+        self.assertEqual([t['id'] for t in traces], ['2', '1'])
+        self.assertEqual([s['name'] for s in traces[1]['spans']], ['queue:assess', 'run:assess', 'telegram'])
+        self.assertAlmostEqual(traces[1]['duration'], 1.2)
+        self.assertAlmostEqual(traces[0]['duration'], 0.05)
+
+    def test_spans_buffered_within_trace(self):
+        with patch.object(self.redis, 'pipeline', wraps=self.redis.pipeline) as mock_pipeline:
+            with tracing.trace('1'):
+                tracing.add_span('queue:assess', 1000.0, 0.1)
+                tracing.add_span('run:assess', 1000.1, 0.5)
+                tracing.add_span('telegram', 1000.6, 0.2)
+                # nothing is sent to Redis until the trace block ends
+                self.assertEqual(tracing.traces(100), [])
+
+        self.assertEqual(mock_pipeline.call_count, 1)
+        self.assertEqual([s['name'] for s in tracing.traces(100)[0]['spans']],
+                         ['queue:assess', 'run:assess', 'telegram'])
+
+    def test_stream_capped(self):
+        with patch.dict(self.app.config, {'APP_TRACE_STREAM_MAX_LEN': 2}):
+            for i in range(3):
+                tracing.add_span('run:assess', 1000.0 + i, 0.1, trace_id=str(i))
+        self.assertEqual([t['id'] for t in tracing.traces(100)], ['2', '1'])
+
+    def test_stamp_headers(self):
+        headers = {}
+        with tracing.trace('42'):
+            tracing.stamp_headers(headers=headers, body=([{'update_id': 1}], {}, {}))
+        self.assertEqual(headers['trace_id'], '42')
+        self.assertIn('enqueued_at', headers)
+
+        # outside of a trace, trace id is derived from the task's parsed update
+        headers = {}
+        tracing.stamp_headers(headers=headers, body=([{'update_id': 1}], {}, {}))
+        self.assertEqual(headers['trace_id'], '1')
@@ -6,7 +6,7 @@ from PilosusBot.models import Role, Language, Sentiment, User
 from PilosusBot.utils import download_polyglot_dicts, generate_password, to_bool, \
     map_value_from_range_to_new_range, detect_language_code, \
     is_valid_lang_code, is_valid_lang_name, lang_code_to_lang_name, \
-    score_to_closest_level, get_rough_sentiment_score
+    score_to_closest_level, get_rough_sentiment_score, score_to_level, level_to_score
 from flask import current_app
 
 
@@ -124,6 +124,17 @@ class UtilsTestCase(unittest.TestCase):
         self.assertEqual(lang_code_to_lang_name('de'), 'German')
         self.assertEqual(lang_code_to_lang_name('la'), 'Latin')
 
+    def test_score_to_level(self):
+        for score in current_app.config['APP_SCORE_LEVELS']:
+            self.assertIsInstance(score_to_level(score), int)
+            self.assertEqual(level_to_score(score_to_level(score)), score)
+
+        self.assertEqual(score_to_level(0.375), 375)
+        self.assertEqual(score_to_level(0.6250000001), 625)
+        # halves are rounded up, not to even
+        self.assertEqual(score_to_level(0.0125), 13)
+        self.assertEqual(score_to_level(0.3125), 313)
+
     def test_score_to_closest_level(self):
         lang = 'la'
         self.assertEqual(score_to_closest_level(lang, 0.63, [0.0, 0.25, 0.375, 0.5, 0.625, 0.75, 1.0]), 0.75)
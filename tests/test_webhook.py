@@ -64,7 +64,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_only_post(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.get(TelegramUpdates.URL_HANDLE_WEBHOOK)
         self.assertTrue(response.status_code == 405,
@@ -79,7 +79,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_empty_input(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.EMPTY),
@@ -92,7 +92,8 @@ class WebhooksTestCase(unittest.TestCase):
         self.assertEqual({}, json.loads(response.data),
                          'Failed to return an empty JSON for empty input')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -103,7 +104,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_bad_id_bad_text(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.TEXT_BAD_ID_BAD_TEXT),
@@ -116,7 +117,8 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty JSON for an Update with '
                          'bad reply_message_id and bad text length')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -127,7 +129,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_ok_id_bad_text(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.TEXT_OK_ID_BAD_TEXT),
@@ -140,7 +142,8 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty JSON for an Update with '
                          'bad text length')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -151,7 +154,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_bad_id_ok_text(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.TEXT_BAD_ID_OK_TEXT),
@@ -164,7 +167,8 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty JSON for an Update with '
                          'bad reply_message_id')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -175,7 +179,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_malformed_Message(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.TEXT_MALFORMED_NO_MESSAGE),
@@ -188,7 +192,8 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty JSON for an Update with '
                          'a malformed Message')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -199,7 +204,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_malformed_Chat_of_Message(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.TEXT_MALFORMED_NO_CHAT),
@@ -212,7 +217,8 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty JSON for an Update with '
                          'a malformed Chat of the Message')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -223,7 +229,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch.object(CappedCollection, 'elements', lambda *args, **kwargs: [TelegramUpdates.UPDATE_ID])
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_update_id_already_used(self, mocked_send_to_chat, mocked_celery_chain):
         # we don't need to test celery tasks in the view
         # that's objective for a separate test suite
@@ -241,7 +247,8 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty JSON for an Update with '
                          'an ID already used')
 
-        mocked_send_to_chat.apply_async.assert_called_with(args=[{}])
+        # 200 OK is the acknowledgement, no empty message is sent
+        mocked_send_to_chat.apply_async.assert_not_called()
 
         with self.assertRaises(AssertionError) as chain_err:
             mocked_celery_chain.assert_called()
@@ -252,7 +259,7 @@ class WebhooksTestCase(unittest.TestCase):
 
     @patch('PilosusBot.processing.CappedCollection', MockCappedCollection.get_mock())
     @patch('PilosusBot.webhook.views.celery_chain')
-    @patch('PilosusBot.webhook.views.send_message_to_chat')
+    @patch('PilosusBot.tasks.send_message_to_chat')
     def test_handle_valid_input(self, mocked_send_to_chat, mocked_celery_chain):
         response = self.client.post(TelegramUpdates.URL_HANDLE_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.TEXT_OK_ID_OK_TEXT),
@@ -267,9 +274,12 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an Update itself for a valid input Update')
         # watch out! parse_update eliminates Updates with message_id already processed
         # so we have to use not parsed Update here
-        mocked_update = {'chat_id': TelegramUpdates.TEXT_OK_ID_OK_TEXT['message']['chat']['id'],
+        mocked_update = {'update_id': TelegramUpdates.TEXT_OK_ID_OK_TEXT['update_id'],
+                         'chat_id': TelegramUpdates.TEXT_OK_ID_OK_TEXT['message']['chat']['id'],
+                         'chat_type': TelegramUpdates.TEXT_OK_ID_OK_TEXT['message']['chat']['type'],
                          'reply_to_message_id': TelegramUpdates.TEXT_OK_ID_OK_TEXT['message']['message_id'],
-                         'text': TelegramUpdates.TEXT_OK_ID_OK_TEXT['message']['text']}
+                         'text': TelegramUpdates.TEXT_OK_ID_OK_TEXT['message']['text'],
+                         'priority': 'high'}
         mocked_celery_chain.assert_called_with(mocked_update)
 
         with self.assertRaises(AssertionError) as send_err:
@@ -279,7 +289,7 @@ class WebhooksTestCase(unittest.TestCase):
                       str(send_err.exception))
         self.assertEqual(mocked_send_to_chat.call_args_list, [])
 
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_sethook_only_post(self, mock_requests):
         response = self.client.get(TelegramUpdates.URL_HANDLE_WEBHOOK)
         self.assertTrue(response.status_code == 405,
@@ -291,7 +301,7 @@ class WebhooksTestCase(unittest.TestCase):
         self.assertIn("Expected 'post' to have been called", str(err.exception))
         self.assertEqual(mock_requests.call_args_list, [])
 
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_sethook_not_authenticated_user(self, mock_requests):
         response = self.client.post(TelegramUpdates.URL_SET_WEBHOOK,
                                     data=json.dumps(TelegramUpdates.EMPTY),
@@ -306,7 +316,7 @@ class WebhooksTestCase(unittest.TestCase):
 
         self.assertIn("Expected 'post' to have been called", str(err.exception))
 
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_sethook_not_authenticated_user_json(self, mock_requests):
         headers = Headers()
         headers.add('Accept', 'application/json')
@@ -323,7 +333,7 @@ class WebhooksTestCase(unittest.TestCase):
                          json.loads(response.data)['error'],
                          'Failed to raise blueprint-wide 403 error.')
 
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_sethook_moderator_user(self, mock_requests):
         moderator_role = Role.query.filter_by(name='Moderator').first()
         moderator = User(email='moderator@example.com',
@@ -351,7 +361,7 @@ class WebhooksTestCase(unittest.TestCase):
         self.assertIn("Expected 'post' to have been called", str(err.exception))
 
     @patch('PilosusBot.processing.CappedCollection', new=MockCappedCollection)
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_sethook_administrator_user(self, mock_requests):
         admin_role = Role.query.filter_by(name='Administrator').first()
         admin = User(email='admin@example.com',
@@ -391,15 +401,15 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return a JSON with the URL of the Webhook handing view '
                          'for an authorized user')
         mock_requests.assert_called()
-        self.assertIn(call(files=None,
+        self.assertIn(call(current_app.config['TELEGRAM_URL'] + 'setWebhook',
+                           files=None,
                            json={'url': TelegramUpdates.URL_HANDLE_WEBHOOK,
                                  'max_connections': current_app.config['SERVER_MAX_CONNECTIONS'],
                                  'allowed_updates': []},
-                           timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'] * 60,
-                           url=current_app.config['TELEGRAM_URL'] + 'setWebhook'),
+                           timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'] * 60),
                       mock_requests.call_args_list)
 
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_unsethook_administrator_user(self, mock_requests):
         admin_role = Role.query.filter_by(name='Administrator').first()
         admin = User(email='admin@example.com',
@@ -435,15 +445,15 @@ class WebhooksTestCase(unittest.TestCase):
                          'Failed to return an empty field for the URL in JSON '
                          'when unsetting Webhook URL by the administrator user')
         mock_requests.assert_called()
-        self.assertIn(call(files=None,
+        self.assertIn(call(current_app.config['TELEGRAM_URL'] + 'setWebhook',
+                           files=None,
                            json={'url': '',
                                  'max_connections': current_app.config['SERVER_MAX_CONNECTIONS'],
                                  'allowed_updates': []},
-                           timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'] * 60,
-                           url=current_app.config['TELEGRAM_URL'] + 'setWebhook'),
+                           timeout=current_app.config['TELEGRAM_REQUEST_TIMEOUT_SEC'] * 60),
                       mock_requests.call_args_list)
 
-    @patch('requests.post', side_effect=HTTP.mocked_requests_post)
+    @patch('requests.Session.post', side_effect=HTTP.mocked_requests_post)
     def test_setwebhook_with_SSL_certificate(self, mock_requests):
         # set up SSL certificate
         tmp_cert_file = os.path.join(tempfile.gettempdir(), "SSL.cert")
@@ -484,7 +494,7 @@ class WebhooksTestCase(unittest.TestCase):
                              'with SSL certificate specified')
             mock_requests.assert_called()
 
-    @patch('requests.post')
+    @patch('requests.Session.post')
     def test_setting_webhook_with_exception_raised(self, mock_requests):
         from requests.exceptions import RequestException
         mock_requests.side_effect = RequestException('Boom!')
@@ -618,7 +628,7 @@ class WebhooksTestCase(unittest.TestCase):
                          'when unsetting Webhook URL by the '
                          'user with incorrect username')
 
-    @patch('requests.post', side_effect=ValidationError('Boom!', 400))
+    @patch('requests.Session.post', side_effect=ValidationError('Boom!', 400))
     def test_bad_request_response(self, mock_requests):
         admin_role = Role.query.filter_by(name='Administrator').first()
         admin = User(email='admin@example.com',